@@ -225,6 +225,14 @@ class Config:
                 "autoclear_downloads": False,
                 "autoclear_uploads": False,
                 "rescanonstartup": True,
+                "scanner_workers": 1,
+                "incremental_rescan": False,
+                "hash_shared_files": False,
+                "scanner_low_priority": False,
+                "scanner_max_read_speed": 0,
+                "scanner_max_files_per_second": 0,
+                "scanner_memory_limit": 256,
+                "watch_shares": False,
                 "enablefilters": False,
                 "downloadregexp": "",
                 "downloadfilters": [
@@ -318,7 +326,10 @@ class Config:
                 "search_results": True,
                 "max_displayed_results": 2500,
                 "min_search_chars": 3,
-                "private_search_results": False
+                "private_search_results": False,
+                "max_user_search_requests": 0,
+                "max_search_requests": 0,
+                "max_search_response_speed": 0
             },
             "ui": {
                 "language": "",
@@ -432,7 +443,10 @@ class Config:
                 "downloaded_size": 0,
                 "started_uploads": 0,
                 "completed_uploads": 0,
-                "uploaded_size": 0
+                "uploaded_size": 0,
+                "processed_search_requests": 0,
+                "rejected_search_requests": 0,
+                "dropped_search_requests": 0
             }
         }
 
@@ -149,9 +149,11 @@ EVENT_NAMES = {
     "shared-file-list-progress",
     "shared-file-list-request",
     "shared-file-list-response",
+    "shares-initialized",
     "shares-preparing",
     "shares-ready",
     "shares-scanning",
+    "shares-updated",
     "shares-unavailable",
     "user-browse-remove-user",
     "user-browse-show-user",
@@ -40,6 +40,12 @@ class Statistics(Dialog):
             self.current_session_label,
             self.downloaded_size_session_label,
             self.downloaded_size_total_label,
+            self.dropped_search_requests_session_label,
+            self.dropped_search_requests_total_label,
+            self.processed_search_requests_session_label,
+            self.processed_search_requests_total_label,
+            self.rejected_search_requests_session_label,
+            self.rejected_search_requests_total_label,
             self.reset_button,
             self.since_timestamp_total_label,
             self.uploaded_size_session_label,
@@ -63,6 +69,18 @@ class Statistics(Dialog):
                 "session": self.uploaded_size_session_label,
                 "total": self.uploaded_size_total_label
             },
+            "dropped_search_requests": {
+                "session": self.dropped_search_requests_session_label,
+                "total": self.dropped_search_requests_total_label
+            },
+            "processed_search_requests": {
+                "session": self.processed_search_requests_session_label,
+                "total": self.processed_search_requests_total_label
+            },
+            "rejected_search_requests": {
+                "session": self.rejected_search_requests_session_label,
+                "total": self.rejected_search_requests_total_label
+            },
             "since_timestamp": {
                 "total": self.since_timestamp_total_label
             }
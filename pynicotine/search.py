@@ -21,17 +21,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from itertools import islice
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections import OrderedDict
+from heapq import merge as heapq_merge
 import json
 import logging
 from operator import itemgetter
+import re
 from shlex import shlex
+from threading import Condition
+from threading import Lock
+from threading import Thread
+import time
 
 from pynicotine.config import config
 from pynicotine.core import core
 from pynicotine.events import events
 from pynicotine.logfacility import log
 from pynicotine.shares import PermissionLevel
+from pynicotine.shares import WordIndexDatabase
 from pynicotine.slskmessages import FileSearch
 from pynicotine.slskmessages import FileSearchResponse
 from pynicotine.slskmessages import increment_token
@@ -62,11 +72,59 @@ class SearchRequest:
         self.is_ignored = is_ignored
 
 
+class TokenBucket:
+    """Limits the rate of an action. Tokens are added at a fixed rate per
+    second, up to a capacity that allows short bursts."""
+
+    __slots__ = ("rate", "capacity", "tokens", "last_time")
+
+    def __init__(self, rate, capacity=None):
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+
+    def refill(self):
+
+        current_time = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + ((current_time - self.last_time) * self.rate))
+        self.last_time = current_time
+
+        return self.tokens
+
+    def consume(self, amount=1):
+        """Remove tokens if enough of them are available. Returns False
+        otherwise."""
+
+        if self.refill() < amount:
+            return False
+
+        self.tokens -= amount
+        return True
+
+    def spend(self, amount):
+        """Remove tokens for an action that already happened. Tokens can go
+        below zero, delaying future actions."""
+
+        self.refill()
+        self.tokens -= amount
+
+
 class Search:
-    __slots__ = ("searches", "excluded_phrases", "token", "wishlist_interval", "_own_tokens",
-                 "_wishlist_timer_id")
+    __slots__ = ("searches", "token", "wishlist_interval", "_own_tokens",
+                 "_wishlist_timer_id", "_search_response_cache", "_search_response_cache_lock",
+                 "_search_response_cache_generation", "_search_requests", "_search_request_condition",
+                 "_search_request_thread", "_excluded_phrases", "_excluded_phrase_pattern",
+                 "_user_search_request_buckets", "_search_request_bucket", "_search_response_bucket",
+                 "_search_request_stats", "_search_request_stats_timer_id")
 
     SEARCH_HISTORY_LIMIT = 200
+    SEARCH_RESPONSE_CACHE_LIMIT = 250
+    SEARCH_REQUEST_QUEUE_LIMIT = 100
+    USER_SEARCH_REQUEST_BUCKET_LIMIT = 2000
+    SEARCH_REQUEST_STATS_INTERVAL = 10
+    MAX_GROUP_INDEX_LISTS = 4
     RESULT_FILTER_HISTORY_LIMIT = 50
     REMOVED_SEARCH_CHARACTERS = [
         "!", '"', "#", "$", "%", "&", "'", "(", ")", "*", "+", ",", "-", ".", "/", ":", ";",
@@ -78,11 +136,24 @@ class Search:
     def __init__(self):
 
         self.searches = {}
-        self.excluded_phrases = []
+        self._excluded_phrases = []
+        self._excluded_phrase_pattern = None
         self.token = initial_token()
         self.wishlist_interval = 0
         self._own_tokens = set()
         self._wishlist_timer_id = None
+        self._search_response_cache = OrderedDict()
+        self._search_response_cache_lock = Lock()
+        self._search_response_cache_generation = 0
+        self._search_requests = deque(maxlen=self.SEARCH_REQUEST_QUEUE_LIMIT)
+        self._search_request_condition = Condition()
+        self._search_request_thread = None
+        self._user_search_request_buckets = OrderedDict()
+        self._search_request_bucket = None
+        self._search_response_bucket = None
+        self._search_request_stats = dict.fromkeys(
+            ("processed_search_requests", "rejected_search_requests", "dropped_search_requests"), 0)
+        self._search_request_stats_timer_id = None
 
         for event_name, callback in (
             ("excluded-search-phrases", self._excluded_search_phrases),
@@ -93,37 +164,59 @@ class Search:
             ("server-disconnect", self._server_disconnect),
             ("server-login", self._server_login),
             ("set-wishlist-interval", self._set_wishlist_interval),
+            ("shares-ready", self._shares_ready),
+            ("shares-updated", self._shares_updated),
             ("start", self._start)
         ):
             events.connect(event_name, callback)
 
     def _start(self):
 
+        self._search_request_thread = Thread(
+            target=self._run_search_request_thread, name="SearchRequestThread", daemon=True)
+        self._search_request_thread.start()
+
         # Create wishlist searches
         for search_term in config.sections["server"]["autosearch"]:
             self.token = increment_token(self.token)
             self.add_search(search_term, mode="wishlist", is_ignored=True)
 
     def _quit(self):
+
         self.remove_all_searches()
 
+        with self._search_request_condition:
+            self._search_requests.clear()
+            self._search_request_thread = None
+            self._search_request_condition.notify()
+
+        self._clear_search_response_cache()
+
     def _server_login(self, msg):
 
         if not msg.success:
             return
 
+        self._search_request_stats_timer_id = events.schedule(
+            delay=self.SEARCH_REQUEST_STATS_INTERVAL, callback=self._update_search_request_stats, repeat=True)
+
         if not config.sections["searches"]["search_results"]:
             log.add_search(("Search responses disabled in preferences, ignoring search "
                             "requests from other users"))
 
     def _server_disconnect(self, _msg):
 
-        self.excluded_phrases.clear()
+        self.excluded_phrases = []
         self._own_tokens.clear()
+        self._user_search_request_buckets.clear()
+        self._clear_search_response_cache()
 
         events.cancel_scheduled(self._wishlist_timer_id)
         self.wishlist_interval = 0
 
+        events.cancel_scheduled(self._search_request_stats_timer_id)
+        self._update_search_request_stats()
+
     # Outgoing Search Requests #
 
     @staticmethod
@@ -434,6 +527,8 @@ class Search:
             log.add_search("Previous list of excluded search phrases: %s", self.excluded_phrases)
 
         self.excluded_phrases = msg.phrases
+        self._clear_search_response_cache()
+
         log.add_search("Server provided %(num_phrases)s excluded search phrase(s): %(phrases)s", {
             "num_phrases": len(msg.phrases),
             "phrases": str(msg.phrases)
@@ -479,25 +574,113 @@ class Search:
 
     # Incoming Search Requests #
 
+    def _shares_ready(self, _successful):
+        self._clear_search_response_cache()
+
+    def _shares_updated(self):
+        self._clear_search_response_cache()
+
+    def _clear_search_response_cache(self):
+
+        with self._search_response_cache_lock:
+            self._search_response_cache.clear()
+            self._search_response_cache_generation += 1
+
+    def _get_search_response(self, included_words, excluded_words, partial_words, max_results, permission_level):
+        """Returns the number of results and compressed result lists for a
+        search term. Popular search terms are requested by many users, so
+        responses for recent search terms are cached until shares change."""
+
+        cache_key = (
+            frozenset(included_words), frozenset(excluded_words), frozenset(partial_words), max_results,
+            permission_level, config.sections["transfers"]["reveal_buddy_shares"],
+            config.sections["transfers"]["reveal_trusted_shares"]
+        )
+
+        with self._search_response_cache_lock:
+            cached_response = self._search_response_cache.get(cache_key)
+            cache_generation = self._search_response_cache_generation
+
+            if cached_response is not None:
+                self._search_response_cache.move_to_end(cache_key)
+                return cached_response
+
+        compressed_lists = None
+
+        # Shares are closed or patched in the main thread, e.g. when rescanning
+        with core.shares.share_dbs_lock:
+            word_index = core.shares.share_dbs.get("words")
+
+            if word_index is None:
+                return 0, None
+
+            word_suffixes = core.shares.share_dbs.get("word_suffixes")
+
+            # Find common file matches for each word in search term, until enough of them can be sent
+            results = self._iter_search_results(
+                included_words, excluded_words, partial_words, word_index, word_suffixes)
+            num_results, fileinfos, private_fileinfos = self._create_file_info_list(
+                results, max_results, permission_level)
+
+        if num_results:
+            compressed_lists = FileSearchResponse.compress_result_lists(fileinfos, private_fileinfos)
+
+        search_response = (num_results, compressed_lists)
+
+        with self._search_response_cache_lock:
+            if cache_generation != self._search_response_cache_generation:
+                # Shares changed while matching, don't cache outdated results
+                return search_response
+
+            self._search_response_cache[cache_key] = search_response
+
+            if len(self._search_response_cache) > self.SEARCH_RESPONSE_CACHE_LIMIT:
+                self._search_response_cache.popitem(last=False)
+
+        return search_response
+
+    @property
+    def excluded_phrases(self):
+        return self._excluded_phrases
+
+    @excluded_phrases.setter
+    def excluded_phrases(self, phrases):
+        """Combine phrases excluded from the search network into a single
+        pattern, to check file paths for all phrases at once."""
+
+        self._excluded_phrases = phrases
+        self._excluded_phrase_pattern = None
+
+        # Longer phrases first, in case a phrase starts with another one
+        phrases = sorted({phrase for phrase in phrases if phrase}, key=len, reverse=True)
+
+        if phrases:
+            self._excluded_phrase_pattern = re.compile("|".join(re.escape(phrase) for phrase in phrases))
+
     def _append_file_info(self, file_list, fileinfo):
 
-        file_path, *_unused = fileinfo
-        file_path_lower = file_path.lower()
-        excluded_phrase = next((phrase for phrase in self.excluded_phrases if phrase in file_path_lower), None)
+        excluded_phrase_pattern = self._excluded_phrase_pattern
 
         # Check if file path contains phrase excluded from the search network
-        if excluded_phrase:
-            log.add_search(('Excluding file %(file)s from search response because server '
-                            'disallowed phrase "%(phrase)s"'), {
-                "file": file_path,
-                "phrase": excluded_phrase
-            })
-            return
+        if excluded_phrase_pattern is not None:
+            file_path, *_unused = fileinfo
+            excluded_phrase = excluded_phrase_pattern.search(file_path.lower())
+
+            if excluded_phrase is not None:
+                log.add_search(('Excluding file %(file)s from search response because server '
+                                'disallowed phrase "%(phrase)s"'), {
+                    "file": file_path,
+                    "phrase": excluded_phrase.group()
+                })
+                return False
 
         file_list.append(fileinfo)
+        return True
 
     def _create_file_info_list(self, results, max_results, permission_level):
-        """Given a list of file indices, retrieve the file information for each index."""
+        """Given file indices, retrieve the file information for each index.
+        File indices are checked in order, until max_results files visible
+        to the permission level are found."""
 
         reveal_buddy_shares = config.sections["transfers"]["reveal_buddy_shares"]
         reveal_trusted_shares = config.sections["transfers"]["reveal_trusted_shares"]
@@ -508,35 +691,45 @@ class Search:
         private_fileinfos = []
         num_fileinfos = 0
 
+        if max_results <= 0:
+            return num_fileinfos, fileinfos, private_fileinfos
+
+        file_path_index = core.shares.file_path_index
         public_files = core.shares.share_dbs["public_files"]
-        buddy_files = core.shares.share_dbs["buddy_files"]
-        trusted_files = core.shares.share_dbs["trusted_files"]
+        buddy_files = core.shares.share_dbs["buddy_files"] if is_buddy or reveal_buddy_shares else {}
+        trusted_files = core.shares.share_dbs["trusted_files"] if is_trusted or reveal_trusted_shares else {}
 
-        for index in islice(results, min(len(results), max_results)):
-            file_path = core.shares.file_path_index[index]
+        for index in results:
+            file_path = file_path_index[index]
 
-            if file_path in public_files:
-                self._append_file_info(fileinfos, public_files[file_path])
+            if file_path is None:
                 continue
 
-            if (is_buddy or reveal_buddy_shares) and file_path in buddy_files:
-                fileinfo = buddy_files[file_path]
+            fileinfo = public_files.get(file_path)
+            file_list = fileinfos
 
-                if is_buddy:
-                    self._append_file_info(fileinfos, fileinfo)
-                else:
-                    self._append_file_info(private_fileinfos, fileinfo)
-                continue
+            if fileinfo is None:
+                fileinfo = buddy_files.get(file_path)
 
-            if (is_trusted or reveal_trusted_shares) and file_path in trusted_files:
-                fileinfo = trusted_files[file_path]
+                if fileinfo is None:
+                    fileinfo = trusted_files.get(file_path)
 
-                if is_trusted:
-                    self._append_file_info(fileinfos, fileinfo)
-                else:
-                    self._append_file_info(private_fileinfos, fileinfo)
+                    if fileinfo is None:
+                        continue
 
-        results.clear()
+                    if not is_trusted:
+                        file_list = private_fileinfos
+
+                elif not is_buddy:
+                    file_list = private_fileinfos
+
+            if not self._append_file_info(file_list, fileinfo):
+                continue
+
+            num_fileinfos += 1
+
+            if num_fileinfos >= max_results:
+                break
 
         if fileinfos:
             fileinfos.sort(key=itemgetter(0))
@@ -544,112 +737,162 @@ class Search:
         if private_fileinfos:
             private_fileinfos.sort(key=itemgetter(0))
 
-        num_fileinfos = len(fileinfos) + len(private_fileinfos)
         return num_fileinfos, fileinfos, private_fileinfos
 
     @staticmethod
-    def _update_search_results(results, word_indices, excluded=False):
-        """Updates the search result list with indices for a new word."""
+    def _seek_file_index(indices, position, file_index):
+        """Returns the position of the first index not lower than file_index
+        in a sorted list of file indices, starting at a previous position.
+        Galloping search is used, since positions only move forward."""
 
-        if not word_indices:
-            if excluded:
-                # We don't care if an excluded word doesn't exist in our DB
-                return results
+        num_indices = len(indices)
+        low = high = position
+        step = 1
 
-            # Included word does not exist in our DB, no results
-            return set()
+        while high < num_indices and indices[high] < file_index:
+            low = high + 1
+            high += step
+            step <<= 1
 
-        if results is None:
-            if excluded:
-                # No results yet, but word is excluded. Bail.
-                return set()
+        return bisect_left(indices, file_index, low, min(high, num_indices))
 
-            # First match for included word, return results
-            return set(word_indices)
+    @staticmethod
+    def _iter_unique_file_indices(index_lists):
+        """Merge sorted lists of file indices, skipping duplicates."""
 
-        if excluded:
-            # Remove results for excluded word
-            results.difference_update(word_indices)
-        else:
-            # Only retain common results for all words so far
-            results.intersection_update(word_indices)
+        if len(index_lists) == 1:
+            yield from index_lists[0]
+            return
 
-        return results
+        previous_file_index = None
 
-    def _create_search_result_list(self, included_words, excluded_words, partial_words, max_results, word_index):
-        """Returns a list of common file indices for each word in a search
-        term."""
+        for file_index in heapq_merge(*index_lists):
+            if file_index != previous_file_index:
+                yield file_index
+                previous_file_index = file_index
 
-        results = None
+    @staticmethod
+    def _get_word_index_lists(word_index, word):
+        """Returns sorted lists of file indices of a word. Files shared after
+        loading the word index are kept in a separate list."""
+
+        if isinstance(word_index, WordIndexDatabase):
+            return word_index.get_index_lists(word)
+
+        indices = word_index.get(word)
+        return (indices,) if indices else ()
+
+    @staticmethod
+    def _iter_partial_word_matches(partial_word, word_index, word_suffixes=None):
+
+        if word_suffixes is not None:
+            # Binary search in sorted reversed words, instead of checking every word
+            yield from word_suffixes.iter_words_ending_with(partial_word)
+            return
+
+        partial_word_len = len(partial_word)
+
+        for complete_word in word_index:
+            if len(complete_word) >= partial_word_len and complete_word.endswith(partial_word):
+                yield complete_word
+
+    def _iter_search_results(self, included_words, excluded_words, partial_words, word_index, word_suffixes=None):
+        """Yields common file indices for each word in a search term, in
+        ascending order.
+
+        All index lists are sorted. File indices of the word with the
+        fewest matches are checked against the other words. Matching
+        stops once the caller has accepted enough results.
+        """
+
+        # Each group contains the index lists of a word, or of all words matching a partial word
+        included_groups = []
+
+        get_word_index_lists = self._get_word_index_lists
 
         for word in included_words:
-            if word not in word_index:
+            index_lists = get_word_index_lists(word_index, word)
+
+            if not index_lists:
                 # No results
-                return results
+                return
 
-        start_word = next(iter(included_words), None)
-        has_single_word = (sum(len(words) for words in (included_words, excluded_words, partial_words)) == 1)
-        included_words.discard(start_word)
+            included_groups.append(index_lists)
 
         # Partial search words (e.g. *ello)
         for partial_word in partial_words:
-            partial_word_len = len(partial_word)
-            partial_results = set()
-            num_partial_results = 0
+            index_lists = tuple(
+                indices
+                for complete_word in self._iter_partial_word_matches(partial_word, word_index, word_suffixes)
+                for indices in get_word_index_lists(word_index, complete_word)
+            )
 
-            for complete_word in word_index:
-                if len(complete_word) < partial_word_len or not complete_word.endswith(partial_word):
-                    continue
+            if not index_lists:
+                return
 
-                indices = word_index[complete_word]
+            included_groups.append(index_lists)
 
-                if has_single_word:
-                    # Attempt to avoid large memory usage if someone searches for e.g. "*lac"
-                    indices = indices[:max_results - num_partial_results]
+        if not included_groups:
+            return
 
-                partial_results.update(indices)
+        included_groups.sort(key=lambda index_lists: sum(len(indices) for indices in index_lists))
+        rarest_group, *included_groups = included_groups
 
-                if not has_single_word:
-                    continue
+        for group_id, group_index_lists in enumerate(included_groups):
+            if len(group_index_lists) > self.MAX_GROUP_INDEX_LISTS:
+                # Merge index lists of partial words matching many words once, instead of
+                # seeking in every list for each file index of the rarest group
+                included_groups[group_id] = (
+                    array(WordIndexDatabase.ARRAY_TYPECODE, self._iter_unique_file_indices(group_index_lists)),
+                )
 
-                num_partial_results = len(partial_results)
+        # Excluded search words (e.g. -hello)
+        excluded_index_lists = [
+            indices for word in excluded_words for indices in get_word_index_lists(word_index, word)]
+        num_excluded_lists = len(excluded_index_lists)
 
-                if num_partial_results >= max_results:
-                    break
+        # Flatten remaining index lists, keeping track of the group each list belongs to
+        index_lists = excluded_index_lists[:]
+        group_ids = [None] * num_excluded_lists
 
-            if not partial_results:
-                return None
+        for group_id, group_index_lists in enumerate(included_groups):
+            index_lists.extend(group_index_lists)
+            group_ids.extend([group_id] * len(group_index_lists))
 
-            results = self._update_search_results(results, partial_results)
+        positions = [0] * len(index_lists)
+        num_groups = len(included_groups)
+        is_single_list_group = [len(group_index_lists) == 1 for group_index_lists in included_groups]
+        seek_file_index = self._seek_file_index
 
-        # Included search words (e.g. hello)
-        if start_word:
-            start_results = word_index[start_word]
+        for file_index in self._iter_unique_file_indices(rarest_group):
+            is_excluded = False
+            matched_groups = set()
 
-            if has_single_word:
-                # Attempt to avoid large memory usage if someone searches for e.g. "flac"
-                start_results = start_results[:max_results]
+            for list_id, indices in enumerate(index_lists):
+                group_id = group_ids[list_id]
 
-            results = self._update_search_results(results, start_results)
+                if group_id in matched_groups:
+                    continue
 
-            for included_word in included_words:
-                if included_word not in word_index:
-                    return None
+                position = positions[list_id] = seek_file_index(indices, positions[list_id], file_index)
 
-                results = self._update_search_results(results, word_index[included_word])
+                if position >= len(indices) or indices[position] != file_index:
+                    if group_id is not None and is_single_list_group[group_id]:
+                        # Word does not match this file, skip remaining checks
+                        break
 
-        # Excluded search words (e.g. -hello)
-        if results:
-            for excluded_word in excluded_words:
-                if excluded_word not in word_index:
                     continue
 
-                results = self._update_search_results(results, word_index[excluded_word], excluded=True)
+                if list_id < num_excluded_lists:
+                    is_excluded = True
+                    break
+
+                matched_groups.add(group_id)
 
-        if not results:
-            return None
+            if is_excluded or len(matched_groups) < num_groups:
+                continue
 
-        return results
+            yield file_index
 
     def _process_search_request(self, search_term, username, token):
         """This section is accessed every time a search request arrives,
@@ -696,9 +939,8 @@ class Search:
         if "words" not in core.shares.share_dbs:
             return
 
-        word_index = core.shares.share_dbs["words"]
         original_search_term = search_term
-        search_term = search_term.lower()
+        search_term = WordIndexDatabase.word_normalizer.normalize(search_term)
 
         # Extract included/excluded/partial words from search term
         excluded_words = set()
@@ -725,29 +967,134 @@ class Search:
         # Strip punctuation
         search_term = search_term.translate(TRANSLATE_PUNCTUATION).strip()
         included_words = (set(search_term.split()) - excluded_words - partial_words)
+        word_filter = core.shares.share_dbs.get("word_filter")
+
+        if word_filter is not None:
+            for word in included_words:
+                if word not in word_filter:
+                    # Word is definitely not shared, no need to look for matches or limit the request
+                    self._search_request_stats["rejected_search_requests"] += 1
+                    return
+
+        if username != local_username and not self._is_search_request_allowed(username):
+            self._search_request_stats["dropped_search_requests"] += 1
+            return
 
-        # Find common file matches for each word in search term
-        results = self._create_search_result_list(
-            included_words, excluded_words, partial_words, max_results, word_index)
+        self._search_request_stats["processed_search_requests"] += 1
+        self._queue_search_request((
+            included_words, excluded_words, partial_words, max_results, permission_level,
+            username, token, original_search_term
+        ))
+
+    def _update_search_request_stats(self):
+        """Search requests can arrive several times per second, update their
+        statistics periodically instead of for every request."""
+
+        search_request_stats = self._search_request_stats
+
+        for stat_id, stat_value in search_request_stats.items():
+            if stat_value:
+                core.statistics.append_stat_value(stat_id, stat_value)
+                search_request_stats[stat_id] = 0
+
+    def _is_search_request_allowed(self, username):
+        """Limit the number of search requests we respond to, per user and in
+        total, as well as the upload speed of search responses. Protects CPU
+        usage and upload bandwidth when receiving a large number of search
+        requests."""
+
+        max_user_requests = config.sections["searches"]["max_user_search_requests"]  # Per minute
+        max_requests = config.sections["searches"]["max_search_requests"]              # Per second
+        max_response_speed = config.sections["searches"]["max_search_response_speed"] * 1024
+
+        if max_response_speed <= 0:
+            self._search_response_bucket = None
+
+        else:
+            if self._search_response_bucket is None or self._search_response_bucket.rate != max_response_speed:
+                self._search_response_bucket = TokenBucket(max_response_speed)
+
+            if self._search_response_bucket.refill() <= 0:
+                # Previous search responses used up the upload speed limit
+                return False
+
+        if max_user_requests > 0:
+            user_buckets = self._user_search_request_buckets
+            user_bucket = user_buckets.get(username)
+
+            if user_bucket is None or user_bucket.capacity != max_user_requests:
+                user_bucket = user_buckets[username] = TokenBucket(max_user_requests / 60, max_user_requests)
+
+                if len(user_buckets) > self.USER_SEARCH_REQUEST_BUCKET_LIMIT:
+                    user_buckets.popitem(last=False)
+
+            user_buckets.move_to_end(username)
+
+            if not user_bucket.consume():
+                return False
 
-        if not results:
+        if max_requests <= 0:
+            self._search_request_bucket = None
+            return True
+
+        if self._search_request_bucket is None or self._search_request_bucket.rate != max_requests:
+            self._search_request_bucket = TokenBucket(max_requests)
+
+        return self._search_request_bucket.consume()
+
+    def _queue_search_request(self, search_request):
+
+        if self._search_request_thread is None:
+            self._process_queued_search_request(*search_request)
             return
 
-        # Get file information for each file index in result list
-        num_results, fileinfos, private_fileinfos = self._create_file_info_list(
-            results, max_results, permission_level)
+        # Match search requests in a separate thread. If requests arrive faster than
+        # they are processed, the oldest ones are dropped.
+        with self._search_request_condition:
+            if len(self._search_requests) >= self.SEARCH_REQUEST_QUEUE_LIMIT:
+                log.add_search("Search request queue is full, dropping oldest search request")
+
+            self._search_requests.append(search_request)
+            self._search_request_condition.notify()
+
+    def _run_search_request_thread(self):
+
+        while True:
+            with self._search_request_condition:
+                while not self._search_requests:
+                    if self._search_request_thread is None:
+                        return
+
+                    self._search_request_condition.wait()
+
+                search_request = self._search_requests.popleft()
+
+            self._process_queued_search_request(*search_request)
+
+    def _process_queued_search_request(self, included_words, excluded_words, partial_words, max_results,
+                                       permission_level, username, token, original_search_term):
+
+        num_results, compressed_lists = self._get_search_response(
+            included_words, excluded_words, partial_words, max_results, permission_level)
 
         if not num_results:
             return
 
+        events.invoke_main_thread(
+            self._send_search_response, username, token, num_results, compressed_lists, original_search_term)
+
+    def _send_search_response(self, username, token, num_results, compressed_lists, original_search_term):
+
+        if self._search_response_bucket is not None:
+            self._search_response_bucket.spend(sum(len(segment.data) for segment in compressed_lists))
+
         core.send_message_to_peer(username, FileSearchResponse(
-            search_username=local_username,
+            search_username=core.users.login_username,
             token=token,
-            shares=fileinfos,
             freeulslots=core.uploads.is_new_upload_accepted(),
             ulspeed=core.uploads.upload_speed,
             inqueue=core.uploads.get_upload_queue_size(username),
-            private_shares=private_fileinfos
+            compressed_lists=compressed_lists
         ))
 
         log.add_search(_('User %(user)s is searching for "%(query)s", found %(num)i results'), {
@@ -21,22 +21,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import gc
+import heapq
 import mmap
 import os
 import stat
 import sys
 import time
+import unicodedata
+import zlib
 
+from array import array
+from bisect import bisect_left
+from bisect import insort
 from collections import defaultdict
 from collections import deque
+from functools import partial
+from hashlib import blake2b
+from io import BytesIO
 from itertools import chain
-from os import SEEK_END
-from os import SEEK_SET
+from itertools import groupby
+from operator import itemgetter
 from pickle import HIGHEST_PROTOCOL
 from pickle import dumps
 from pickle import Unpickler
 from pickle import UnpicklingError
+from re import compile as re_compile
 from struct import Struct
+from threading import Lock
 from threading import Thread
 
 from pynicotine import rename_process
@@ -48,6 +59,7 @@ from pynicotine.logfacility import log
 from pynicotine.slskmessages import FileListMessage
 from pynicotine.slskmessages import FolderContentsResponse
 from pynicotine.slskmessages import GetUserStats
+from pynicotine.slskmessages import PackedFileInfo
 from pynicotine.slskmessages import SharedFileListResponse
 from pynicotine.slskmessages import SharedFoldersFiles
 from pynicotine.utils import TRANSLATE_PUNCTUATION
@@ -105,437 +117,1773 @@ class DatabaseError(Exception):
     pass
 
 
+_REMOVED = object()
+
+
 class Database:
-    """Custom key-value database format for Nicotine+ shares."""
+    """Custom key-value database format for Nicotine+ shares.
+
+    Records are followed by a hash table of record offsets, written when
+    the database is closed. Keys are looked up in the memory-mapped table,
+    without loading them into memory when opening the database.
+
+    Databases opened for reading can be patched in memory, without
+    modifying the file on disk.
+    """
 
-    __slots__ = ("_value_offsets", "_file_handle", "_file_offset", "_overwrite")
+    __slots__ = ("_file_handle", "_file_offset", "_overwrite", "_patched_values", "_num_keys",
+                 "_key_hashes", "_record_offsets", "_slots", "_records_end_offset")
 
     FILE_SIGNATURE = b"DBN+"
-    VERSION = 3
+    VERSION = 4
+    HEADER_SIZE = 5
     LENGTH_DATA_SIZE = 8
     PACK_LENGTHS = Struct("!II").pack
     UNPACK_LENGTHS = Struct("!II").unpack_from
+    TRAILER_SIGNATURE = b"DBNI"
+    TRAILER_SIZE = 28
+    PACK_TRAILER = Struct("!QQQ4s").pack
+    UNPACK_TRAILER = Struct("!QQQ4s").unpack_from
+    SLOT_TYPECODE = "Q"
+    SLOT_SIZE = 8
     PICKLE_PROTOCOL = min(HIGHEST_PROTOCOL, 5)  # Use version 5 when available
 
     def __init__(self, file_path, overwrite=True):
 
         folder_path = os.path.dirname(file_path)
-        mode = "ab+" if overwrite else "rb"
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
-        if overwrite and os.path.exists(file_path):
-            os.remove(file_path)
-
-        self._value_offsets = self._load_value_offsets(file_path, mode)
+        self._file_handle = None
+        self._file_offset = 0
+        self._overwrite = overwrite
+        self._patched_values = {}
+        self._num_keys = 0
+        self._key_hashes = array("I")
+        self._record_offsets = array(self.SLOT_TYPECODE)
+        self._slots = ()
+        self._records_end_offset = 0
 
         if overwrite:
-            self._file_handle = open(file_path, mode)  # pylint: disable=consider-using-with
-        else:
-            with open(file_path, mode) as file_handle:
-                self._file_handle = mmap.mmap(file_handle.fileno(), length=0, access=mmap.ACCESS_READ)
+            self._file_handle = open(file_path, "wb")  # pylint: disable=consider-using-with
+            self._file_handle.write(self._get_header())
+            self._file_offset = self._file_handle.tell()
+            return
 
-        self._file_offset = self._file_handle.seek(0, SEEK_END)
-        self._overwrite = overwrite
+        with open(file_path, "rb") as file_handle:
+            self._file_handle = mmap.mmap(file_handle.fileno(), length=0, access=mmap.ACCESS_READ)
+
+        try:
+            self._load_slots(len(self._file_handle))
 
-    def _parse_content(self, content, total_size):
+        except Exception:
+            self.close()
+            raise
+
+    def _get_header(self):
+        return self.FILE_SIGNATURE + bytes([self.VERSION])
 
-        value_offsets = {}
-        file_signature_length = len(self.FILE_SIGNATURE)
+    def _load_slots(self, file_size):
 
-        if content[:file_signature_length] != self.FILE_SIGNATURE:
+        content = self._file_handle
+        header_size = self.HEADER_SIZE
+
+        if file_size < header_size or content[:len(self.FILE_SIGNATURE)] != self.FILE_SIGNATURE:
             raise DatabaseError("Not a database file")
 
-        if content[file_signature_length:file_signature_length + 1][0] != self.VERSION:
+        if content[:header_size] != self._get_header():
             raise DatabaseError("Incompatible version")
 
-        current_offset = (file_signature_length + 1)
+        trailer_offset = (file_size - self.TRAILER_SIZE)
+
+        if trailer_offset < header_size:
+            raise DatabaseError("Incomplete database file")
+
+        slots_offset, num_slots, num_keys, trailer_signature = self.UNPACK_TRAILER(content, trailer_offset)
+
+        if (trailer_signature != self.TRAILER_SIGNATURE or slots_offset < header_size
+                or slots_offset + (num_slots * self.SLOT_SIZE) != trailer_offset):
+            raise DatabaseError("Incomplete database file")
+
+        self._slots = memoryview(content)[slots_offset:trailer_offset].cast(self.SLOT_TYPECODE)
+        self._records_end_offset = slots_offset
+        self._num_keys = num_keys
+
+    @staticmethod
+    def _hash_key(encoded_key):
+        return zlib.crc32(encoded_key)
+
+    def _find_value(self, key):
+        """Returns the offset and length of a value stored on disk, or None
+        if the key is not present in the file."""
+
+        slots = self._slots
+        num_slots = len(slots)
+
+        if not num_slots:
+            return None
+
+        content = self._file_handle
+        encoded_key = key.encode("utf-8")
+        key_length = len(encoded_key)
+        slot_mask = (num_slots - 1)
+        slot_index = (self._hash_key(encoded_key) & slot_mask)
+
+        while True:
+            record_offset = slots[slot_index]
+
+            if not record_offset:
+                return None
+
+            key_offset = (record_offset + self.LENGTH_DATA_SIZE)
+            stored_key_length, value_length = self.UNPACK_LENGTHS(content, record_offset)
+
+            if stored_key_length == key_length and content[key_offset:key_offset + key_length] == encoded_key:
+                return (key_offset + key_length), value_length
 
-        while current_offset < total_size:
+            slot_index = ((slot_index + 1) & slot_mask)
+
+    def _iter_records(self):
+        """Yields the key, value offset and value length of each record
+        stored on disk, in the order they were written."""
+
+        content = self._file_handle
+        current_offset = self.HEADER_SIZE
+        records_end_offset = self._records_end_offset
+
+        while current_offset < records_end_offset:
             key_offset = (current_offset + self.LENGTH_DATA_SIZE)
-            key_length, value_length = self.UNPACK_LENGTHS(content[current_offset:key_offset])
+            key_length, value_length = self.UNPACK_LENGTHS(content, current_offset)
             value_offset = (key_offset + key_length)
-            key = content[key_offset:value_offset].tobytes().decode("utf-8")
 
-            value_offsets[key] = value_offset
+            yield content[key_offset:value_offset].decode("utf-8"), value_offset, value_length
             current_offset = (value_offset + value_length)
 
-        return value_offsets
+    def __contains__(self, key):
 
-    def _load_value_offsets(self, file_path, mode):
+        if key in self._patched_values:
+            return self._patched_values[key] is not _REMOVED
 
-        value_offsets = {}
+        return self._find_value(key) is not None
 
-        with open(file_path, mode) as file_handle:  # pylint: disable=unspecified-encoding
-            file_size = os.fstat(file_handle.fileno()).st_size
+    def __iter__(self):
 
-            if not file_size:
-                file_handle.write(self.FILE_SIGNATURE)
-                file_handle.write(bytes([self.VERSION]))
-                return value_offsets
+        for key, _value in self._iter_items(read_values=False):
+            yield key
 
-            file_handle.seek(0)
+    def _iter_items(self, read_values=True):
 
-            with mmap.mmap(file_handle.fileno(), length=0, access=mmap.ACCESS_READ) as content:
-                value_offsets = self._parse_content(memoryview(content), file_size)
+        patched_values = self._patched_values
 
-        return value_offsets
+        for key, value_offset, value_length in self._iter_records():
+            if key not in patched_values:
+                yield key, (self._read_value(value_offset, value_length) if read_values else None)
+                continue
 
-    def __contains__(self, key):
-        return key in self._value_offsets
+            value = patched_values[key]
 
-    def __iter__(self):
-        yield from self._value_offsets
+            if value is not _REMOVED:
+                yield key, value
+
+        # Keys only present in memory
+        for key, value in tuple(patched_values.items()):
+            if value is not _REMOVED and self._find_value(key) is None:
+                yield key, value
 
     def __len__(self):
-        return len(self._value_offsets)
+        return self._num_keys
 
     def __getitem__(self, key):
 
-        value_offset = self._value_offsets[key]
+        if key in self._patched_values:
+            value = self._patched_values[key]
+
+            if value is _REMOVED:
+                raise KeyError(key)
+
+            return value
+
+        value_location = self._find_value(key)
 
-        self._file_handle.seek(value_offset, SEEK_SET)
-        return RestrictedUnpickler(self._file_handle).load()
+        if value_location is None:
+            raise KeyError(key)
+
+        return self._read_value(*value_location)
 
     def __setitem__(self, key, value):
 
+        if not self._overwrite:
+            if key not in self:
+                self._num_keys += 1
+
+            self._patched_values[key] = value
+            return
+
         encoded_key = key.encode("utf-8")
-        pickled_value = dumps(value, protocol=self.PICKLE_PROTOCOL)
+        packed_value = self._pack_value(value)
 
-        key_length = len(encoded_key)
-        length_data = self.PACK_LENGTHS(key_length, len(pickled_value))
-        item_data = (length_data + encoded_key + pickled_value)
+        length_data = self.PACK_LENGTHS(len(encoded_key), len(packed_value))
+        item_data = (length_data + encoded_key + packed_value)
 
         self._file_handle.write(item_data)
 
-        self._value_offsets[key] = self._file_offset + self.LENGTH_DATA_SIZE + key_length
+        # Keys written to a new database are expected to be unique
+        self._key_hashes.append(self._hash_key(encoded_key))
+        self._record_offsets.append(self._file_offset)
         self._file_offset += len(item_data)
+        self._num_keys += 1
+
+    def __delitem__(self, key):
+
+        if self._overwrite:
+            raise DatabaseError("Cannot remove items from a database being written")
+
+        if key not in self:
+            raise KeyError(key)
+
+        if self._find_value(key) is None:
+            del self._patched_values[key]
+        else:
+            self._patched_values[key] = _REMOVED
+
+        self._num_keys -= 1
+
+    def _pack_value(self, value):
+        return dumps(value, protocol=self.PICKLE_PROTOCOL)
+
+    def _read_value(self, value_offset, value_length):
+        # Slice the memory map instead of seeking, values can be read from multiple threads
+        return RestrictedUnpickler(BytesIO(self._file_handle[value_offset:value_offset + value_length])).load()
 
     def get(self, key, default=None):
 
-        if key in self._value_offsets:
+        try:
             return self[key]
 
-        return default
+        except KeyError:
+            return default
+
+    def items(self):
+        """Iterate over keys and values, reading records sequentially."""
+        yield from self._iter_items()
 
     def update(self, obj):
         for key, value in obj.items():
             self[key] = value
 
+    def _write_slots(self):
+
+        # Keep the table at most half full, to avoid long probing sequences
+        num_slots = 1
+
+        while num_slots < (self._num_keys * 2):
+            num_slots *= 2
+
+        slots = array(self.SLOT_TYPECODE, bytes(num_slots * self.SLOT_SIZE))
+        slot_mask = (num_slots - 1)
+
+        for key_hash, record_offset in zip(self._key_hashes, self._record_offsets):
+            slot_index = (key_hash & slot_mask)
+
+            while slots[slot_index]:
+                slot_index = ((slot_index + 1) & slot_mask)
+
+            slots[slot_index] = record_offset
+
+        self._file_handle.write(slots.tobytes())
+        self._file_handle.write(
+            self.PACK_TRAILER(self._file_offset, num_slots, self._num_keys, self.TRAILER_SIGNATURE))
+
     def close(self):
 
         if self._overwrite:
-            os.fsync(self._file_handle)
+            self._overwrite = False
+            self._write_slots()
+            self._key_hashes = array("I")
+            self._record_offsets = array(self.SLOT_TYPECODE)
+            self._file_handle.flush()
+            os.fsync(self._file_handle.fileno())
 
-        self._file_handle.close()
+        if isinstance(self._slots, memoryview):
+            self._slots.release()
 
+        self._slots = ()
+        self._patched_values.clear()
 
-class ScannerState:
-    INITIALIZED = "initialized"
-    RESCANNING = "rescanning"
-    FAILURE = "failure"
+        if self._file_handle is None:
+            return
 
+        try:
+            self._file_handle.close()
 
-class ScannerLogMessage:
-    __slots__ = ("msg", "msg_args")
+        except BufferError:
+            # Values are still being read from the memory map, it's closed once they are released
+            pass
 
-    def __init__(self, msg, msg_args=None):
-        self.msg = msg
-        self.msg_args = msg_args
 
+class WordNormalizer:
+    """Splits text into words for the word index. Words are lowercased and
+    decomposed, diacritics are stripped and remaining special letters are
+    transliterated, so that e.g. "Beyoncé" and "beyonce" match. The same
+    normalizer must be used when indexing and searching."""
 
-class Scanner:
-    """Separate process responsible for building shares.
+    __slots__ = ("version", "_translate_chars")
 
-    It handles scanning of folders and files, as well as building
-    databases and writing them to disk.
-    """
+    VERSION = 1
+    TRANSLITERATIONS = {
+        "ß": "ss", "æ": "ae", "œ": "oe", "ø": "o", "đ": "d", "ð": "d", "þ": "th", "ł": "l", "ı": "i", "ŀ": "l"
+    }
+    DIACRITICS_PATTERN = re_compile("[\u0300-\u036F\u1AB0-\u1AFF\u1DC0-\u1DFF\u20D0-\u20FF\uFE20-\uFE2F]")
 
-    __slots__ = ("queue", "share_groups", "share_dbs", "share_db_paths", "init",
-                 "rescan", "rebuild", "reveal_buddy_shares", "reveal_trusted_shares",
-                 "files", "streams", "mtimes", "word_index", "processed_share_names",
-                 "processed_share_paths", "current_file_index", "current_folder_count")
+    def __init__(self, transliterations=None, version=VERSION):
 
-    HIDDEN_FOLDER_NAMES = {"@eaDir", "#recycle", "#snapshot"}
+        if transliterations is None:
+            transliterations = self.TRANSLITERATIONS
 
-    def __init__(self, queue, share_groups, share_db_paths, init=False, rescan=True,
-                 rebuild=False, reveal_buddy_shares=False, reveal_trusted_shares=False):
+        self.version = version
+        self._translate_chars = str.maketrans(transliterations)
 
-        self.queue = queue
-        self.share_groups = share_groups
-        self.share_dbs = {}
-        self.share_db_paths = share_db_paths
-        self.init = init
-        self.rescan = rescan
-        self.rebuild = rebuild
-        self.reveal_buddy_shares = reveal_buddy_shares
-        self.reveal_trusted_shares = reveal_trusted_shares
-        self.files = {}
-        self.streams = {}
-        self.mtimes = {}
-        self.word_index = defaultdict(list)
-        self.processed_share_names = set()
-        self.processed_share_paths = set()
-        self.current_file_index = 0
-        self.current_folder_count = 0
+    def normalize(self, text):
+        """Returns normalized text, without splitting it into words."""
 
-    def run(self):
+        text = text.lower()
 
-        try:
-            rename_process(b"nicotine-scan")
+        if text.isascii():
+            return text
 
-            if self.init:
-                try:
-                    self.create_compressed_shares()
-                    self.create_file_path_index()
+        # Only diacritical marks are stripped, other combining characters are recomposed
+        text = unicodedata.normalize("NFKD", text)
+        text = self.DIACRITICS_PATTERN.sub("", text)
 
-                except Exception:
-                    # Failed to load shares or version is invalid, rebuild
-                    self.rescan = self.rebuild = True
+        return unicodedata.normalize("NFC", text).translate(self._translate_chars)
 
-                self.queue.put(ScannerState.INITIALIZED)
+    def get_words(self, text):
+        return self.normalize(text).translate(TRANSLATE_PUNCTUATION).split()
 
-            if self.rescan:
-                self.queue.put(ScannerState.RESCANNING)
-                self.queue.put(
-                    ScannerLogMessage(_("Rebuilding shares…") if self.rebuild else _("Rescanning shares…"))
-                )
 
-                # Clear previous word index to prevent inconsistent state if the scanner fails
-                self.set_shares(word_index={})
+class WordIndexDatabase(Database):
+    """Database mapping words to sorted file indices. Indices are stored as
+    raw arrays of 32-bit integers, and read without copying or unpickling.
 
-                # Scan shares
-                for permission_level in (
-                    PermissionLevel.PUBLIC,
-                    PermissionLevel.BUDDY,
-                    PermissionLevel.TRUSTED
-                ):
-                    self.rescan_dirs(permission_level)
+    The version of the word normalizer is stored in the header, and word
+    indices created by a different normalizer are rejected when loaded.
 
-                self.set_shares(word_index=self.word_index)
-                self.word_index.clear()
+    File indices of files shared after loading the database are kept in
+    memory separately, without copying the stored indices.
+    """
 
-                self.create_compressed_shares()
-                self.create_file_path_index()
+    __slots__ = ("_appended_indices",)
 
-                self.queue.put(
-                    ScannerLogMessage(
-                        _("Rescan complete: %(num)s folders found"),
-                        {"num": self.current_folder_count}
-                    )
-                )
+    VERSION = 6
+    HEADER_SIZE = 6
+    ARRAY_TYPECODE = "I"
 
-        except Exception:
-            from traceback import format_exc
+    # Normalizes words when indexing and searching
+    word_normalizer = WordNormalizer()
 
-            self.queue.put(
-                ScannerLogMessage(
-                    _("Serious error occurred while rescanning shares. If this problem persists, "
-                      "delete %(dir)s/*.dbn and try again. If that doesn't help, please file a bug "
-                      "report with this stack trace included: %(trace)s"), {
-                        "dir": os.path.dirname(next(iter(self.share_db_paths.values()))),
-                        "trace": "\n" + format_exc()
-                    }
-                )
-            )
-            self.queue.put(ScannerState.FAILURE)
+    def __init__(self, file_path, overwrite=True):
+        self._appended_indices = defaultdict(partial(array, self.ARRAY_TYPECODE))
+        super().__init__(file_path, overwrite)
 
-        finally:
-            Shares.close_shares(self.share_dbs)
+    def __contains__(self, key):
+        return key in self._appended_indices or super().__contains__(key)
 
-    def create_compressed_shares_message(self, permission_level):
-        """Create a message that will later contain a compressed list of our
-        shares."""
+    def __iter__(self):
 
-        public_streams = self.share_dbs["public_streams"]
-        buddy_streams = self.share_dbs["buddy_streams"]
-        trusted_streams = self.share_dbs["trusted_streams"]
+        yield from super().__iter__()
 
-        if permission_level == PermissionLevel.PUBLIC and not self.reveal_buddy_shares:
-            buddy_streams = None
+        for word in tuple(self._appended_indices):
+            if not super().__contains__(word):
+                yield word
 
-        if permission_level in {PermissionLevel.PUBLIC, PermissionLevel.BUDDY} and not self.reveal_trusted_shares:
-            trusted_streams = None
+    def _get_header(self):
+        return self.FILE_SIGNATURE + bytes([self.VERSION, self.word_normalizer.version])
 
-        compressed_shares = SharedFileListResponse(
-            public_shares=public_streams, buddy_shares=buddy_streams, trusted_shares=trusted_streams,
-            permission_level=permission_level
-        )
-        compressed_shares.make_network_message()
-        compressed_shares.public_shares = compressed_shares.buddy_shares = compressed_shares.trusted_shares = None
+    def append(self, word, file_index):
+        """Add the file index of a new shared file to a loaded index in
+        memory, without modifying the file on disk. File indices must be
+        higher than previous ones."""
+        self._appended_indices[word].append(file_index)
 
-        self.queue.put(compressed_shares)
+    def get_index_lists(self, word):
+        """Returns sorted lists of stored and appended file indices of a
+        word."""
 
-    def create_compressed_shares(self):
+        index_lists = []
+        indices = self.get(word)
+        appended_indices = self._appended_indices.get(word)
 
-        Shares.load_shares(
-            self.share_dbs, self.share_db_paths, destinations={"public_streams", "buddy_streams", "trusted_streams"}
-        )
+        if indices:
+            index_lists.append(indices)
 
-        for permission_level in (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED):
-            self.create_compressed_shares_message(permission_level)
+        if appended_indices:
+            index_lists.append(appended_indices)
 
-        Shares.close_shares(self.share_dbs)
+        return index_lists
 
-    def create_file_path_index(self):
+    def close(self):
+        super().close()
+        self._appended_indices.clear()
 
-        Shares.load_shares(
-            self.share_dbs, self.share_db_paths, destinations={"public_files", "buddy_files", "trusted_files"}
-        )
+    def _pack_value(self, value):
 
-        file_path_index = tuple(chain(
-            self.share_dbs["public_files"],
-            self.share_dbs["buddy_files"],
-            self.share_dbs["trusted_files"]
-        ))
-        self.queue.put(file_path_index)
+        if not isinstance(value, array):
+            value = array(self.ARRAY_TYPECODE, value)
 
-        Shares.close_shares(self.share_dbs)
+        return value.tobytes()
 
-    def real2virtual(self, real_path):
+    def _read_value(self, value_offset, value_length):
+        return memoryview(self._file_handle)[value_offset:value_offset + value_length].cast(self.ARRAY_TYPECODE)
 
-        real_path = real_path.replace("/", "\\")
 
-        for shared_folder_paths in self.share_groups:
-            for virtual_name, folder_path, *_unused in shared_folder_paths:
-                folder_path = folder_path.replace("/", "\\")
+class FileDatabase(Database):
+    """Database mapping real file paths to shared file metadata. Metadata is
+    stored as fixed-size fields followed by the file's packed network
+    representation, and unpacked from the memory map without unpickling.
+    The packed representation is reused as-is when sending file lists."""
 
-                if real_path == folder_path:
-                    return virtual_name
+    __slots__ = ()
 
-                # Use rstrip to remove trailing separator from root folders
-                folder_path = folder_path.rstrip("\\") + "\\"
+    VERSION = 7
+    RECORD_HEADER_SIZE = 25
+    PACK_RECORD_HEADER = Struct("!QIIIIB").pack
+    UNPACK_RECORD_HEADER = Struct("!QIIIIB").unpack_from
+    UNPACK_PATH_LENGTH = Struct("<I").unpack_from
+    PATH_OFFSET = 5  # Code and length of virtual file path in packed file info
 
-                if real_path.startswith(folder_path):
-                    real_path_no_prefix = real_path[len(folder_path):]
-                    virtual_path = f"{virtual_name}\\{real_path_no_prefix}"
-                    return virtual_path
+    # Presence of optional metadata fields
+    HAS_QUALITY = 1
+    HAS_BITRATE = 2
+    HAS_SAMPLERATE = 4
+    HAS_BITDEPTH = 8
+    HAS_DURATION = 16
+    IS_VBR = 32
 
-        raise ValueError(f"Cannot find virtual path for {real_path}")
+    def _pack_value(self, value):
 
-    def set_shares(self, permission_level=None, files=None, streams=None, mtimes=None, word_index=None):
+        _virtual_file_path, size, quality, duration = value
+        bitrate = samplerate = bitdepth = None
+        flags = 0
 
-        for source, destination in (
-            (files, "files"),
-            (streams, "streams"),
-            (mtimes, "mtimes"),
-            (word_index, "words")
-        ):
-            if source is None:
-                continue
+        if quality is not None:
+            bitrate, is_vbr, samplerate, bitdepth = quality
+            flags |= self.HAS_QUALITY
 
-            if destination != "words":
-                destination = f"{permission_level}_{destination}"
+            if is_vbr:
+                flags |= self.IS_VBR
 
-            share_db = None
+        if bitrate is not None:
+            flags |= self.HAS_BITRATE
 
-            try:
-                share_db_path = self.share_db_paths[destination]
-                share_db = Shares.create_db_file(share_db_path)
-                share_db.update(source)
+        if samplerate is not None:
+            flags |= self.HAS_SAMPLERATE
 
-            finally:
-                if share_db is not None:
-                    share_db.close()
+        if bitdepth is not None:
+            flags |= self.HAS_BITDEPTH
 
-    def rescan_dirs(self, permission_level):
+        if duration is not None:
+            flags |= self.HAS_DURATION
 
-        shared_public_folders, shared_buddy_folders, shared_trusted_folders = self.share_groups
+        return self.PACK_RECORD_HEADER(
+            size, bitrate or 0, samplerate or 0, bitdepth or 0, duration or 0, flags
+        ) + FileListMessage.pack_file_info(value)
 
-        if permission_level == PermissionLevel.TRUSTED:
-            shared_folder_paths = sorted(shared_trusted_folders)
+    def _read_value(self, value_offset, value_length):
 
-        elif permission_level == PermissionLevel.BUDDY:
-            shared_folder_paths = sorted(shared_buddy_folders)
+        content = self._file_handle
+        size, bitrate, samplerate, bitdepth, duration, flags = self.UNPACK_RECORD_HEADER(content, value_offset)
+        packed_offset = (value_offset + self.RECORD_HEADER_SIZE)
+        path_offset = (packed_offset + self.PATH_OFFSET)
+        path_length, = self.UNPACK_PATH_LENGTH(content, packed_offset + 1)
+        virtual_file_path = content[path_offset:path_offset + path_length].decode("utf-8")
+        quality = None
 
-        else:
-            shared_folder_paths = sorted(shared_public_folders)
+        if flags & self.HAS_QUALITY:
+            quality = (
+                bitrate if flags & self.HAS_BITRATE else None,
+                int(bool(flags & self.IS_VBR)),
+                samplerate if flags & self.HAS_SAMPLERATE else None,
+                bitdepth if flags & self.HAS_BITDEPTH else None
+            )
 
-        try:
-            Shares.load_shares(
-                self.share_dbs, self.share_db_paths,
-                destinations={f"{permission_level}_files", f"{permission_level}_mtimes"})
+        if not flags & self.HAS_DURATION:
+            duration = None
 
-        except Exception:
-            # No previous share databases, rebuild
-            self.rebuild = True
+        return PackedFileInfo(
+            (virtual_file_path, size, quality, duration),
+            packed=content[packed_offset:value_offset + value_length]
+        )
 
-        old_files = self.share_dbs.get(f"{permission_level}_files")
-        old_mtimes = self.share_dbs.get(f"{permission_level}_mtimes")
 
-        for virtual_name, folder_path, *_unused in shared_folder_paths:
-            if virtual_name in self.processed_share_names:
-                # No duplicate names
-                continue
+class StringTable:
+    """Memory-mapped table of strings, accessed by position. Strings are
+    collected when writing, and saved to disk when the table is closed."""
 
-            if folder_path in self.processed_share_paths:
-                # No duplicate folder paths
-                continue
+    __slots__ = ("_file_path", "_file_handle", "_offsets", "_strings_offset", "_pending_strings", "_overwrite")
 
-            self.scan_shared_folder(folder_path, old_mtimes, old_files)
+    FILE_SIGNATURE = b"DBN+"
+    VERSION = 1
+    HEADER_SIZE = 16
+    OFFSET_TYPECODE = "Q"
+    OFFSET_SIZE = 8
+    PACK_HEADER = Struct("!4sB3xQ").pack
+    UNPACK_HEADER = Struct("!4sB3xQ").unpack_from
 
-            self.processed_share_names.add(virtual_name)
-            self.processed_share_paths.add(folder_path)
+    def __init__(self, file_path, overwrite=True):
 
-        # Save data to databases
-        Shares.close_shares(self.share_dbs)
-        self.set_shares(permission_level, files=self.files, streams=self.streams, mtimes=self.mtimes)
+        self._file_path = file_path
+        self._file_handle = None
+        self._offsets = ()
+        self._strings_offset = 0
+        self._pending_strings = []
+        self._overwrite = overwrite
 
-        for dictionary in (self.files, self.streams, self.mtimes):
-            dictionary.clear()
+        if overwrite:
+            folder_path = os.path.dirname(file_path)
 
-        gc.collect()
+            if not os.path.exists(folder_path):
+                os.makedirs(folder_path)
+            return
 
-    @classmethod
-    def is_hidden(cls, folder, filename=None, entry=None):
-        """Stop sharing any dot/hidden folders/files."""
+        with open(file_path, "rb") as file_handle:
+            self._file_handle = mmap.mmap(file_handle.fileno(), length=0, access=mmap.ACCESS_READ)
 
-        if filename is None:
-            last_folder = os.path.basename(folder)
+        try:
+            file_signature, version, num_strings = self.UNPACK_HEADER(self._file_handle)
 
-            if last_folder.startswith(".") or last_folder in cls.HIDDEN_FOLDER_NAMES:
-                return True
+            if file_signature != self.FILE_SIGNATURE:
+                raise DatabaseError("Not a database file")
 
-        # If we're asked to check a file, we exclude it if it starts with a dot
-        if filename is not None and filename.startswith("."):
-            return True
+            if version != self.VERSION:
+                raise DatabaseError("Incompatible version")
 
-        # Check if file is marked as hidden on Windows
-        if sys.platform == "win32":
-            if len(folder) == 3 and folder[1] == ":" and folder[2] == os.sep:
-                # Root folders are marked as hidden, but we allow scanning them
-                return False
+            self._strings_offset = self.HEADER_SIZE + ((num_strings + 1) * self.OFFSET_SIZE)
+            self._offsets = memoryview(self._file_handle)[self.HEADER_SIZE:self._strings_offset].cast(
+                self.OFFSET_TYPECODE)
 
-            if entry is None:
-                if filename is not None:
-                    entry_stat = os.stat(encode_path(os.path.join(folder, filename)))
-                else:
-                    entry_stat = os.stat(encode_path(folder))
-            else:
-                entry_stat = entry.stat()
+        except Exception:
+            self.close()
+            raise
 
-            return entry_stat.st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN
+    def __len__(self):
+        return len(self._offsets) - 1 if self._offsets else 0
 
-        return False
+    def __getitem__(self, index):
 
-    def scan_shared_folder(self, shared_folder_path, old_mtimes, old_files):
-        """Scan a shared folder for all subfolders, files and their metadata."""
+        if not 0 <= index < len(self):
+            raise IndexError("string index out of range")
 
-        folder_paths = deque([shared_folder_path])
+        strings_offset = self._strings_offset
+        start_offset = strings_offset + self._offsets[index]
+        end_offset = strings_offset + self._offsets[index + 1]
 
-        while folder_paths:
-            folder_path = folder_paths.pop()
-            virtual_folder_path = self.real2virtual(folder_path)
+        return self._file_handle[start_offset:end_offset].decode("utf-8")
 
-            if virtual_folder_path in self.streams:
-                # Sharing a folder twice, no go
-                continue
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
 
-            file_list = []
+    def update(self, strings):
+        self._pending_strings.extend(strings)
 
-            try:
-                with os.scandir(encode_path(folder_path, prefix=False)) as entries:
+    def _prepare_strings(self, strings):
+        return strings
+
+    def _write(self):
+
+        strings = self._prepare_strings(self._pending_strings)
+        offsets = array(self.OFFSET_TYPECODE, [0])
+        offset = 0
+
+        with open(self._file_path, "wb") as file_handle:
+            file_handle.write(self.PACK_HEADER(self.FILE_SIGNATURE, self.VERSION, len(strings)))
+
+            encoded_strings = [string.encode("utf-8") for string in strings]
+
+            for encoded_string in encoded_strings:
+                offset += len(encoded_string)
+                offsets.append(offset)
+
+            file_handle.write(offsets.tobytes())
+
+            for encoded_string in encoded_strings:
+                file_handle.write(encoded_string)
+
+            os.fsync(file_handle)
+
+    def close(self):
+
+        if self._overwrite:
+            self._overwrite = False
+            self._write()
+            self._pending_strings.clear()
+            return
+
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+
+        self._offsets = ()
+
+        if self._file_handle is None:
+            return
+
+        try:
+            self._file_handle.close()
+
+        except BufferError:
+            # Offsets are still being read from the memory map, it's closed once they are released
+            pass
+
+
+class FilePathIndex(StringTable):
+    """Table of real paths of shared files, in the order of their file
+    indices in the word index. Stored indices of paths appended again are
+    dead, and return None."""
+
+    __slots__ = ("_appended_strings", "_appended_indices", "_num_stored_strings")
+
+    def __init__(self, file_path, overwrite=True):
+
+        self._appended_strings = []
+        self._appended_indices = {}
+        super().__init__(file_path, overwrite)
+        self._num_stored_strings = super().__len__()
+
+    def __len__(self):
+        return self._num_stored_strings + len(self._appended_strings)
+
+    def __getitem__(self, index):
+
+        if index >= self._num_stored_strings:
+            return self._appended_strings[index - self._num_stored_strings]
+
+        file_path = super().__getitem__(index)
+
+        if file_path in self._appended_indices:
+            # Path was removed and shared again under a new index
+            return None
+
+        return file_path
+
+    def append(self, file_path):
+        """Add the path of a new shared file to a loaded index in memory,
+        without modifying the file on disk. Returns False if the path was
+        already appended, in which case its previous index is reused."""
+
+        if file_path in self._appended_indices:
+            return False
+
+        self._appended_indices[file_path] = len(self)
+        self._appended_strings.append(file_path)
+        return True
+
+    def close(self):
+
+        super().close()
+        self._appended_strings.clear()
+        self._appended_indices.clear()
+        self._num_stored_strings = 0
+
+
+class SuffixIndex(StringTable):
+    """Sorted table of reversed words, allowing words ending with a partial
+    word (e.g. *ello) to be found with a binary search."""
+
+    __slots__ = ("_patched_strings",)
+
+    def __init__(self, file_path, overwrite=True):
+        self._patched_strings = []
+        super().__init__(file_path, overwrite)
+
+    def _prepare_strings(self, strings):
+        return sorted(word[::-1] for word in strings)
+
+    def add(self, word):
+        """Add a new word to a loaded index in memory, without modifying the
+        file on disk."""
+        insort(self._patched_strings, word[::-1])
+
+    def iter_words_ending_with(self, partial_word):
+
+        reversed_partial_word = partial_word[::-1]
+
+        for reversed_words in (self, self._patched_strings):
+            index = bisect_left(reversed_words, reversed_partial_word)
+            num_words = len(reversed_words)
+
+            while index < num_words:
+                reversed_word = reversed_words[index]
+
+                if not reversed_word.startswith(reversed_partial_word):
+                    break
+
+                yield reversed_word[::-1]
+                index += 1
+
+
+class WordFilter:
+    """Bloom filter of all words in the word index. Words missing from the
+    filter are definitely not shared, allowing search requests without
+    matches to be rejected without looking up words in the word index.
+    Words are collected when writing, and saved to disk when the filter is
+    closed."""
+
+    __slots__ = ("_file_path", "_bits", "_num_bits", "_num_hashes", "_pending_words", "_overwrite")
+
+    FILE_SIGNATURE = b"DBN+"
+    VERSION = 1
+    HEADER_SIZE = 16
+    PACK_HEADER = Struct("!4sBB2xQ").pack
+    UNPACK_HEADER = Struct("!4sBB2xQ").unpack_from
+    UNPACK_HASHES = Struct("<II").unpack
+    BITS_PER_WORD = 10
+    NUM_HASHES = 7  # False positive rate of about 1% for 10 bits per word
+
+    def __init__(self, file_path, overwrite=True):
+
+        self._file_path = file_path
+        self._bits = bytearray()
+        self._num_bits = 0
+        self._num_hashes = self.NUM_HASHES
+        self._pending_words = []
+        self._overwrite = overwrite
+
+        if overwrite:
+            folder_path = os.path.dirname(file_path)
+
+            if not os.path.exists(folder_path):
+                os.makedirs(folder_path)
+            return
+
+        with open(file_path, "rb") as file_handle:
+            content = file_handle.read()
+
+        if len(content) < self.HEADER_SIZE:
+            raise DatabaseError("Not a database file")
+
+        file_signature, version, num_hashes, num_bits = self.UNPACK_HEADER(content)
+
+        if file_signature != self.FILE_SIGNATURE:
+            raise DatabaseError("Not a database file")
+
+        if version != self.VERSION:
+            raise DatabaseError("Incompatible version")
+
+        if num_bits <= 0 or num_bits % 8 or len(content) != self.HEADER_SIZE + (num_bits // 8):
+            raise DatabaseError("Incomplete database file")
+
+        self._bits = bytearray(content[self.HEADER_SIZE:])
+        self._num_bits = num_bits
+        self._num_hashes = num_hashes
+
+    def _iter_bit_positions(self, word):
+        """Derive bit positions from two hash values of a word."""
+
+        hash1, hash2 = self.UNPACK_HASHES(blake2b(word.encode("utf-8"), digest_size=8).digest())
+        hash2 |= 1
+        num_bits = self._num_bits
+
+        for i in range(self._num_hashes):
+            yield (hash1 + (i * hash2)) % num_bits
+
+    def __contains__(self, word):
+
+        bits = self._bits
+
+        if not bits:
+            return False
+
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._iter_bit_positions(word))
+
+    def update(self, words):
+        self._pending_words.extend(words)
+
+    def add(self, word):
+        """Add a new word to a loaded filter in memory, without modifying the
+        file on disk."""
+
+        bits = self._bits
+
+        for bit_position in self._iter_bit_positions(word):
+            bits[bit_position >> 3] |= (1 << (bit_position & 7))
+
+    def _write(self):
+
+        num_bits = max(len(self._pending_words) * self.BITS_PER_WORD, 64)
+        self._num_bits = num_bits = (num_bits + 7) & ~7
+        self._bits = bytearray(num_bits // 8)
+
+        for word in self._pending_words:
+            self.add(word)
+
+        with open(self._file_path, "wb") as file_handle:
+            file_handle.write(self.PACK_HEADER(self.FILE_SIGNATURE, self.VERSION, self._num_hashes, num_bits))
+            file_handle.write(self._bits)
+            os.fsync(file_handle)
+
+    def close(self):
+
+        if self._overwrite:
+            self._overwrite = False
+            self._write()
+            self._pending_words.clear()
+
+        self._bits = bytearray()
+        self._num_bits = 0
+
+
+class ScannerState:
+    INITIALIZED = "initialized"
+    RESCANNING = "rescanning"
+    FAILURE = "failure"
+
+
+class ScannerLogMessage:
+    __slots__ = ("msg", "msg_args")
+
+    def __init__(self, msg, msg_args=None):
+        self.msg = msg
+        self.msg_args = msg_args
+
+
+class ScannerProgress:
+    __slots__ = ("num_folders", "num_files", "num_parsed_bytes", "elapsed_time")
+
+    def __init__(self, num_folders=0, num_files=0, num_parsed_bytes=0, elapsed_time=0):
+        self.num_folders = num_folders
+        self.num_files = num_files
+        self.num_parsed_bytes = num_parsed_bytes
+        self.elapsed_time = elapsed_time
+
+    def _get_rate(self, value):
+        return value / self.elapsed_time if self.elapsed_time > 0 else 0
+
+    @property
+    def folders_per_second(self):
+        return self._get_rate(self.num_folders)
+
+    @property
+    def files_per_second(self):
+        return self._get_rate(self.num_files)
+
+    @property
+    def parsed_bytes_per_second(self):
+        return self._get_rate(self.num_parsed_bytes)
+
+
+class ScannerSharedFileList:
+    """Reference to a compressed list of shared files written to disk by the
+    scanner, to avoid sending large messages to the main process."""
+
+    __slots__ = ("permission_level", "file_path")
+
+    def __init__(self, permission_level, file_path):
+        self.permission_level = permission_level
+        self.file_path = file_path
+
+
+class ScannerBudget:
+    """Limits the rate at which the scanner reads files, to let uploads and
+    other disk activity proceed during scans. A limit of 0 disables it."""
+
+    __slots__ = ("max_bytes_per_second", "max_files_per_second", "_start_time", "_num_bytes", "_num_files")
+
+    MAX_IDLE_TIME = 1  # Unused budget is only kept for this many seconds
+
+    def __init__(self, max_bytes_per_second=0, max_files_per_second=0):
+
+        self.max_bytes_per_second = max_bytes_per_second
+        self.max_files_per_second = max_files_per_second
+        self._start_time = time.monotonic()
+        self._num_bytes = 0
+        self._num_files = 0
+
+    def consume(self, num_bytes=0, num_files=0):
+        """Account for files and bytes read, and sleep until they fit within
+        the budget."""
+
+        self._num_bytes += num_bytes
+        self._num_files += num_files
+        elapsed_time = (time.monotonic() - self._start_time)
+        delay = -elapsed_time
+
+        if self.max_bytes_per_second > 0:
+            delay = max(delay, (self._num_bytes / self.max_bytes_per_second) - elapsed_time)
+
+        if self.max_files_per_second > 0:
+            delay = max(delay, (self._num_files / self.max_files_per_second) - elapsed_time)
+
+        if delay > 0:
+            time.sleep(delay)
+
+        elif delay < -self.MAX_IDLE_TIME:
+            # Don't allow bursts after idling, e.g. while reusing unchanged folders
+            self._start_time = time.monotonic()
+            self._num_bytes = self._num_files = 0
+
+
+class BudgetedFile:
+    """File wrapper accounting for bytes read in a scanner budget."""
+
+    __slots__ = ("_file_handle", "_budget")
+
+    def __init__(self, file_handle, budget):
+        self._file_handle = file_handle
+        self._budget = budget
+
+    def read(self, size=-1):
+
+        data = self._file_handle.read(size)
+        self._budget.consume(num_bytes=len(data))
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file_handle.seek(offset, whence)
+
+    def tell(self):
+        return self._file_handle.tell()
+
+
+class Scanner:
+    """Separate process responsible for building shares.
+
+    It handles scanning of folders and files, as well as building
+    databases and writing them to disk.
+    """
+
+    __slots__ = ("connection", "share_groups", "share_dbs", "share_db_paths", "shared_file_list_paths", "init",
+                 "rescan", "rebuild", "reveal_buddy_shares", "reveal_trusted_shares",
+                 "num_workers", "incremental_rescan", "files", "streams", "mtimes", "folders", "word_index",
+                 "share_stats", "processed_share_names",
+                 "processed_share_paths", "current_file_index", "current_folder_count", "num_parsed_bytes",
+                 "file_hash_db_path", "file_hashes", "low_priority", "max_read_speed", "max_files_per_second",
+                 "memory_limit", "scanned_folder_paths", "new_share_db_paths", "_start_time", "_worker_pool",
+                 "_pending_folders", "_pending_tasks", "_submitted_batch", "_share_db_writers", "_buffered_size",
+                 "_word_index_runs", "_file_hash_writer")
+
+    HIDDEN_FOLDER_NAMES = {"@eaDir", "#recycle", "#snapshot"}
+    SHARE_DB_DESTINATIONS = ("files", "streams", "mtimes", "folders")
+    WORKER_BATCH_SIZE = 512
+    WORKER_CHUNK_SIZE = 16
+    HASH_SAMPLE_SIZE = 65536
+
+    # Approximate memory usage of buffered share data, in bytes
+    FILE_ENTRY_SIZE = 400
+    WORD_ENTRY_SIZE = 100
+    FILE_INDEX_SIZE = 4
+    FILE_HASH_ENTRY_SIZE = 150
+    LOW_PRIORITY_NICENESS = 10
+    IOPRIO_SET_SYSCALLS = {
+        "x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314, "ppc64le": 273, "riscv64": 30
+    }
+
+    # Budget of the current process, shared by the scanner and its workers
+    budget = None
+
+    # Metadata of previously scanned files, opened by each process reading metadata
+    cached_file_hashes = None
+
+    def __init__(self, connection, share_groups, share_db_paths, shared_file_list_paths, init=False, rescan=True,
+                 rebuild=False, *, reveal_buddy_shares=False, reveal_trusted_shares=False, num_workers=1,
+                 incremental_rescan=False, file_hash_db_path=None, low_priority=False, max_read_speed=0,
+                 max_files_per_second=0, memory_limit=0):
+
+        self.connection = connection
+        self.share_groups = share_groups
+        self.share_dbs = {}
+        self.share_db_paths = share_db_paths
+        self.new_share_db_paths = Shares.get_new_share_db_paths(share_db_paths)
+        self.shared_file_list_paths = shared_file_list_paths
+        self.init = init
+        self.rescan = rescan
+        self.rebuild = rebuild
+        self.reveal_buddy_shares = reveal_buddy_shares
+        self.reveal_trusted_shares = reveal_trusted_shares
+        self.num_workers = num_workers
+        self.incremental_rescan = incremental_rescan
+        self.files = {}
+        self.streams = {}
+        self.mtimes = {}
+        self.folders = {}
+        self.word_index = defaultdict(partial(array, WordIndexDatabase.ARRAY_TYPECODE))
+        self.share_stats = {}
+        self.processed_share_names = set()
+        self.processed_share_paths = set()
+        self.current_file_index = 0
+        self.current_folder_count = 0
+        self.num_parsed_bytes = 0
+        self.file_hash_db_path = file_hash_db_path
+        self.file_hashes = {}
+        self.low_priority = low_priority
+        self.max_read_speed = max_read_speed
+        self.max_files_per_second = max_files_per_second
+        self.memory_limit = memory_limit
+        self.scanned_folder_paths = set()
+        self._start_time = None
+        self._worker_pool = None
+        self._pending_folders = []
+        self._pending_tasks = []
+        self._submitted_batch = None
+        self._share_db_writers = {}
+        self._buffered_size = 0
+        self._word_index_runs = []
+        self._file_hash_writer = None
+
+    def run(self):
+
+        try:
+            rename_process(b"nicotine-scan")
+            self._start_time = time.monotonic()
+
+            if self.low_priority:
+                self.lower_process_priority()
+
+            if self.max_read_speed > 0 or self.max_files_per_second > 0:
+                Scanner.budget = ScannerBudget(self.max_read_speed, self.max_files_per_second)
+
+            if self.init:
+                try:
+                    self.create_compressed_shares(self.share_db_paths)
+
+                    try:
+                        Shares.load_shares(self.share_dbs, self.share_db_paths, destinations={"file_paths"})
+                        Shares.close_shares(self.share_dbs)
+
+                    except Exception:
+                        # File path index is missing, recreate it from existing shares
+                        self.create_file_path_index(self.share_db_paths)
+
+                except Exception:
+                    # Failed to load shares or version is invalid, rebuild
+                    self.rescan = self.rebuild = True
+
+                try:
+                    Shares.load_shares(
+                        self.share_dbs, self.share_db_paths, destinations={
+                            "words", "word_suffixes", "word_filter", "public_stats", "buddy_stats",
+                            "trusted_stats"
+                        })
+                    Shares.close_shares(self.share_dbs)
+
+                except Exception:
+                    # Word index version is invalid or share statistics are missing, rescan to recreate them
+                    self.rescan = True
+
+                self.connection.send(ScannerState.INITIALIZED)
+
+            if self.rescan:
+                self.connection.send(ScannerState.RESCANNING)
+                self.connection.send(
+                    ScannerLogMessage(_("Rebuilding shares…") if self.rebuild else _("Rescanning shares…"))
+                )
+
+                if self.num_workers > 1:
+                    self._worker_pool = self._create_worker_pool()
+
+                self.load_file_hashes(self.file_hash_db_path)
+
+                # Scan shares
+                for permission_level in (
+                    PermissionLevel.PUBLIC,
+                    PermissionLevel.BUDDY,
+                    PermissionLevel.TRUSTED
+                ):
+                    self.rescan_dirs(permission_level)
+
+                # Workers keep previous file hashes open until they are stopped
+                self._stop_worker_pool()
+                self.save_file_hashes()
+                self.write_word_index()
+
+                # Previous databases are replaced by the new ones once the scan is complete
+                self.create_compressed_shares(self.new_share_db_paths, new_shared_file_lists=True)
+                self.create_file_path_index(self.new_share_db_paths)
+
+                self.send_progress()
+                self.connection.send(
+                    ScannerLogMessage(
+                        _("Rescan complete: %(num)s folders found"),
+                        {"num": self.current_folder_count}
+                    )
+                )
+
+        except Exception:
+            from traceback import format_exc
+
+            self.connection.send(
+                ScannerLogMessage(
+                    _("Serious error occurred while rescanning shares. If this problem persists, "
+                      "delete %(dir)s/*.dbn and try again. If that doesn't help, please file a bug "
+                      "report with this stack trace included: %(trace)s"), {
+                        "dir": os.path.dirname(next(iter(self.share_db_paths.values()))),
+                        "trace": "\n" + format_exc()
+                    }
+                )
+            )
+            self.connection.send(ScannerState.FAILURE)
+
+        finally:
+            self._stop_worker_pool()
+            self.close_file_hashes()
+
+            self.close_share_db_writers()
+            Shares.close_shares(self.share_dbs)
+
+            for run_path in self._word_index_runs:
+                Shares.remove_db_file(run_path)
+
+            if self._file_hash_writer is not None:
+                self._file_hash_writer.close()
+
+            if self.file_hash_db_path is not None:
+                Shares.remove_db_file(f"{self.file_hash_db_path}.run")
+
+            self.connection.close()
+
+    def _create_worker_pool(self):
+        """Create a pool of processes responsible for reading file metadata."""
+
+        import multiprocessing
+
+        context = multiprocessing.get_context(method="spawn")
+        max_read_speed = self.max_read_speed
+
+        if max_read_speed > 0:
+            # Workers share the read budget
+            max_read_speed = max(max_read_speed // self.num_workers, 1)
+
+        return context.Pool(
+            processes=self.num_workers, initializer=self._init_worker,
+            initargs=(self.low_priority, max_read_speed, self.file_hash_db_path))
+
+    def _stop_worker_pool(self):
+
+        if self._worker_pool is not None:
+            self._worker_pool.terminate()
+            self._worker_pool = None
+
+    @classmethod
+    def _init_worker(cls, low_priority=False, max_read_speed=0, file_hash_db_path=None):
+
+        import multiprocessing
+
+        rename_process(b"nicotine-scan")
+
+        if low_priority:
+            cls.lower_process_priority()
+
+        if max_read_speed > 0:
+            cls.budget = ScannerBudget(max_bytes_per_second=max_read_speed)
+
+        cls.load_file_hashes(file_hash_db_path)
+
+        # Stop the worker if the scanner process is terminated, instead of leaving it orphaned
+        parent_process = multiprocessing.parent_process()
+
+        if parent_process is None:
+            return
+
+        def _watch_parent_process():
+            parent_process.join()
+            os._exit(0)  # pylint: disable=protected-access
+
+        Thread(target=_watch_parent_process, name="ScannerWatcher", daemon=True).start()
+
+    @classmethod
+    def lower_process_priority(cls):
+        """Lower the CPU and I/O priority of the current process, to let
+        uploads and the rest of the system take precedence."""
+
+        if sys.platform == "win32":
+            import ctypes
+
+            # Background mode lowers both CPU and I/O priority
+            process_mode_background_begin = 0x00100000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), process_mode_background_begin)
+            return
+
+        try:
+            # Workers inherit the niceness of the scanner, avoid lowering it further
+            niceness = os.getpriority(os.PRIO_PROCESS, 0)
+            os.setpriority(os.PRIO_PROCESS, 0, max(niceness, cls.LOW_PRIORITY_NICENESS))
+
+        except OSError:
+            pass
+
+        if sys.platform != "linux":
+            return
+
+        import ctypes
+        import platform
+
+        syscall_number = cls.IOPRIO_SET_SYSCALLS.get(platform.machine())
+
+        if syscall_number is None:
+            return
+
+        ioprio_who_process = 1
+        ioprio_class_best_effort = 2
+        ioprio_lowest_level = 7
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.syscall(syscall_number, ioprio_who_process, 0, (ioprio_class_best_effort << 13) | ioprio_lowest_level)
+
+        except (AttributeError, OSError):
+            pass
+
+    @staticmethod
+    def get_shared_file_list_message(permission_level, compressed_streams, reveal_buddy_shares=False,
+                                     reveal_trusted_shares=False):
+
+        public_streams = compressed_streams[PermissionLevel.PUBLIC]
+        buddy_streams = compressed_streams[PermissionLevel.BUDDY]
+        trusted_streams = compressed_streams[PermissionLevel.TRUSTED]
+
+        if permission_level == PermissionLevel.PUBLIC and not reveal_buddy_shares:
+            buddy_streams = None
+
+        if permission_level in {PermissionLevel.PUBLIC, PermissionLevel.BUDDY} and not reveal_trusted_shares:
+            trusted_streams = None
+
+        return SharedFileListResponse(
+            public_shares=public_streams, buddy_shares=buddy_streams, trusted_shares=trusted_streams,
+            permission_level=permission_level
+        )
+
+    def create_compressed_shares_message(self, permission_level, compressed_streams, new_shared_file_list=False):
+        """Create a message containing a compressed list of our shares. Folders
+        of each permission level are only compressed once, and joined for
+        every permission level they are visible to."""
+
+        compressed_shares = self.get_shared_file_list_message(
+            permission_level, compressed_streams, self.reveal_buddy_shares, self.reveal_trusted_shares)
+        shared_file_list_path = self.shared_file_list_paths[permission_level]
+
+        if new_shared_file_list:
+            # Replaces the list in use once the main process swaps in the new databases
+            with open(encode_path(f"{shared_file_list_path}.new"), "wb") as file_handle:
+                file_handle.write(compressed_shares.make_network_message())
+            return
+
+        temp_file_path = f"{shared_file_list_path}.tmp"
+
+        # The previous file can still be streamed to peers, don't overwrite it in place
+        with open(encode_path(temp_file_path), "wb") as file_handle:
+            file_handle.write(compressed_shares.make_network_message())
+
+        try:
+            os.replace(encode_path(temp_file_path), encode_path(shared_file_list_path))
+
+        except OSError:
+            # Previous file is still open on Windows, send the new file instead
+            shared_file_list_path = temp_file_path
+
+        self.connection.send(ScannerSharedFileList(permission_level, shared_file_list_path))
+
+    def create_compressed_shares(self, share_db_paths, new_shared_file_lists=False):
+
+        Shares.load_shares(
+            self.share_dbs, share_db_paths, destinations={"public_streams", "buddy_streams", "trusted_streams"}
+        )
+
+        permission_levels = (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED)
+        compressed_streams = {
+            permission_level: SharedFileListResponse.compress_shares(self.share_dbs[f"{permission_level}_streams"])
+            for permission_level in permission_levels
+        }
+        Shares.close_shares(self.share_dbs)
+
+        for permission_level in permission_levels:
+            self.create_compressed_shares_message(permission_level, compressed_streams, new_shared_file_lists)
+
+    def create_file_path_index(self, share_db_paths):
+
+        Shares.load_shares(
+            self.share_dbs, share_db_paths, destinations={"public_files", "buddy_files", "trusted_files"}
+        )
+
+        file_path_index = None
+
+        try:
+            file_path_index = Shares.create_db_file(share_db_paths["file_paths"], FilePathIndex)
+            file_path_index.update(chain(
+                self.share_dbs["public_files"],
+                self.share_dbs["buddy_files"],
+                self.share_dbs["trusted_files"]
+            ))
+
+        finally:
+            if file_path_index is not None:
+                file_path_index.close()
+
+            Shares.close_shares(self.share_dbs)
+
+    @classmethod
+    def load_file_hashes(cls, file_hash_db_path):
+        """Load metadata of previously scanned files, identified by their
+        contents. Kept across rebuilds."""
+
+        if file_hash_db_path is None:
+            return
+
+        try:
+            cls.cached_file_hashes = Database(encode_path(file_hash_db_path), overwrite=False)
+
+        except Exception:
+            # No previous file hashes, replaced once the scan is complete
+            pass
+
+    @classmethod
+    def close_file_hashes(cls):
+
+        if cls.cached_file_hashes is not None:
+            cls.cached_file_hashes.close()
+            cls.cached_file_hashes = None
+
+    def spill_file_hashes(self):
+        """Write metadata of files hashed so far to a temporary database, to
+        keep memory usage within the limit."""
+
+        if self.file_hash_db_path is None:
+            return
+
+        if self._file_hash_writer is None:
+            self._file_hash_writer = Shares.create_db_file(f"{self.file_hash_db_path}.run")
+
+        self._file_hash_writer.update(self.file_hashes)
+        self.file_hashes.clear()
+
+    def save_file_hashes(self):
+        """Save metadata of files hashed during this scan. Entries of previous
+        scans are kept, most recent first, until there are twice as many
+        entries as shared files."""
+
+        if self.file_hash_db_path is None:
+            return
+
+        cached_file_hashes = self.cached_file_hashes
+        file_hashes = self.file_hashes
+        temp_db_path = f"{self.file_hash_db_path}.tmp"
+        file_hash_db = None
+
+        try:
+            if self._file_hash_writer is not None:
+                # Metadata was written to disk while scanning, read it back from there
+                self.spill_file_hashes()
+                self._file_hash_writer.close()
+                self._file_hash_writer = None
+                file_hashes = Database(encode_path(f"{self.file_hash_db_path}.run"), overwrite=False)
+
+            max_file_hashes = max(self.current_file_index * 2, len(file_hashes))
+            file_hash_db = Shares.create_db_file(temp_db_path)
+            file_hash_db.update(file_hashes)
+            num_file_hashes = len(file_hashes)
+
+            if cached_file_hashes is not None:
+                for content_hash, file_info in cached_file_hashes.items():
+                    if num_file_hashes >= max_file_hashes:
+                        break
+
+                    if content_hash not in file_hashes:
+                        file_hash_db[content_hash] = file_info
+                        num_file_hashes += 1
+
+        finally:
+            if file_hash_db is not None:
+                file_hash_db.close()
+
+            if file_hashes is not self.file_hashes:
+                file_hashes.close()
+
+            self.close_file_hashes()
+
+        os.replace(encode_path(temp_db_path), encode_path(self.file_hash_db_path))
+        self.file_hashes.clear()
+
+    @staticmethod
+    def should_hash_file(file_path, size):
+        """Files are only hashed if their metadata is read, since hashing
+        requires reading the file."""
+
+        if size <= 128:
+            return False
+
+        return TinyTag._get_parser_for_filename(file_path) is not None  # pylint: disable=protected-access
+
+    @classmethod
+    def get_content_hash(cls, file_path, size):
+        """Get a fast hash of a file's size and contents. Large files are only
+        sampled at their start, middle and end."""
+
+        sample_size = cls.HASH_SAMPLE_SIZE
+        content_hash = blake2b(size.to_bytes(8, "big"), digest_size=16)
+
+        with open(encode_path(file_path), "rb") as file_handle:
+            if cls.budget is not None:
+                file_handle = BudgetedFile(file_handle, cls.budget)
+
+            if size <= sample_size * 3:
+                content_hash.update(file_handle.read())
+            else:
+                for offset in (0, (size - sample_size) // 2, size - sample_size):
+                    file_handle.seek(offset)
+                    content_hash.update(file_handle.read(sample_size))
+
+        return content_hash.hexdigest()
+
+    def real2virtual(self, real_path):
+
+        real_path = real_path.replace("/", "\\")
+
+        for shared_folder_paths in self.share_groups:
+            for virtual_name, folder_path, *_unused in shared_folder_paths:
+                folder_path = folder_path.replace("/", "\\")
+
+                if real_path == folder_path:
+                    return virtual_name
+
+                # Use rstrip to remove trailing separator from root folders
+                folder_path = folder_path.rstrip("\\") + "\\"
+
+                if real_path.startswith(folder_path):
+                    real_path_no_prefix = real_path[len(folder_path):]
+                    virtual_path = f"{virtual_name}\\{real_path_no_prefix}"
+                    return virtual_path
+
+        raise ValueError(f"Cannot find virtual path for {real_path}")
+
+    def set_shares(self, permission_level=None, files=None, streams=None, mtimes=None, folders=None,
+                   word_index=None, share_stats=None):
+
+        for source, destination in (
+            (files, "files"),
+            (streams, "streams"),
+            (mtimes, "mtimes"),
+            (folders, "folders"),
+            (share_stats, "stats"),
+            (word_index, "words"),
+            (word_index, "word_suffixes"),
+            (word_index, "word_filter")
+        ):
+            if source is None:
+                continue
+
+            if permission_level is not None:
+                destination = f"{permission_level}_{destination}"
+
+            share_db = None
+
+            try:
+                share_db_path = self.new_share_db_paths[destination]
+                share_db = Shares.create_db_file(share_db_path, Shares.DATABASE_CLASSES.get(destination, Database))
+                share_db.update(source)
+
+            finally:
+                if share_db is not None:
+                    share_db.close()
+
+    def rescan_dirs(self, permission_level):
+
+        shared_public_folders, shared_buddy_folders, shared_trusted_folders = self.share_groups
+
+        if permission_level == PermissionLevel.TRUSTED:
+            shared_folder_paths = sorted(shared_trusted_folders)
+
+        elif permission_level == PermissionLevel.BUDDY:
+            shared_folder_paths = sorted(shared_buddy_folders)
+
+        else:
+            shared_folder_paths = sorted(shared_public_folders)
+
+        if self.incremental_rescan and not self.rebuild:
+            try:
+                Shares.load_shares(
+                    self.share_dbs, self.share_db_paths,
+                    destinations={f"{permission_level}_streams", f"{permission_level}_folders"})
+
+            except Exception:
+                # No previous folder modification times, scan all folders
+                pass
+
+        try:
+            Shares.load_shares(
+                self.share_dbs, self.share_db_paths,
+                destinations={f"{permission_level}_files", f"{permission_level}_mtimes"})
+
+        except Exception:
+            # No previous share databases, rebuild
+            self.rebuild = True
+
+        old_files = self.share_dbs.get(f"{permission_level}_files")
+        old_mtimes = self.share_dbs.get(f"{permission_level}_mtimes")
+        old_streams = self.share_dbs.get(f"{permission_level}_streams")
+        old_folders = self.share_dbs.get(f"{permission_level}_folders")
+
+        self.open_share_db_writers(permission_level)
+
+        for virtual_name, folder_path, *_unused in shared_folder_paths:
+            if virtual_name in self.processed_share_names:
+                # No duplicate names
+                continue
+
+            if folder_path in self.processed_share_paths:
+                # No duplicate folder paths
+                continue
+
+            self.scan_shared_folder(folder_path, old_mtimes, old_files, old_streams, old_folders)
+
+            self.processed_share_names.add(virtual_name)
+            self.processed_share_paths.add(folder_path)
+
+        # Save remaining data to databases
+        self.flush_shares()
+        self.close_share_db_writers()
+        self.set_shares(permission_level, share_stats=self.share_stats)
+        Shares.close_shares(self.share_dbs)
+
+        self.share_stats.clear()
+        self.scanned_folder_paths.clear()
+        gc.collect()
+
+    def open_share_db_writers(self, permission_level):
+        """Create databases that data of scanned folders is written to while
+        scanning."""
+
+        for destination in self.SHARE_DB_DESTINATIONS:
+            db_destination = f"{permission_level}_{destination}"
+            self._share_db_writers[destination] = Shares.create_db_file(
+                self.new_share_db_paths[db_destination], Shares.DATABASE_CLASSES.get(db_destination, Database))
+
+    def close_share_db_writers(self):
+
+        for share_db in self._share_db_writers.values():
+            share_db.close()
+
+        self._share_db_writers.clear()
+
+    def flush_shares(self):
+        """Write data of scanned folders to databases, to keep memory usage
+        within the limit."""
+
+        for source, destination in (
+            (self.files, "files"),
+            (self.streams, "streams"),
+            (self.mtimes, "mtimes"),
+            (self.folders, "folders")
+        ):
+            self._share_db_writers[destination].update(source)
+            source.clear()
+
+    def spill_word_index(self):
+        """Write the current word index to a temporary run of sorted words,
+        merged with other runs once all shares are scanned."""
+
+        run_path = f"{self.new_share_db_paths['words']}.run{len(self._word_index_runs)}"
+        word_index_run = None
+        self._word_index_runs.append(run_path)
+
+        try:
+            word_index_run = Shares.create_db_file(run_path, WordIndexDatabase)
+
+            for word in sorted(self.word_index):
+                word_index_run[word] = self.word_index[word]
+
+        finally:
+            if word_index_run is not None:
+                word_index_run.close()
+
+        self.word_index.clear()
+
+    @staticmethod
+    def _merge_word_index_runs(word_index_runs):
+        """Merge runs of sorted words. File indices in earlier runs are lower,
+        so they are concatenated in the order of the runs."""
+
+        merged_items = heapq.merge(*(word_index_run.items() for word_index_run in word_index_runs), key=itemgetter(0))
+
+        for word, items in groupby(merged_items, key=itemgetter(0)):
+            file_indices = array(WordIndexDatabase.ARRAY_TYPECODE)
+
+            for _word, run_file_indices in items:
+                file_indices.frombytes(run_file_indices.cast("B"))
+                run_file_indices.release()
+
+            yield word, file_indices
+
+    def write_word_index(self):
+
+        if not self._word_index_runs:
+            self.set_shares(word_index=self.word_index)
+            self.word_index.clear()
+            return
+
+        self.spill_word_index()
+
+        word_index_runs = []
+        word_index = suffix_index = word_filter = None
+
+        try:
+            for run_path in self._word_index_runs:
+                word_index_runs.append(WordIndexDatabase(encode_path(run_path), overwrite=False))
+
+            word_index = Shares.create_db_file(self.new_share_db_paths["words"], WordIndexDatabase)
+            suffix_index = Shares.create_db_file(self.new_share_db_paths["word_suffixes"], SuffixIndex)
+            word_filter = Shares.create_db_file(self.new_share_db_paths["word_filter"], WordFilter)
+
+            for word, file_indices in self._merge_word_index_runs(word_index_runs):
+                word_index[word] = file_indices
+                suffix_index.update((word,))
+                word_filter.update((word,))
+
+        finally:
+            for share_db in (word_index, suffix_index, word_filter, *word_index_runs):
+                if share_db is not None:
+                    share_db.close()
+
+            for run_path in self._word_index_runs:
+                Shares.remove_db_file(run_path)
+
+            self._word_index_runs.clear()
+
+    @classmethod
+    def is_hidden(cls, folder, filename=None, entry=None):
+        """Stop sharing any dot/hidden folders/files."""
+
+        if filename is None:
+            last_folder = os.path.basename(folder)
+
+            if last_folder.startswith(".") or last_folder in cls.HIDDEN_FOLDER_NAMES:
+                return True
+
+        # If we're asked to check a file, we exclude it if it starts with a dot
+        if filename is not None and filename.startswith("."):
+            return True
+
+        # Check if file is marked as hidden on Windows
+        if sys.platform == "win32":
+            if len(folder) == 3 and folder[1] == ":" and folder[2] == os.sep:
+                # Root folders are marked as hidden, but we allow scanning them
+                return False
+
+            if entry is None:
+                if filename is not None:
+                    entry_stat = os.stat(encode_path(os.path.join(folder, filename)))
+                else:
+                    entry_stat = os.stat(encode_path(folder))
+            else:
+                entry_stat = entry.stat()
+
+            return entry_stat.st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN
+
+        return False
+
+    def add_subfolder(self, folder_paths, folder_path):
+
+        self.current_folder_count += 1
+        folder_paths.append(folder_path)
+
+        if not self.current_folder_count % 100:
+            self.send_progress()
+
+    def send_progress(self):
+        self.connection.send(
+            ScannerProgress(
+                num_folders=self.current_folder_count, num_files=self.current_file_index,
+                num_parsed_bytes=self.num_parsed_bytes, elapsed_time=(time.monotonic() - self._start_time)
+            )
+        )
+
+    def reuse_shared_folder(self, folder_paths, folder_path, virtual_folder_path, folder_mtime,
+                            old_mtimes, old_files, old_streams, old_folders):
+        """Reuse previous data of a folder whose contents have not been
+        added, removed or renamed since the last scan. Returns False if the
+        folder must be scanned again."""
+
+        old_folder_data = old_folders.get(folder_path)
+
+        if old_folder_data is None:
+            return False
+
+        old_folder_mtime, old_virtual_folder_path, subfolder_names, file_names = old_folder_data
+
+        if folder_mtime != old_folder_mtime:
+            return False
+
+        stream = old_streams.get(old_virtual_folder_path)
+
+        if stream is None:
+            return False
+
+        file_entries = []
+
+        for basename in file_names:
+            path = os.path.join(folder_path, basename)
+            full_path_file_data = old_files.get(path)
+            file_mtime = old_mtimes.get(path)
+
+            if full_path_file_data is None or file_mtime is None:
+                return False
+
+            virtual_file_path = f"{virtual_folder_path}\\{basename}"
+            full_path_file_data[0] = virtual_file_path  # Virtual name might have changed
+
+            self.mtimes[path] = file_mtime
+            file_entries.append((path, basename, virtual_file_path, full_path_file_data))
+
+        for basename in subfolder_names:
+            self.add_subfolder(folder_paths, os.path.join(folder_path, basename))
+
+        self.folders[folder_path] = [folder_mtime, virtual_folder_path, subfolder_names, file_names]
+        self._pending_folders.append((virtual_folder_path, file_entries, stream))
+        return True
+
+    def scan_shared_folder(self, shared_folder_path, old_mtimes, old_files, old_streams=None, old_folders=None):
+        """Scan a shared folder for all subfolders, files and their metadata."""
+
+        folder_paths = deque([shared_folder_path])
+        hash_contents = (self.file_hash_db_path is not None)
+
+        # Files shared before file hashes were enabled are hashed once, to fill the new cache
+        fill_file_hashes = (hash_contents and self.cached_file_hashes is None)
+        use_folder_mtimes = (self.incremental_rescan and not self.rebuild and not fill_file_hashes)
+
+        while folder_paths:
+            folder_path = folder_paths.pop()
+            virtual_folder_path = self.real2virtual(folder_path)
+
+            if virtual_folder_path in self.scanned_folder_paths:
+                # Sharing a folder twice, no go
+                continue
+
+            self.scanned_folder_paths.add(virtual_folder_path)
+
+            folder_mtime = None
+
+            if self.incremental_rescan:
+                try:
+                    # Retrieve modification time before listing contents, in case the folder changes
+                    folder_mtime = os.stat(encode_path(folder_path)).st_mtime
+
+                except OSError:
+                    pass
+
+            if (use_folder_mtimes and folder_mtime is not None and old_folders is not None
+                    and old_streams is not None
+                    and self.reuse_shared_folder(
+                        folder_paths, folder_path, virtual_folder_path, folder_mtime,
+                        old_mtimes, old_files, old_streams, old_folders)):
+                self._submit_pending_folders()
+                continue
+
+            file_entries = []
+            subfolder_names = []
+            file_names = []
+
+            try:
+                with os.scandir(encode_path(folder_path, prefix=False)) as entries:
                     for entry in entries:
                         basename = entry.name.decode("utf-8", "replace")
                         path = os.path.join(folder_path, basename)
@@ -544,146 +1892,699 @@ class Scanner:
                             if self.is_hidden(path, entry=entry):
                                 continue
 
-                            self.current_folder_count += 1
-                            folder_paths.append(path)
-
-                            if not self.current_folder_count % 100:
-                                self.queue.put(self.current_folder_count)
+                            subfolder_names.append(basename)
+                            self.add_subfolder(folder_paths, path)
                             continue
 
                         try:
                             if self.is_hidden(folder_path, basename, entry):
                                 continue
 
+                            if self.budget is not None:
+                                self.budget.consume(num_files=1)
+
                             file_stat = entry.stat()
-                            file_index = self.current_file_index
                             self.mtimes[path] = file_mtime = file_stat.st_mtime
+                            file_size = file_stat.st_size
                             virtual_file_path = f"{virtual_folder_path}\\{basename}"
+                            old_file_data = None
 
-                            if not self.rebuild and file_mtime == old_mtimes.get(path) and path in old_files:
-                                full_path_file_data = old_files[path]
+                            if not self.rebuild and file_mtime == old_mtimes.get(path):
+                                old_file_data = old_files.get(path)
+
+                            if old_file_data is not None and not (
+                                    fill_file_hashes and self.should_hash_file(path, file_size)):
+                                full_path_file_data = old_file_data
                                 full_path_file_data[0] = virtual_file_path  # Virtual name might have changed
                             else:
-                                full_path_file_data = self.get_file_info(virtual_file_path, path, file_stat)
+                                # Metadata is read later, possibly by a worker process. Unchanged files are
+                                # only hashed.
+                                full_path_file_data = None
+                                file_info = old_file_data[2:] if old_file_data is not None else None
+                                self._pending_tasks.append(
+                                    (virtual_file_path, path, file_size, hash_contents, file_info))
+
+                            file_entries.append((path, basename, virtual_file_path, full_path_file_data))
+                            file_names.append(basename)
+
+                        except OSError as error:
+                            self.connection.send(
+                                ScannerLogMessage(
+                                    _("Error while scanning file %(path)s: %(error)s"),
+                                    {"path": path, "error": error}
+                                )
+                            )
+
+                if folder_mtime is not None:
+                    self.folders[folder_path] = [folder_mtime, virtual_folder_path, subfolder_names, file_names]
+
+            except OSError as error:
+                self.connection.send(
+                    ScannerLogMessage(
+                        _("Error while scanning folder %(path)s: %(error)s"),
+                        {"path": folder_path, "error": error}
+                    )
+                )
+
+            # The folder's stream is added once metadata is available
+            self._pending_folders.append((virtual_folder_path, file_entries, None))
+            self._submit_pending_folders()
+
+        self._submit_pending_folders(flush=True)
+        self._finish_submitted_folders()
+
+    def _submit_pending_folders(self, flush=False):
+        """Start reading metadata for files in pending folders. When using
+        worker processes, metadata for the next batch is read while the
+        previous batch is processed."""
+
+        pending_folders = self._pending_folders
+        pending_tasks = self._pending_tasks
+
+        if not pending_folders:
+            return
+
+        if not flush and self._worker_pool is not None and len(pending_tasks) < self.WORKER_BATCH_SIZE:
+            return
+
+        self._pending_folders = []
+        self._pending_tasks = []
+
+        if self._worker_pool is None:
+            self._add_folders(pending_folders, (self.read_file_info(*task) for task in pending_tasks))
+            return
+
+        results = self._worker_pool.starmap_async(
+            self.read_file_info, pending_tasks, chunksize=self.WORKER_CHUNK_SIZE)
+
+        self._finish_submitted_folders()
+        self._submitted_batch = (pending_folders, results)
+
+    def _finish_submitted_folders(self):
+
+        if self._submitted_batch is None:
+            return
+
+        folders, results = self._submitted_batch
+        self._submitted_batch = None
+        self._add_folders(folders, iter(results.get()))
+
+    def _add_folders(self, folders, file_info_results):
+        """Add scanned folders and files to the share data, in the same order
+        they were scanned in."""
+
+        word_index = self.word_index
+        buffered_size = self._buffered_size
+        get_words = WordIndexDatabase.word_normalizer.get_words
+
+        for virtual_folder_path, file_entries, stream in folders:
+            file_list = []
+            share_stats = self.get_folder_share_stats(virtual_folder_path)
+            share_stats[0] += 1
+
+            for path, basename, virtual_file_path, full_path_file_data in file_entries:
+                if full_path_file_data is None:
+                    full_path_file_data, error, content_hash = next(file_info_results)
+                    self.num_parsed_bytes += full_path_file_data[1]
+
+                    if error is not None:
+                        self.connection.send(
+                            ScannerLogMessage(
+                                _("Error while scanning metadata for file %(path)s: %(error)s"),
+                                {"path": path, "error": error}
+                            )
+                        )
+
+                    elif content_hash is not None:
+                        _virtual_file_path, _size, quality, duration = full_path_file_data
+                        self.file_hashes[content_hash] = [quality, duration]
+                        buffered_size += self.FILE_HASH_ENTRY_SIZE
+
+                file_index = self.current_file_index
+                self.add_file_stats(share_stats, basename, full_path_file_data)
+
+                if stream is None:
+                    basename_file_data = full_path_file_data[:]
+                    basename_file_data[0] = basename
+                    file_list.append(basename_file_data)
+
+                for k in set(get_words(virtual_file_path)):
+                    if k not in word_index:
+                        buffered_size += len(k) + self.WORD_ENTRY_SIZE
+
+                    word_index[k].append(file_index)
+                    buffered_size += self.FILE_INDEX_SIZE
+
+                self.files[path] = full_path_file_data
+                self.current_file_index += 1
+                buffered_size += len(path) + self.FILE_ENTRY_SIZE
+
+            if stream is None:
+                stream = self.get_folder_stream(file_list)
+
+            self.streams[virtual_folder_path] = stream
+            buffered_size += len(stream)
+
+            if 0 < self.memory_limit < buffered_size:
+                self.flush_shares()
+                self.spill_word_index()
+                self.spill_file_hashes()
+                buffered_size = 0
+
+        self._buffered_size = buffered_size
+
+    def get_folder_share_stats(self, virtual_folder_path):
+        """Returns the statistics of the share a folder belongs to, as a list
+        of folder count, file count, total size, total duration and number of
+        files per file extension."""
+
+        virtual_name = virtual_folder_path.partition("\\")[0]
+        share_stats = self.share_stats.get(virtual_name)
+
+        if share_stats is None:
+            share_stats = self.share_stats[virtual_name] = [0, 0, 0, 0, {}]
+
+        return share_stats
+
+    @staticmethod
+    def add_file_stats(share_stats, basename, file_data):
+
+        _virtual_file_path, size, _quality, duration = file_data
+        file_extension = os.path.splitext(basename)[1][1:].lower()
+        file_extensions = share_stats[4]
+
+        share_stats[1] += 1
+        share_stats[2] += size
+
+        if duration:
+            share_stats[3] += duration
+
+        file_extensions[file_extension] = file_extensions.get(file_extension, 0) + 1
+
+    @staticmethod
+    def remove_file_stats(share_stats, basename, file_data):
+
+        _virtual_file_path, size, _quality, duration = file_data
+        file_extension = os.path.splitext(basename)[1][1:].lower()
+        file_extensions = share_stats[4]
+
+        share_stats[1] -= 1
+        share_stats[2] -= size
+
+        if duration:
+            share_stats[3] -= duration
+
+        num_files = file_extensions.get(file_extension, 0) - 1
+
+        if num_files > 0:
+            file_extensions[file_extension] = num_files
+        else:
+            file_extensions.pop(file_extension, None)
+
+    @classmethod
+    def get_audio_tag(cls, file_path, size):
+
+        parser_class = TinyTag._get_parser_for_filename(file_path)  # pylint: disable=protected-access
+
+        if parser_class is None:
+            return None
+
+        with open(encode_path(file_path), "rb") as file_handle:
+            if cls.budget is not None:
+                file_handle = BudgetedFile(file_handle, cls.budget)
+
+            tag = parser_class()
+            tag._filehandler = file_handle                          # pylint: disable=protected-access
+            tag.filesize = size
+            tag._load(tags=False, duration=True, image=False)       # pylint: disable=protected-access
+
+        return tag
+
+    @classmethod
+    def read_file_info(cls, virtual_file_path, file_path, size, hash_contents=False, file_info=None):
+        """Get file metadata, along with any error that occurred while reading
+        it and the hash of the file's contents, if requested. Metadata of
+        files with the same contents is reused from previous scans. If the
+        metadata is already known, the file is only hashed. Called from
+        worker processes when enabled."""
+
+        content_hash = None
+
+        if hash_contents and cls.should_hash_file(file_path, size):
+            try:
+                content_hash = cls.get_content_hash(file_path, size)
+
+            except OSError:
+                pass
+
+            if content_hash is not None and cls.cached_file_hashes is not None:
+                cached_file_info = cls.cached_file_hashes.get(content_hash)
+
+                if cached_file_info is not None:
+                    quality, duration = cached_file_info
+                    return [virtual_file_path, size, quality, duration], None, content_hash
+
+        if file_info is not None:
+            quality, duration = file_info
+            return [virtual_file_path, size, quality, duration], None, content_hash
+
+        tag = None
+        quality = None
+        duration = None
+        error = None
+
+        # We skip metadata scanning of files without meaningful content
+        if size > 128:
+            try:
+                tag = cls.get_audio_tag(file_path, size)
+
+            except Exception as tag_error:
+                error = str(tag_error)
+
+        if tag is not None:
+            bitrate = tag.bitrate
+            samplerate = tag.samplerate
+            bitdepth = tag.bitdepth
+            duration = tag.duration
+
+            if bitrate is not None:
+                bitrate = int(bitrate + 0.5)  # Round the value with minimal performance loss
 
-                            basename_file_data = full_path_file_data[:]
-                            basename_file_data[0] = basename
-                            file_list.append(basename_file_data)
+                if not UINT32_LIMIT > bitrate > 0:
+                    bitrate = None
+
+            if samplerate is not None:
+                samplerate = int(samplerate)
+
+                if not UINT32_LIMIT > samplerate > 0:
+                    samplerate = None
+
+            if bitdepth is not None:
+                bitdepth = int(bitdepth)
+
+                if not UINT32_LIMIT > bitdepth > 0:
+                    bitdepth = None
+
+            if duration is not None:
+                duration = int(duration)
+
+                if not UINT32_LIMIT > duration >= 0:
+                    duration = None
+
+            quality = (bitrate, int(tag.is_vbr), samplerate, bitdepth)
+
+        return [virtual_file_path, size, quality, duration], error, content_hash
+
+    @staticmethod
+    def get_folder_stream(file_list):
+        """Pack all files and metadata in folder."""
+
+        stream = bytearray()
+        stream += FileListMessage.pack_uint32(len(file_list))
+
+        for fileinfo in file_list:
+            stream += FileListMessage.pack_file_info(fileinfo)
+
+        return bytes(stream)
+
+
+class ShareWatcher:
+    """Watches shared folders for changes using inotify (Linux only), and
+    reports coalesced changes to be applied to the share databases without
+    a full rescan."""
+
+    __slots__ = ("share_groups", "callback", "delay", "_fd", "_folder_paths", "_watch_descriptors",
+                 "_folder_contents", "_libc", "_thread", "_is_active", "_reported_watch_error")
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+    EVENT_HEADER_SIZE = 16
+    UNPACK_EVENT_HEADER = Struct("iIII").unpack_from
+    COALESCE_DELAY = 2
+
+    def __init__(self, share_groups, callback, delay=COALESCE_DELAY):
+
+        self.share_groups = share_groups
+        self.callback = callback
+        self.delay = delay
+
+        self._fd = None
+        self._folder_paths = {}
+        self._watch_descriptors = {}
+        self._folder_contents = {}
+        self._libc = None
+        self._thread = None
+        self._is_active = False
+        self._reported_watch_error = False
+
+    @staticmethod
+    def is_supported():
+        return sys.platform == "linux"
+
+    def start(self):
+
+        import ctypes
+
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        self._is_active = True
+        self._thread = Thread(target=self._run, name="ShareWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._is_active = False
+
+    def _add_watch(self, folder_path):
+
+        import ctypes
+
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, encode_path(folder_path), self.WATCH_MASK)
+
+        if watch_descriptor < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), folder_path)
+
+        self._folder_paths[watch_descriptor] = folder_path
+        self._watch_descriptors[folder_path] = watch_descriptor
+
+    def _remove_watch(self, folder_path):
+
+        watch_descriptor = self._watch_descriptors.pop(folder_path, None)
+
+        if watch_descriptor is None:
+            return
+
+        if self._folder_paths.get(watch_descriptor) == folder_path:
+            del self._folder_paths[watch_descriptor]
+
+        self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+
+    @staticmethod
+    def _list_folder(folder_path):
+
+        file_names = set()
+        subfolder_names = set()
+
+        with os.scandir(encode_path(folder_path, prefix=False)) as entries:
+            for entry in entries:
+                basename = entry.name.decode("utf-8", "replace")
+
+                if entry.is_dir():
+                    if not Scanner.is_hidden(os.path.join(folder_path, basename), entry=entry):
+                        subfolder_names.add(basename)
+                    continue
+
+                if not Scanner.is_hidden(folder_path, basename, entry):
+                    file_names.add(basename)
+
+        return file_names, subfolder_names
+
+    def _watch_folder_tree(self, root_folder_path, new_folder_paths=None):
+        """Start watching a folder and its subfolders. If new_folder_paths is
+        provided, the folders are treated as new, and all their files will be
+        reported as added."""
+
+        folder_paths = deque([root_folder_path])
+
+        while folder_paths:
+            folder_path = folder_paths.pop()
+
+            if folder_path in self._watch_descriptors:
+                continue
+
+            try:
+                self._add_watch(folder_path)
+
+            except OSError as error:
+                if self._reported_watch_error:
+                    log.add_debug("Failed to watch shared folder %s: %s", (folder_path, error))
+                    continue
+
+                # Usually caused by reaching the inotify watch limit, only report it once
+                log.add(_("Cannot watch shared folder %(path)s for changes, live updates of shares are "
+                          "incomplete until the next rescan: %(error)s"), {"path": folder_path, "error": error})
+                self._reported_watch_error = True
+                continue
+
+            try:
+                file_names, subfolder_names = self._list_folder(folder_path)
+
+            except OSError as error:
+                # Folder was removed after watching it
+                log.add_debug("Failed to list shared folder %s: %s", (folder_path, error))
+                self._remove_watch(folder_path)
+                continue
+
+            if new_folder_paths is not None:
+                new_folder_paths.append(folder_path)
+                file_names = set()
+
+            self._folder_contents[folder_path] = (file_names, subfolder_names)
+
+            for basename in subfolder_names:
+                folder_paths.append(os.path.join(folder_path, basename))
+
+    def _unwatch_folder_tree(self, root_folder_path, removed_folders):
+
+        folder_paths = deque([root_folder_path])
+
+        while folder_paths:
+            folder_path = folder_paths.pop()
+            folder_contents = self._folder_contents.pop(folder_path, None)
+            self._remove_watch(folder_path)
+
+            if folder_contents is None:
+                continue
+
+            file_names, subfolder_names = folder_contents
+            removed_folders.append((folder_path, file_names))
+
+            for basename in subfolder_names:
+                folder_paths.append(os.path.join(folder_path, basename))
+
+    def _collect_changes(self, dirty_folder_paths, written_file_paths, moved_paths):
+        """List dirty folders again, and read metadata of added and modified
+        files."""
+
+        updated_folders = []
+        removed_folders = []
+        new_folder_paths = []
+        folder_listings = []
+
+        for folder_path in sorted(dirty_folder_paths):
+            folder_contents = self._folder_contents.get(folder_path)
+
+            if folder_contents is None:
+                continue
+
+            old_file_names, old_subfolder_names = folder_contents
+
+            try:
+                file_names, subfolder_names = self._list_folder(folder_path)
+
+            except OSError:
+                # Folder was removed, handled when listing its parent folder
+                continue
+
+            for basename in old_subfolder_names - subfolder_names:
+                self._unwatch_folder_tree(os.path.join(folder_path, basename), removed_folders)
+
+            folder_listings.append((folder_path, file_names, subfolder_names, old_file_names, old_subfolder_names))
+
+        # Watch new subfolders after removing old watches, since watches follow renamed folders
+        for folder_path, file_names, subfolder_names, old_file_names, old_subfolder_names in folder_listings:
+            if folder_path not in self._folder_contents:
+                # Parent folder of this folder was removed
+                continue
+
+            for basename in subfolder_names - old_subfolder_names:
+                self._watch_folder_tree(os.path.join(folder_path, basename), new_folder_paths)
+
+            self._folder_contents[folder_path] = (file_names, subfolder_names)
+            updated_folders.append(
+                self._get_folder_changes(
+                    folder_path, file_names, old_file_names, written_file_paths, moved_paths)
+            )
+
+        for folder_path in new_folder_paths:
+            try:
+                file_names, _subfolder_names = self._list_folder(folder_path)
+
+            except OSError:
+                continue
+
+            # Files in renamed folders keep their previous metadata
+            old_folder_path = next(
+                (moved_paths[path] + folder_path[len(path):] for path in moved_paths
+                 if folder_path == path or folder_path.startswith(path + os.sep)), None
+            )
+            if old_folder_path is not None:
+                for basename in file_names:
+                    moved_paths[os.path.join(folder_path, basename)] = os.path.join(old_folder_path, basename)
+
+            self._folder_contents[folder_path] = (file_names, self._folder_contents[folder_path][1])
+            updated_folders.append(
+                self._get_folder_changes(folder_path, file_names, set(), written_file_paths, moved_paths)
+            )
+
+        return updated_folders, removed_folders
+
+    @staticmethod
+    def _get_folder_changes(folder_path, file_names, old_file_names, written_file_paths, moved_paths):
+
+        file_entries = []
+
+        for basename in file_names:
+            file_path = os.path.join(folder_path, basename)
+            old_file_path = moved_paths.get(file_path)
+
+            if old_file_path is not None and file_path not in written_file_paths:
+                # Moved file, reuse previous metadata
+                file_entries.append((basename, None, old_file_path))
+
+            elif basename in old_file_names and file_path not in written_file_paths:
+                # Unchanged file
+                file_entries.append((basename, None, None))
+
+            else:
+                # Only added and modified files are stat'ed
+                try:
+                    size = os.stat(encode_path(file_path)).st_size
 
-                            for k in set(virtual_file_path.lower().translate(TRANSLATE_PUNCTUATION).split()):
-                                self.word_index[k].append(file_index)
+                except OSError:
+                    # File was removed after listing its folder
+                    continue
 
-                            self.files[path] = full_path_file_data
-                            self.current_file_index += 1
+                file_data, _error, _content_hash = Scanner.read_file_info(file_path, file_path, size)
+                file_entries.append((basename, file_data, None))
 
-                        except OSError as error:
-                            self.queue.put(
-                                ScannerLogMessage(
-                                    _("Error while scanning file %(path)s: %(error)s"),
-                                    {"path": path, "error": error}
-                                )
-                            )
+        return folder_path, file_entries, old_file_names - file_names
 
-            except OSError as error:
-                self.queue.put(
-                    ScannerLogMessage(
-                        _("Error while scanning folder %(path)s: %(error)s"),
-                        {"path": folder_path, "error": error}
-                    )
-                )
+    def _read_events(self, dirty_folder_paths, written_file_paths, moved_paths, pending_moves):
 
-            self.streams[virtual_folder_path] = self.get_folder_stream(file_list)
+        try:
+            data = os.read(self._fd, 65536)
 
-    def get_audio_tag(self, file_path, size):
+        except BlockingIOError:
+            return
 
-        parser_class = TinyTag._get_parser_for_filename(file_path)  # pylint: disable=protected-access
+        offset = 0
 
-        if parser_class is None:
-            return None
+        while offset < len(data):
+            watch_descriptor, mask, cookie, name_length = self.UNPACK_EVENT_HEADER(data, offset)
+            offset += self.EVENT_HEADER_SIZE
+            basename = data[offset:offset + name_length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += name_length
 
-        with open(encode_path(file_path), "rb") as file_handle:
-            tag = parser_class()
-            tag._filehandler = file_handle                          # pylint: disable=protected-access
-            tag.filesize = size
-            tag._load(tags=False, duration=True, image=False)       # pylint: disable=protected-access
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, check all folders
+                dirty_folder_paths.update(self._folder_contents)
+                continue
 
-        return tag
+            folder_path = self._folder_paths.get(watch_descriptor)
 
-    def get_file_info(self, virtual_file_path, file_path, file_stat):
-        """Get file metadata."""
+            if folder_path is None:
+                continue
 
-        tag = None
-        quality = None
-        duration = None
-        size = file_stat.st_size
+            if mask & self.IN_IGNORED:
+                self._folder_paths.pop(watch_descriptor, None)
+                continue
 
-        # We skip metadata scanning of files without meaningful content
-        if size > 128:
-            try:
-                tag = self.get_audio_tag(file_path, size)
+            path = os.path.join(folder_path, basename)
+            dirty_folder_paths.add(folder_path)
 
-            except Exception as error:
-                self.queue.put(
-                    ScannerLogMessage(
-                        _("Error while scanning metadata for file %(path)s: %(error)s"),
-                        {"path": file_path, "error": error}
-                    )
-                )
+            if mask & self.IN_CLOSE_WRITE:
+                written_file_paths.add(path)
 
-        if tag is not None:
-            bitrate = tag.bitrate
-            samplerate = tag.samplerate
-            bitdepth = tag.bitdepth
-            duration = tag.duration
+            elif mask & self.IN_MOVED_FROM:
+                pending_moves[cookie] = path
 
-            if bitrate is not None:
-                bitrate = int(bitrate + 0.5)  # Round the value with minimal performance loss
+            elif mask & self.IN_MOVED_TO:
+                old_path = pending_moves.pop(cookie, None)
 
-                if not UINT32_LIMIT > bitrate > 0:
-                    bitrate = None
+                if old_path is not None:
+                    moved_paths[path] = old_path
 
-            if samplerate is not None:
-                samplerate = int(samplerate)
+    def _run(self):
 
-                if not UINT32_LIMIT > samplerate > 0:
-                    samplerate = None
+        import select
 
-            if bitdepth is not None:
-                bitdepth = int(bitdepth)
+        try:
+            for shared_folder_paths in self.share_groups:
+                for _virtual_name, folder_path, *_unused in shared_folder_paths:
+                    self._watch_folder_tree(folder_path)
 
-                if not UINT32_LIMIT > bitdepth > 0:
-                    bitdepth = None
+            dirty_folder_paths = set()
+            written_file_paths = set()
+            moved_paths = {}
+            pending_moves = {}
+            last_event_time = None
 
-            if duration is not None:
-                duration = int(duration)
+            while self._is_active:
+                readable, _writable, _exceptional = select.select([self._fd], [], [], min(self.delay, 1))
 
-                if not UINT32_LIMIT > duration >= 0:
-                    duration = None
+                if readable:
+                    self._read_events(dirty_folder_paths, written_file_paths, moved_paths, pending_moves)
+                    last_event_time = time.monotonic()
+                    continue
 
-            quality = (bitrate, int(tag.is_vbr), samplerate, bitdepth)
+                if not dirty_folder_paths or time.monotonic() - last_event_time < self.delay:
+                    continue
 
-        return [virtual_file_path, size, quality, duration]
+                updated_folders, removed_folders = self._collect_changes(
+                    dirty_folder_paths, written_file_paths, moved_paths)
 
-    @staticmethod
-    def get_folder_stream(file_list):
-        """Pack all files and metadata in folder."""
+                for collection in (dirty_folder_paths, written_file_paths, moved_paths, pending_moves):
+                    collection.clear()
 
-        stream = bytearray()
-        stream += FileListMessage.pack_uint32(len(file_list))
+                if self._is_active and (updated_folders or removed_folders):
+                    self.callback(updated_folders, removed_folders)
 
-        for fileinfo in file_list:
-            stream += FileListMessage.pack_file_info(fileinfo)
+        except Exception as error:
+            log.add(_("Stopped watching shared folders due to an error: %s"), error)
 
-        return bytes(stream)
+        finally:
+            os.close(self._fd)
+            self._is_active = False
 
 
 class Shares:
-    __slots__ = ("share_dbs", "requested_share_times", "initialized", "rescanning", "compressed_shares",
-                 "share_db_paths", "file_path_index", "_scanner_process")
+    __slots__ = ("share_dbs", "share_dbs_lock", "requested_share_times", "initialized", "rescanning",
+                 "compressed_shares", "share_db_paths", "shared_file_list_paths", "file_hash_db_path",
+                 "file_path_index", "scan_progress", "_scanner_process", "_share_watcher", "_pending_share_changes",
+                 "_compressed_streams", "_outdated_permission_levels")
+
+    DATABASE_CLASSES = {
+        "public_files": FileDatabase,
+        "buddy_files": FileDatabase,
+        "trusted_files": FileDatabase,
+        "words": WordIndexDatabase,
+        "word_suffixes": SuffixIndex,
+        "word_filter": WordFilter,
+        "file_paths": FilePathIndex
+    }
+    LOADED_DESTINATIONS = {
+        "words", "word_suffixes", "word_filter", "file_paths", "public_files", "public_streams", "public_stats",
+        "buddy_files", "buddy_streams", "buddy_stats", "trusted_files", "trusted_streams", "trusted_stats"
+    }
 
     def __init__(self):
 
         self.share_dbs = {}
+        self.share_dbs_lock = Lock()
         self.requested_share_times = {}
         self.initialized = False
         self.rescanning = False
@@ -695,19 +2596,39 @@ class Shares:
         }
         self.share_db_paths = {
             "words": os.path.join(config.data_folder_path, "words.dbn"),
+            "word_suffixes": os.path.join(config.data_folder_path, "wordsuffixes.dbn"),
+            "word_filter": os.path.join(config.data_folder_path, "wordfilter.dbn"),
+            "file_paths": os.path.join(config.data_folder_path, "filepaths.dbn"),
             "public_files": os.path.join(config.data_folder_path, "publicfiles.dbn"),
             "public_mtimes": os.path.join(config.data_folder_path, "publicmtimes.dbn"),
             "public_streams": os.path.join(config.data_folder_path, "publicstreams.dbn"),
+            "public_folders": os.path.join(config.data_folder_path, "publicfolders.dbn"),
+            "public_stats": os.path.join(config.data_folder_path, "publicstats.dbn"),
             "buddy_files": os.path.join(config.data_folder_path, "buddyfiles.dbn"),
             "buddy_mtimes": os.path.join(config.data_folder_path, "buddymtimes.dbn"),
             "buddy_streams": os.path.join(config.data_folder_path, "buddystreams.dbn"),
+            "buddy_folders": os.path.join(config.data_folder_path, "buddyfolders.dbn"),
+            "buddy_stats": os.path.join(config.data_folder_path, "buddystats.dbn"),
             "trusted_files": os.path.join(config.data_folder_path, "trustedfiles.dbn"),
             "trusted_mtimes": os.path.join(config.data_folder_path, "trustedmtimes.dbn"),
-            "trusted_streams": os.path.join(config.data_folder_path, "trustedstreams.dbn")
+            "trusted_streams": os.path.join(config.data_folder_path, "trustedstreams.dbn"),
+            "trusted_folders": os.path.join(config.data_folder_path, "trustedfolders.dbn"),
+            "trusted_stats": os.path.join(config.data_folder_path, "trustedstats.dbn")
+        }
+        self.shared_file_list_paths = {
+            PermissionLevel.PUBLIC: os.path.join(config.data_folder_path, "publicfilelist.dbn"),
+            PermissionLevel.BUDDY: os.path.join(config.data_folder_path, "buddyfilelist.dbn"),
+            PermissionLevel.TRUSTED: os.path.join(config.data_folder_path, "trustedfilelist.dbn")
         }
+        self.file_hash_db_path = os.path.join(config.data_folder_path, "filehashes.dbn")
         self.file_path_index = ()
+        self.scan_progress = None
 
         self._scanner_process = None
+        self._share_watcher = None
+        self._pending_share_changes = []
+        self._compressed_streams = {}
+        self._outdated_permission_levels = set()
 
         for event_name, callback in (
             ("folder-contents-request", self._folder_contents_request),
@@ -715,6 +2636,7 @@ class Shares:
             ("server-disconnect", self._server_disconnect),
             ("server-login", self._server_login),
             ("shared-file-list-request", self._shared_file_list_request),
+            ("shares-initialized", self._shares_initialized),
             ("shares-ready", self._shares_ready),
             ("start", self._start)
         ):
@@ -730,7 +2652,14 @@ class Shares:
 
     def _quit(self):
 
-        self.close_shares(self.share_dbs)
+        self._stop_share_watcher()
+        self._pending_share_changes.clear()
+        self._compressed_streams.clear()
+        self._outdated_permission_levels.clear()
+
+        with self.share_dbs_lock:
+            self.close_shares(self.share_dbs)
+
         self.initialized = False
 
         if self._scanner_process is not None:
@@ -745,10 +2674,112 @@ class Shares:
 
     # Shares-related Actions #
 
+    @staticmethod
+    def get_new_share_db_paths(share_db_paths):
+        """Paths of databases written by the scanner, before they replace the
+        databases currently in use."""
+        return {destination: f"{db_path}.new" for destination, db_path in share_db_paths.items()}
+
+    def replace_share_dbs(self):
+        """Replace share databases with new ones written by the scanner. Share
+        databases must be closed first. Replaced databases are kept as backups
+        until removed, and restored if a database cannot be replaced.
+
+        Returns the paths of replaced databases, along with the paths of their
+        backups.
+        """
+
+        replaced_db_paths = {}
+
+        try:
+            for destination, new_db_path in self.get_new_share_db_paths(self.share_db_paths).items():
+                new_db_path_encoded = encode_path(new_db_path)
+
+                if not os.path.isfile(new_db_path_encoded):
+                    continue
+
+                db_path = self.share_db_paths[destination]
+                db_path_encoded = encode_path(db_path)
+                old_db_path = None
+
+                if os.path.isfile(db_path_encoded):
+                    old_db_path = f"{db_path}.old"
+                    os.replace(db_path_encoded, encode_path(old_db_path))
+
+                replaced_db_paths[db_path] = old_db_path
+                os.replace(new_db_path_encoded, db_path_encoded)
+
+        except OSError:
+            self.restore_share_dbs(replaced_db_paths)
+            raise
+
+        return replaced_db_paths
+
+    def restore_share_dbs(self, replaced_db_paths):
+        """Restore databases replaced by new ones, using their backups. Share
+        databases must be closed first."""
+
+        for db_path, old_db_path in replaced_db_paths.items():
+            try:
+                if old_db_path is None:
+                    # No previous database
+                    self.remove_db_file(db_path)
+                else:
+                    os.replace(encode_path(old_db_path), encode_path(db_path))
+
+            except OSError as error:
+                log.add(_("Failed to restore previous share database %(path)s: %(error)s"), {
+                    "path": db_path,
+                    "error": error
+                })
+
+    def remove_new_share_dbs(self):
+
+        for new_db_path in self.get_new_share_db_paths(self.share_db_paths).values():
+            self.remove_db_file(new_db_path)
+
+        for new_file_path in self.get_new_share_db_paths(self.shared_file_list_paths).values():
+            self.remove_db_file(new_file_path)
+
+    def replace_shared_file_lists(self):
+        """Replace lists of shared files sent to peers with new ones written by
+        the scanner, once the new databases are in use."""
+
+        for permission_level, new_file_path in self.get_new_share_db_paths(self.shared_file_list_paths).items():
+            new_file_path_encoded = encode_path(new_file_path)
+
+            if not os.path.isfile(new_file_path_encoded):
+                continue
+
+            file_path = self.shared_file_list_paths[permission_level]
+
+            try:
+                os.replace(new_file_path_encoded, encode_path(file_path))
+
+            except OSError:
+                # Previous file is still open on Windows, send the new file instead
+                file_path = new_file_path
+
+            self._load_shared_file_list(permission_level, file_path)
+
+    def remove_old_share_dbs(self):
+
+        for db_path in self.share_db_paths.values():
+            try:
+                self.remove_db_file(f"{db_path}.old")
+
+            except OSError as error:
+                log.add_debug("Failed to remove old share database %s: %s", (db_path, error))
+
+    def is_ready(self):
+        """Returns False while rescanning, unless databases of a previous scan
+        are still in use."""
+        return not self.rescanning or "public_files" in self.share_dbs
+
     @classmethod
-    def create_db_file(cls, db_path):
+    def create_db_file(cls, db_path, database_class=Database):
         cls.remove_db_file(db_path)
-        return Database(encode_path(db_path))
+        return database_class(encode_path(db_path))
 
     @staticmethod
     def remove_db_file(db_path):
@@ -828,7 +2859,8 @@ class Shares:
                 continue
 
             try:
-                share_dbs[destination] = Database(encode_path(db_path), overwrite=False)
+                database_class = cls.DATABASE_CLASSES.get(destination, Database)
+                share_dbs[destination] = database_class(encode_path(db_path), overwrite=False)
 
             except Exception as error:
                 exception = error
@@ -991,6 +3023,46 @@ class Shares:
             if database is not None:
                 database.close()
 
+    def get_share_stats(self, permission_level):
+        """Returns statistics of shares visible to a permission level, summed
+        from statistics stored for each share while scanning. Returns None if
+        statistics are unavailable."""
+
+        if permission_level == PermissionLevel.BANNED:
+            permission_levels = ()
+
+        elif permission_level == PermissionLevel.TRUSTED:
+            permission_levels = (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED)
+
+        else:
+            permission_levels = [PermissionLevel.PUBLIC]
+
+            if permission_level == PermissionLevel.BUDDY or config.sections["transfers"]["reveal_buddy_shares"]:
+                permission_levels.append(PermissionLevel.BUDDY)
+
+            if config.sections["transfers"]["reveal_trusted_shares"]:
+                permission_levels.append(PermissionLevel.TRUSTED)
+
+        stats = {"dirs": 0, "files": 0, "shared_size": 0, "duration": 0, "file_extensions": {}}
+        file_extensions = stats["file_extensions"]
+
+        for level in permission_levels:
+            share_stats = self.share_dbs.get(f"{level}_stats")
+
+            if share_stats is None:
+                return None
+
+            for _virtual_name, (num_folders, num_files, shared_size, duration, extensions) in share_stats.items():
+                stats["dirs"] += num_folders
+                stats["files"] += num_files
+                stats["shared_size"] += shared_size
+                stats["duration"] += duration
+
+                for file_extension, num_extension_files in extensions.items():
+                    file_extensions[file_extension] = file_extensions.get(file_extension, 0) + num_extension_files
+
+        return stats
+
     def send_num_shared_folders_files(self):
         """Send number of publicly shared files to the server."""
 
@@ -1052,25 +3124,27 @@ class Shares:
                 if not init:
                     return None
 
-        # Hand over database control to the scanner process
+        # The scanner process writes new databases, previous ones are used until it's done
         self.rescanning = True
-        self.close_shares(self.share_dbs)
-        self.file_path_index = ()
 
         events.emit("shares-preparing")
 
         share_groups = self.get_shared_folders()
-        self._scanner_process, scanner_queue = self._build_scanner_process(share_groups, init, rescan, rebuild)
+        self._scanner_process, scanner_connection, process_connection = self._build_scanner_process(
+            share_groups, init, rescan, rebuild)
         self._scanner_process.start()
 
+        # Only the scanner process writes to the pipe, close our copy to detect when it exits
+        process_connection.close()
+
         if use_thread:
             Thread(
-                target=self._process_scanner, args=(scanner_queue, events.emit_main_thread),
+                target=self._process_scanner, args=(scanner_connection, events.emit_main_thread),
                 name="ProcessShareScanner", daemon=True
             ).start()
             return None
 
-        return self._process_scanner(scanner_queue)
+        return self._process_scanner(scanner_connection)
 
     def check_shares_available(self):
 
@@ -1089,84 +3163,441 @@ class Shares:
         import multiprocessing
 
         context = multiprocessing.get_context(method="spawn")
-        scanner_queue = context.Queue()
+        scanner_connection, process_connection = context.Pipe(duplex=False)
+        num_workers = config.sections["transfers"]["scanner_workers"]
+
+        if num_workers <= 0:
+            num_workers = os.cpu_count() or 1
+
         scanner_obj = Scanner(
-            scanner_queue,
+            process_connection,
             share_groups,
             self.share_db_paths,
+            self.shared_file_list_paths,
             init,
             rescan,
             rebuild,
             reveal_buddy_shares=config.sections["transfers"]["reveal_buddy_shares"],
-            reveal_trusted_shares=config.sections["transfers"]["reveal_trusted_shares"]
+            reveal_trusted_shares=config.sections["transfers"]["reveal_trusted_shares"],
+            num_workers=num_workers,
+            incremental_rescan=config.sections["transfers"]["incremental_rescan"],
+            file_hash_db_path=self.file_hash_db_path if config.sections["transfers"]["hash_shared_files"] else None,
+            low_priority=config.sections["transfers"]["scanner_low_priority"],
+            max_read_speed=config.sections["transfers"]["scanner_max_read_speed"] * 1024,
+            max_files_per_second=config.sections["transfers"]["scanner_max_files_per_second"],
+            memory_limit=config.sections["transfers"]["scanner_memory_limit"] * 1048576
         )
-        scanner = context.Process(target=scanner_obj.run, daemon=True)
-        return scanner, scanner_queue
+        # Daemonic processes are not allowed to start the metadata worker pool
+        scanner = context.Process(target=scanner_obj.run, daemon=(num_workers <= 1))
+        return scanner, scanner_connection, process_connection
+
+    def get_shared_file_list(self, permission_level):
+        """Get the compressed list of shared files sent when browsing shares.
+        Lists changed by the share watcher are rebuilt first."""
+
+        if self._outdated_permission_levels:
+            self._rebuild_shared_file_lists()
+
+        return self.compressed_shares.get(permission_level)
+
+    def _rebuild_shared_file_lists(self):
+        """Rebuild lists of shared files from streams patched by the share
+        watcher. Streams of each permission level are compressed again only
+        when they change."""
+
+        permission_levels = (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED)
+        compressed_streams = self._compressed_streams
+
+        for permission_level in permission_levels:
+            shared_streams = self.share_dbs.get(f"{permission_level}_streams")
+
+            if shared_streams is None:
+                return
+
+            if permission_level in self._outdated_permission_levels or permission_level not in compressed_streams:
+                compressed_streams[permission_level] = SharedFileListResponse.compress_shares(shared_streams)
+
+        self._outdated_permission_levels.clear()
+
+        for permission_level in permission_levels:
+            self.compressed_shares[permission_level] = Scanner.get_shared_file_list_message(
+                permission_level, compressed_streams,
+                reveal_buddy_shares=config.sections["transfers"]["reveal_buddy_shares"],
+                reveal_trusted_shares=config.sections["transfers"]["reveal_trusted_shares"]
+            )
+
+    def _load_shared_file_list(self, permission_level, file_path):
+
+        if file_path == self.shared_file_list_paths[permission_level]:
+            # Sent to peers straight from disk
+            self.compressed_shares[permission_level] = SharedFileListResponse(
+                permission_level=permission_level, file_path=file_path)
+            return
 
-    def _process_scanner(self, scanner_queue, emit_event=None):
+        # Scanner was unable to replace the previous file, keep the new one in memory
+        compressed_shares = SharedFileListResponse(permission_level=permission_level)
+
+        with open(encode_path(file_path), "rb") as file_handle:
+            compressed_shares.built = file_handle.read()
+
+        self.compressed_shares[permission_level] = compressed_shares
+        self.remove_db_file(file_path)
+
+    def _process_scanner(self, scanner_connection, emit_event=None):
+
+        from multiprocessing.connection import wait
 
         successful = True
+        scanner_sentinel = self._scanner_process.sentinel
+        self.scan_progress = None
+
+        with scanner_connection:
+            while True:
+                # Sleep until the scanner sends something or exits
+                wait((scanner_connection, scanner_sentinel))
 
-        while self._scanner_process.is_alive():
-            # Cooldown
-            time.sleep(0.05)
+                try:
+                    while scanner_connection.poll():
+                        item = scanner_connection.recv()
 
-            while not scanner_queue.empty():
-                item = scanner_queue.get()
+                        if item == ScannerState.FAILURE:
+                            successful = False
 
-                if item == ScannerState.FAILURE:
-                    successful = False
-                    break
+                        elif isinstance(item, ScannerProgress):
+                            self.scan_progress = item
 
-                if isinstance(item, int):
-                    if emit_event is not None:
-                        emit_event("shares-scanning", item)
+                            if emit_event is not None:
+                                emit_event("shares-scanning", item.num_folders)
 
-                elif isinstance(item, ScannerLogMessage):
-                    log.add(item.msg, item.msg_args)
+                        elif isinstance(item, ScannerLogMessage):
+                            log.add(item.msg, item.msg_args)
 
-                elif isinstance(item, tuple):
-                    self.file_path_index = item
+                        elif isinstance(item, ScannerSharedFileList):
+                            self._load_shared_file_list(item.permission_level, item.file_path)
 
-                elif isinstance(item, SharedFileListResponse):
-                    self.compressed_shares[item.permission_level] = item
+                        elif item == ScannerState.RESCANNING:
+                            if emit_event is not None:
+                                emit_event("shares-scanning")
 
-                elif item == ScannerState.RESCANNING:
-                    if emit_event is not None:
-                        emit_event("shares-scanning")
+                        elif item == ScannerState.INITIALIZED:
+                            self.initialized = True
 
-                elif item == ScannerState.INITIALIZED:
-                    self.initialized = True
+                            if emit_event is not None:
+                                emit_event("shares-initialized")
+                            else:
+                                self._shares_initialized()
+
+                except (EOFError, OSError):
+                    # Scanner process exited
+                    break
 
+        self._scanner_process.join()
         self._scanner_process = None
 
+        if self.scan_progress is not None:
+            log.add_debug(("Scanned %(num_folders)s folders and %(num_files)s files in %(time).1f seconds "
+                           "(%(folders_per_second).1f folders/s, %(files_per_second).1f files/s, "
+                           "%(parsed_bytes_per_second).0f bytes/s parsed)"), {
+                "num_folders": self.scan_progress.num_folders,
+                "num_files": self.scan_progress.num_files,
+                "time": self.scan_progress.elapsed_time,
+                "folders_per_second": self.scan_progress.folders_per_second,
+                "files_per_second": self.scan_progress.files_per_second,
+                "parsed_bytes_per_second": self.scan_progress.parsed_bytes_per_second
+            })
+
         if emit_event is not None:
             emit_event("shares-ready", successful)
 
         return successful
 
-    def _shares_ready(self, successful):
+    def _shares_initialized(self):
+        """Serve databases of the previous scan while rescanning on startup,
+        until the new databases replace them. Changes to shared folders made
+        while rescanning are applied afterwards."""
 
-        # Scanning done, load shares in the main process again
-        if successful:
+        self._start_share_watcher()
+
+        if "public_files" in self.share_dbs:
+            return
+
+        with self.share_dbs_lock:
             try:
-                self.load_shares(
-                    self.share_dbs, self.share_db_paths, destinations={
-                        "words", "public_files", "public_streams", "buddy_files", "buddy_streams",
-                        "trusted_files", "trusted_streams"
-                    })
+                self.load_shares(self.share_dbs, self.share_db_paths, destinations=self.LOADED_DESTINATIONS)
+                self.file_path_index = self.share_dbs["file_paths"]
 
             except Exception:
-                successful = False
+                # Databases are recreated by the scanner
+                self.file_path_index = ()
+
+    def _swap_share_dbs(self):
+        """Replace databases in use with new ones written by the scanner. If
+        the new databases cannot be used, previous databases are restored and
+        loaded again."""
+
+        self.close_shares(self.share_dbs)
+        self.file_path_index = ()
+        self._compressed_streams.clear()
+        self._outdated_permission_levels.clear()
+        replaced_db_paths = {}
+
+        try:
+            replaced_db_paths = self.replace_share_dbs()
+            self.load_shares(self.share_dbs, self.share_db_paths, destinations=self.LOADED_DESTINATIONS)
+
+        except Exception as error:
+            log.add(_("Failed to replace shares with rescanned shares, previously scanned shares are still "
+                      "shared: %s"), error)
+            self.restore_share_dbs(replaced_db_paths)
+            self.remove_new_share_dbs()
+
+            try:
+                self.load_shares(self.share_dbs, self.share_db_paths, destinations=self.LOADED_DESTINATIONS)
+                self.file_path_index = self.share_dbs["file_paths"]
+
+            except Exception as load_error:
+                log.add(_("Failed to load previously scanned shares, please rescan shares: %s"), load_error)
+
+            return False
+
+        self.file_path_index = self.share_dbs["file_paths"]
+        self.remove_old_share_dbs()
+        self.replace_shared_file_lists()
+        return True
+
+    def _shares_ready(self, successful):
+
+        if successful:
+            # Scanning done, swap in the new databases. Search requests are matched in a
+            # separate thread, wait until it's done reading the previous databases.
+            with self.share_dbs_lock:
+                successful = self._swap_share_dbs()
+        else:
+            # Keep using the previous databases
+            log.add(_("Rescan failed, previously scanned shares are still shared"))
+            self.remove_new_share_dbs()
 
         self.rescanning = False
 
-        if not successful:
-            self.file_path_index = ()
+        if successful:
+            self.send_num_shared_folders_files()
+
+        self._start_share_watcher()
+
+        # Apply changes to shared folders reported while rescanning
+        pending_share_changes = self._pending_share_changes
+        self._pending_share_changes = []
+
+        for updated_folders, removed_folders in pending_share_changes:
+            self.update_shared_folders(updated_folders, removed_folders)
+
+    # Watching #
+
+    def _start_share_watcher(self):
+
+        share_groups = tuple(list(shared_folders) for shared_folders in self.get_shared_folders())
+        watch_shares = config.sections["transfers"]["watch_shares"] and ShareWatcher.is_supported()
+
+        if self._share_watcher is not None:
+            if watch_shares and self._share_watcher.share_groups == share_groups:
+                # Shared folders are unchanged, keep watching them
+                return
+
+            self._stop_share_watcher()
+
+        if not watch_shares:
+            return
+
+        self._share_watcher = ShareWatcher(share_groups, callback=self._share_watcher_changes)
+
+        try:
+            self._share_watcher.start()
+
+        except OSError as error:
+            log.add(_("Cannot watch shared folders for changes: %s"), error)
+            self._share_watcher = None
+
+    def _stop_share_watcher(self):
+
+        if self._share_watcher is None:
+            return
+
+        self._share_watcher.stop()
+        self._share_watcher = None
+
+    def _share_watcher_changes(self, updated_folders, removed_folders):
+        events.invoke_main_thread(self.update_shared_folders, updated_folders, removed_folders)
+
+    def _find_shared_folder(self, real_path):
+        """Returns the permission level and virtual path of a path inside a
+        shared folder."""
+
+        for permission_level, shared_folders in zip(
+            (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED),
+            self.get_shared_folders()
+        ):
+            for virtual_name, folder_path, *_unused in shared_folders:
+                if real_path == folder_path:
+                    return permission_level, virtual_name
+
+                folder_path = folder_path.rstrip(os.sep) + os.sep
+
+                if real_path.startswith(folder_path):
+                    real_path_no_prefix = real_path[len(folder_path):].replace(os.sep, "\\")
+                    return permission_level, f"{virtual_name}\\{real_path_no_prefix}"
+
+        return None, None
+
+    def _get_shared_file_data(self, real_path):
+
+        for destination in ("public_files", "buddy_files", "trusted_files"):
+            shared_files = self.share_dbs.get(destination)
+
+            if shared_files is not None and real_path in shared_files:
+                return shared_files[real_path]
+
+        return None
+
+    def _get_updated_share_stats(self, updated_share_stats, permission_level, virtual_path):
+        """Returns statistics of the share a path belongs to, in order to update
+        them when the share watcher reports changes."""
+
+        virtual_name = virtual_path.partition("\\")[0]
+        share_stats = updated_share_stats.get((permission_level, virtual_name))
+
+        if share_stats is None:
+            stored_share_stats = self.share_dbs.get(f"{permission_level}_stats")
+
+            if stored_share_stats is not None:
+                share_stats = stored_share_stats.get(virtual_name)
+
+            if share_stats is None:
+                share_stats = [0, 0, 0, 0, {}]
+
+            updated_share_stats[permission_level, virtual_name] = share_stats
+
+        return share_stats
+
+    def update_shared_folders(self, updated_folders, removed_folders):
+        """Apply changes reported by the share watcher to the loaded share
+        databases, without rescanning shares. Lists of shared files sent when
+        browsing are rebuilt the next time they are requested."""
+
+        if self.rescanning:
+            # Applied once the rescanned databases replace the ones in use
+            self._pending_share_changes.append((updated_folders, removed_folders))
+            return
+
+        if "words" not in self.share_dbs or "file_paths" not in self.share_dbs:
             return
 
+        # Search requests are matched in a separate thread, don't patch databases while it reads them
+        with self.share_dbs_lock:
+            self._patch_share_dbs(updated_folders, removed_folders)
+
+        events.emit("shares-updated")
         self.send_num_shared_folders_files()
 
+    def _patch_share_dbs(self, updated_folders, removed_folders):
+
+        word_index = self.share_dbs["words"]
+        word_suffixes = self.share_dbs.get("word_suffixes")
+        word_filter = self.share_dbs.get("word_filter")
+        updated_paths = set()
+        updated_share_stats = {}
+
+        for folder_path, file_entries, _removed_file_names in updated_folders:
+            permission_level, virtual_folder_path = self._find_shared_folder(folder_path)
+
+            if permission_level is None:
+                continue
+
+            shared_files = self.share_dbs[f"{permission_level}_files"]
+            shared_streams = self.share_dbs[f"{permission_level}_streams"]
+            share_stats = self._get_updated_share_stats(updated_share_stats, permission_level, virtual_folder_path)
+            file_list = []
+
+            if virtual_folder_path not in shared_streams:
+                share_stats[0] += 1
+
+            for basename, file_data, old_file_path in file_entries:
+                file_path = os.path.join(folder_path, basename)
+                old_file_data = shared_files.get(file_path)
+
+                if file_data is None:
+                    file_data = self._get_shared_file_data(old_file_path or file_path)
+
+                    if file_data is None:
+                        continue
+
+                file_data[0] = virtual_file_path = f"{virtual_folder_path}\\{basename}"
+
+                if file_path not in shared_files and self.file_path_index.append(file_path):
+                    file_index = len(self.file_path_index) - 1
+
+                    for word in set(WordIndexDatabase.word_normalizer.get_words(virtual_file_path)):
+                        if word_suffixes is not None and word not in word_index:
+                            word_suffixes.add(word)
+
+                        if word_filter is not None:
+                            word_filter.add(word)
+
+                        word_index.append(word, file_index)
+
+                if old_file_data is not None:
+                    Scanner.remove_file_stats(share_stats, basename, old_file_data)
+
+                Scanner.add_file_stats(share_stats, basename, file_data)
+                shared_files[file_path] = file_data
+                updated_paths.add(file_path)
+
+                basename_file_data = file_data[:]
+                basename_file_data[0] = basename
+                file_list.append(basename_file_data)
+
+            shared_streams[virtual_folder_path] = Scanner.get_folder_stream(file_list)
+            self._outdated_permission_levels.add(permission_level)
+            updated_paths.add(folder_path)
+
+        # Remove files after adding new ones, since moved files reuse their previous metadata
+        for folder_path, _file_entries, removed_file_names in updated_folders:
+            self._remove_shared_files(folder_path, removed_file_names, updated_paths, updated_share_stats)
+
+        for folder_path, file_names in removed_folders:
+            self._remove_shared_files(
+                folder_path, file_names, updated_paths, updated_share_stats, remove_folder=True)
+
+        for (permission_level, virtual_name), share_stats in updated_share_stats.items():
+            stored_share_stats = self.share_dbs.get(f"{permission_level}_stats")
+
+            if stored_share_stats is not None:
+                stored_share_stats[virtual_name] = share_stats
+
+    def _remove_shared_files(self, folder_path, file_names, updated_paths, updated_share_stats,
+                             remove_folder=False):
+
+        permission_level, virtual_folder_path = self._find_shared_folder(folder_path)
+
+        if permission_level is None:
+            return
+
+        shared_files = self.share_dbs[f"{permission_level}_files"]
+        shared_streams = self.share_dbs[f"{permission_level}_streams"]
+        share_stats = self._get_updated_share_stats(updated_share_stats, permission_level, virtual_folder_path)
+
+        for basename in file_names:
+            file_path = os.path.join(folder_path, basename)
+
+            # Word index entries are kept, and skipped when searching since the file is gone
+            if file_path not in updated_paths and file_path in shared_files:
+                Scanner.remove_file_stats(share_stats, basename, shared_files[file_path])
+                del shared_files[file_path]
+
+        if remove_folder and folder_path not in updated_paths and virtual_folder_path in shared_streams:
+            share_stats[0] -= 1
+            del shared_streams[virtual_folder_path]
+            self._outdated_permission_levels.add(permission_level)
+
     # Network Messages #
 
     def _shared_file_list_request(self, msg):
@@ -1186,7 +3617,7 @@ class Shares:
 
         ip_address, _port = msg.addr
         permission_level, _reject_reason = self.check_user_permission(username, ip_address)
-        shares_list = self.compressed_shares.get(permission_level)
+        shares_list = self.get_shared_file_list(permission_level)
         shares_list.username = shares_list.sock = None  # Reset previous connection
 
         core.send_message_to_peer(username, shares_list)
@@ -32,6 +32,7 @@ from socket import inet_ntoa
 from struct import Struct
 
 from pynicotine.utils import UINT32_LIMIT
+from pynicotine.utils import encode_path
 from pynicotine.utils import human_length
 
 # This module contains message classes, that networking and UI thread
@@ -53,6 +54,89 @@ UINT64_PACK = Struct("<Q").pack
 
 SEARCH_TOKENS_ALLOWED = set()
 
+ADLER32_BASE = 65521
+ZLIB_HEADER = b"\x78\x9c"
+ZLIB_CHECKSUM_PACK = Struct(">I").pack
+
+
+def combine_adler32(checksum1, checksum2, length2):
+    """Return the Adler-32 checksum of two concatenated byte strings, given
+    the checksum of each string and the length of the second string."""
+
+    remainder = length2 % ADLER32_BASE
+    sum1 = checksum1 & 0xffff
+    sum2 = (remainder * sum1) % ADLER32_BASE
+    sum1 += (checksum2 & 0xffff) + ADLER32_BASE - 1
+    sum2 += ((checksum1 >> 16) & 0xffff) + ((checksum2 >> 16) & 0xffff) + ADLER32_BASE - remainder
+
+    return (sum1 % ADLER32_BASE) | ((sum2 % ADLER32_BASE) << 16)
+
+
+class CompressedSegment:
+    """Data compressed into a raw deflate segment ending at a byte boundary.
+    Segments can be joined into a zlib stream in any order, without
+    compressing their data again."""
+
+    __slots__ = ("data", "checksum", "length", "_compressor")
+
+    def __init__(self, data=None):
+
+        self.data = bytearray()
+        self.checksum = zlib.adler32(b"")
+        self.length = 0
+        self._compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+        if data is not None:
+            self.append(data)
+            self.finish()
+
+    def append(self, data):
+
+        self.data += self._compressor.compress(data)
+        self.checksum = zlib.adler32(data, self.checksum)
+        self.length += len(data)
+
+    def finish(self):
+        self.data += self._compressor.flush(zlib.Z_FULL_FLUSH)
+        self._compressor = None
+
+
+class CompressedShares(CompressedSegment):
+    """Shared folders of a single permission level, compressed once."""
+
+    __slots__ = ("num_folders",)
+
+    def __init__(self):
+        super().__init__()
+        self.num_folders = 0
+
+    def __len__(self):
+        return self.num_folders
+
+
+def join_compressed_segments(segments):
+    """Join compressed segments and uncompressed byte strings into a single
+    zlib stream."""
+
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    checksum = zlib.adler32(b"")
+    msg = bytearray(ZLIB_HEADER)
+
+    for segment in segments:
+        if isinstance(segment, CompressedSegment):
+            msg += segment.data
+            checksum = combine_adler32(checksum, segment.checksum, segment.length)
+            continue
+
+        msg += compressor.compress(segment)
+        msg += compressor.flush(zlib.Z_FULL_FLUSH)
+        checksum = zlib.adler32(segment, checksum)
+
+    msg += compressor.flush(zlib.Z_FINISH)
+    msg += ZLIB_CHECKSUM_PACK(checksum)
+
+    return msg
+
 
 def initial_token():
     """Return a random token in a large enough range to effectively prevent
@@ -355,6 +439,21 @@ class SlskMessage:
         return f"<{self.msg_type} - {self.__class__.__name__}> {attrs}"
 
 
+class PackedFileInfo(list):
+    """File information along with its packed network representation, which
+    is reused as long as the file information is unchanged."""
+
+    __slots__ = ("packed",)
+
+    def __init__(self, fileinfo, packed=None):
+        super().__init__(fileinfo)
+        self.packed = packed
+
+    def __setitem__(self, index, value):
+        self.packed = None
+        super().__setitem__(index, value)
+
+
 class FileListMessage(SlskMessage):
     __slots__ = ()
 
@@ -369,6 +468,9 @@ class FileListMessage(SlskMessage):
     @classmethod
     def pack_file_info(cls, fileinfo):
 
+        if isinstance(fileinfo, PackedFileInfo) and fileinfo.packed is not None:
+            return fileinfo.packed
+
         msg = bytearray()
         virtual_file_path, size, quality, duration = fileinfo
         bitrate = is_vbr = samplerate = bitdepth = None
@@ -3083,11 +3185,11 @@ class SharedFileListResponse(PeerMessage):
     """
 
     __slots__ = ("list", "unknown", "privatelist", "built", "permission_level",
-                 "public_shares", "buddy_shares", "trusted_shares")
+                 "public_shares", "buddy_shares", "trusted_shares", "file_path")
     __excluded_attrs__ = {"list", "privatelist"}
 
     def __init__(self, public_shares=None, buddy_shares=None, trusted_shares=None,
-                 permission_level=None):
+                 permission_level=None, file_path=None):
         PeerMessage.__init__(self)
         self.public_shares = public_shares
         self.buddy_shares = buddy_shares
@@ -3097,6 +3199,7 @@ class SharedFileListResponse(PeerMessage):
         self.privatelist = []
         self.unknown = 0
         self.built = None
+        self.file_path = file_path  # Compressed message stored on disk, streamed when sent to peers
 
     def _make_shares_list(self, share_groups):
 
@@ -3121,12 +3224,48 @@ class SharedFileListResponse(PeerMessage):
 
         return msg_list
 
+    @classmethod
+    def compress_shares(cls, shares):
+        """Compress a group of shared folders once, in order to include it in
+        lists of shared files for multiple permission levels."""
+
+        compressed_shares = CompressedShares()
+
+        try:
+            for key in shares:
+                compressed_shares.append(cls.pack_string(key) + shares[key])
+                compressed_shares.num_folders += 1
+
+        except Exception as error:
+            from pynicotine.logfacility import log
+            compressed_shares = CompressedShares()
+            log.add(_("Unable to read shares database. Please rescan your shares. Error: %s"), error)
+
+        compressed_shares.finish()
+        return compressed_shares
+
+    def _make_compressed_network_message(self, share_groups, private_share_groups):
+
+        segments = [self.pack_uint32(sum(len(shares) for shares in share_groups))]
+        segments += share_groups
+        segments.append(self.pack_uint32(self.unknown))
+
+        if private_share_groups:
+            segments.append(self.pack_uint32(sum(len(shares) for shares in private_share_groups)))
+            segments += private_share_groups
+
+        return join_compressed_segments(segments)
+
     def make_network_message(self):
         # Elaborate hack to save CPU
         # Store packed message contents in self.built, and use instead of repacking it
         if self.built is not None:
             return self.built
 
+        if self.file_path is not None:
+            with open(encode_path(self.file_path), "rb") as file_handle:
+                return file_handle.read()
+
         from pynicotine.shares import PermissionLevel
 
         msg = bytearray()
@@ -3142,15 +3281,20 @@ class SharedFileListResponse(PeerMessage):
         if self.permission_level == PermissionLevel.TRUSTED and self.trusted_shares:
             share_groups.append(self.trusted_shares)
 
+        for shares in (self.buddy_shares, self.trusted_shares):
+            if shares and shares not in share_groups:
+                private_share_groups.append(shares)
+
+        if all(isinstance(shares, CompressedShares) for shares in share_groups + private_share_groups):
+            # Folders were already compressed, only join them
+            self.built = self._make_compressed_network_message(share_groups, private_share_groups)
+            return self.built
+
         msg += self._make_shares_list(share_groups)
 
         # Unknown purpose, but official clients always send a value of 0
         msg += self.pack_uint32(self.unknown)
 
-        for shares in (self.buddy_shares, self.trusted_shares):
-            if shares and shares not in share_groups:
-                private_share_groups.append(shares)
-
         if private_share_groups:
             msg += self._make_shares_list(share_groups=private_share_groups)
 
@@ -3240,11 +3384,11 @@ class FileSearchResponse(PeerMessage):
     """
 
     __slots__ = ("search_username", "token", "list", "privatelist", "freeulslots",
-                 "ulspeed", "inqueue", "unknown")
-    __excluded_attrs__ = {"list", "privatelist"}
+                 "ulspeed", "inqueue", "unknown", "compressed_lists")
+    __excluded_attrs__ = {"list", "privatelist", "compressed_lists"}
 
     def __init__(self, search_username=None, token=None, shares=None, freeulslots=None,
-                 ulspeed=None, inqueue=None, private_shares=None):
+                 ulspeed=None, inqueue=None, private_shares=None, compressed_lists=None):
         PeerMessage.__init__(self)
         self.search_username = search_username
         self.token = token
@@ -3254,8 +3398,43 @@ class FileSearchResponse(PeerMessage):
         self.ulspeed = ulspeed
         self.inqueue = inqueue
         self.unknown = 0
+        self.compressed_lists = compressed_lists
+
+    @classmethod
+    def compress_result_lists(cls, shares, private_shares=None):
+        """Compress result lists once, in order to reuse them in responses to
+        multiple users. Returns a tuple of compressed segments."""
+
+        compressed_lists = []
+
+        for fileinfos in (shares, private_shares) if private_shares else (shares,):
+            msg = bytearray()
+            msg += cls.pack_uint32(len(fileinfos))
+
+            for fileinfo in fileinfos:
+                msg += FileListMessage.pack_file_info(fileinfo)
+
+            compressed_lists.append(CompressedSegment(msg))
+
+        return tuple(compressed_lists)
+
+    def _make_compressed_network_message(self):
+
+        public_list, *private_list = self.compressed_lists
+
+        return join_compressed_segments((
+            self.pack_string(self.search_username) + self.pack_uint32(self.token),
+            public_list,
+            (self.pack_bool(self.freeulslots) + self.pack_uint32(self.ulspeed)
+             + self.pack_uint32(self.inqueue) + self.pack_uint32(self.unknown)),
+            *private_list
+        ))
 
     def make_network_message(self):
+
+        if self.compressed_lists:
+            return self._make_compressed_network_message()
+
         msg = bytearray()
         msg += self.pack_string(self.search_username)
         msg += self.pack_uint32(self.token)
@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import errno
+import os
 import random
 import selectors
 import socket
@@ -87,6 +88,7 @@ from pynicotine.slskmessages import UserStatus
 from pynicotine.slskmessages import WatchUser
 from pynicotine.slskmessages import increment_token
 from pynicotine.slskmessages import initial_token
+from pynicotine.utils import encode_path
 from pynicotine.utils import human_speed
 
 
@@ -115,7 +117,7 @@ class ServerConnection(Connection):
 
 
 class PeerConnection(Connection):
-    __slots__ = ("init", "request_token", "response_token", "has_post_init_activity")
+    __slots__ = ("init", "request_token", "response_token", "has_post_init_activity", "out_streams")
 
     def __init__(self, *args, init=None, request_token=None, response_token=None, **kwargs):
 
@@ -125,6 +127,15 @@ class PeerConnection(Connection):
         self.request_token = request_token    # Requesting indirect connection to user
         self.response_token = response_token  # Responding to indirect connection request from user
         self.has_post_init_activity = False
+        self.out_streams = deque()            # Data sent once out_buffer is empty, in chunks from files
+
+
+class OutgoingFileStream:
+    __slots__ = ("file", "bytes_left")
+
+    def __init__(self, file, bytes_left):
+        self.file = file
+        self.bytes_left = bytes_left
 
 
 class NetworkInterfaces:
@@ -349,6 +360,7 @@ class NetworkThread(Thread):
     # ~20 (SLEEP_MAX_IDLE + SLEEP_MIN_IDLE) by default
     SLEEP_MAX_IDLE = 0.04584
     SLEEP_MIN_IDLE = 0.00416
+    STREAM_CHUNK_SIZE = 262144
 
     try:
         import resource
@@ -575,7 +587,7 @@ class NetworkThread(Thread):
             # are critical. Always assume they are active.
             return True
 
-        return len(conn.out_buffer) > 0 or len(conn.in_buffer) > 0
+        return len(conn.out_buffer) > 0 or len(conn.in_buffer) > 0 or len(conn.out_streams) > 0
 
     def _bind_socket_interface(self, sock):
         """Attempt to bind socket to an IP address, if provided with the
@@ -920,6 +932,12 @@ class NetworkThread(Thread):
         if conn.__class__ is not PeerConnection:
             return
 
+        for stream in conn.out_streams:
+            if stream.__class__ is OutgoingFileStream:
+                stream.file.close()
+
+        conn.out_streams.clear()
+
         init = conn.init
 
         if init is None:
@@ -1808,24 +1826,99 @@ class NetworkThread(Thread):
 
             self._close_connection(conn)
 
+    def _open_message_file(self, msg):
+        """Open a file containing the packed contents of a message, to send it
+        to a peer without reading the whole file into memory."""
+
+        try:
+            file_handle = open(encode_path(msg.file_path), "rb")  # pylint: disable=consider-using-with
+
+        except OSError as error:
+            log.add("Unable to read message type %s from file %s: %s", (msg.__class__, msg.file_path, error))
+            return None
+
+        return OutgoingFileStream(file_handle, os.fstat(file_handle.fileno()).st_size)
+
     def _process_peer_output(self, msg):
 
+        msg_class = msg.__class__
+        conn = self._conns[msg.sock]
+
         # Pack peer messages
-        msg_content = self._pack_network_message(msg)
+        if msg_class is SharedFileListResponse and msg.built is None and msg.file_path is not None:
+            file_stream = self._open_message_file(msg)
 
-        if msg_content is None:
-            return
+            if file_stream is None:
+                return
 
-        conn = self._conns[msg.sock]
-        out_buffer = conn.out_buffer
+            msg_size = file_stream.bytes_left
+            msg_content = None
+        else:
+            file_stream = None
+            msg_content = self._pack_network_message(msg)
 
-        out_buffer += msg.pack_uint32(len(msg_content) + 4)
-        out_buffer += msg.pack_uint32(PEER_MESSAGE_CODES[msg.__class__])
-        out_buffer += msg_content
+            if msg_content is None:
+                return
+
+            msg_size = len(msg_content)
+
+        msg_header = msg.pack_uint32(msg_size + 4) + msg.pack_uint32(PEER_MESSAGE_CODES[msg_class])
+        out_streams = conn.out_streams
+
+        if out_streams:
+            # Keep messages in order while a previous message is streamed from a file
+            out_streams.append(msg_header)
+        else:
+            conn.out_buffer += msg_header
+
+        if file_stream is not None:
+            out_streams.append(file_stream)
+
+            try:
+                self._fill_out_buffer(conn)
+
+            except OSError as error:
+                log.add_conn("Cannot read message from file for connection %s, closing connection. Error: %s",
+                             (conn.addr, error))
+                self._close_connection(conn)
+                return
+
+        elif out_streams:
+            out_streams.append(msg_content)
+
+        else:
+            conn.out_buffer += msg_content
 
         conn.has_post_init_activity = True
         self._modify_connection_events(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
 
+    def _fill_out_buffer(self, conn):
+        """Move queued data from streams to the output buffer of a peer
+        connection, one chunk at a time."""
+
+        out_buffer = conn.out_buffer
+        out_streams = conn.out_streams
+
+        while out_streams and len(out_buffer) < self.STREAM_CHUNK_SIZE:
+            stream = out_streams[0]
+
+            if stream.__class__ is not OutgoingFileStream:
+                out_buffer += stream
+                out_streams.popleft()
+                continue
+
+            data = stream.file.read(min(stream.bytes_left, self.STREAM_CHUNK_SIZE))
+
+            if not data:
+                raise OSError(errno.EIO, f"File {stream.file.name} ended unexpectedly")
+
+            out_buffer += data
+            stream.bytes_left -= len(data)
+
+            if stream.bytes_left <= 0:
+                stream.file.close()
+                out_streams.popleft()
+
     # File Connection #
 
     def _calc_upload_limit(self, limit_disabled=False, limit_per_transfer=False):
@@ -2675,6 +2768,9 @@ class NetworkThread(Thread):
         if is_file_upload and not self._process_upload(conn, num_bytes_sent, current_time):
             return False  # Close the connection
 
+        if conn.__class__ is PeerConnection and conn.out_streams:
+            self._fill_out_buffer(conn)
+
         if not out_buffer:
             # Nothing else to send, stop watching connection for writes
             self._modify_connection_events(conn, selectors.EVENT_READ)
@@ -16,11 +16,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import zlib
+
 from unittest import TestCase
 
 from pynicotine.slskmessages import AckNotifyPrivileges
 from pynicotine.slskmessages import ChangePassword
 from pynicotine.slskmessages import FileSearch
+from pynicotine.slskmessages import FileSearchResponse
 from pynicotine.slskmessages import GetPeerAddress
 from pynicotine.slskmessages import GetUserStatus
 from pynicotine.slskmessages import JoinGlobalRoom
@@ -35,6 +38,7 @@ from pynicotine.slskmessages import PrivateRoomRemoveUser
 from pynicotine.slskmessages import PrivateRoomSomething
 from pynicotine.slskmessages import SayChatroom
 from pynicotine.slskmessages import SetStatus
+from pynicotine.slskmessages import SharedFileListResponse
 from pynicotine.slskmessages import SetWaitPort
 from pynicotine.slskmessages import SlskMessage
 from pynicotine.slskmessages import UnwatchUser
@@ -187,6 +191,56 @@ class FileSearchTest(TestCase):
             message)
 
 
+class FileSearchResponseMessageTest(TestCase):
+
+    def test_make_compressed_network_message(self):
+        # Arrange
+        shares = [["Music\\song.mp3", 1000, (320, 0, None, None), 200], ["Music\\song.flac", 9000, None, None]]
+        private_shares = [["Private\\song.ogg", 500, None, None]]
+
+        for private_list in (private_shares, []):
+            obj = FileSearchResponse(
+                search_username="user1", token=524700074, shares=shares, freeulslots=True, ulspeed=1000,
+                inqueue=3, private_shares=private_list)
+            compressed_obj = FileSearchResponse(
+                search_username="user1", token=524700074, freeulslots=True, ulspeed=1000, inqueue=3,
+                compressed_lists=FileSearchResponse.compress_result_lists(shares, private_list))
+
+            # Act
+            message = obj.make_network_message()
+            compressed_message = compressed_obj.make_network_message()
+
+            # Assert
+            self.assertEqual(zlib.decompress(message), zlib.decompress(compressed_message))
+
+
+class SharedFileListResponseMessageTest(TestCase):
+
+    def test_make_compressed_network_message(self):
+        # Arrange
+        public_shares = {"Music\\Album": b"\x00\x00\x00\x00", "Music\\Album 2": b"\x00\x00\x00\x00"}
+        buddy_shares = {"Buddies\\Album": b"\x00\x00\x00\x00"}
+        trusted_shares = {"Trusted\\Album": b"\x00\x00\x00\x00"}
+        compressed_public_shares = SharedFileListResponse.compress_shares(public_shares)
+        compressed_buddy_shares = SharedFileListResponse.compress_shares(buddy_shares)
+        compressed_trusted_shares = SharedFileListResponse.compress_shares(trusted_shares)
+
+        for permission_level in ("public", "buddy", "trusted"):
+            obj = SharedFileListResponse(
+                public_shares=public_shares, buddy_shares=buddy_shares, trusted_shares=trusted_shares,
+                permission_level=permission_level)
+            compressed_obj = SharedFileListResponse(
+                public_shares=compressed_public_shares, buddy_shares=compressed_buddy_shares,
+                trusted_shares=compressed_trusted_shares, permission_level=permission_level)
+
+            # Act
+            message = obj.make_network_message()
+            compressed_message = compressed_obj.make_network_message()
+
+            # Assert
+            self.assertEqual(zlib.decompress(message), zlib.decompress(compressed_message))
+
+
 class SetStatusMessageTest(TestCase):
 
     def test_make_network_message(self):
@@ -34,6 +34,8 @@ from pynicotine.config import config
 from pynicotine.core import core
 from pynicotine.events import events
 from pynicotine.slskmessages import ServerConnect, SetWaitPort
+from pynicotine.slskmessages import SharedFileListResponse
+from pynicotine.slskproto import PeerConnection
 from pynicotine.utils import encode_path
 
 DATA_FOLDER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "temp_data")
@@ -143,3 +145,29 @@ class SoulseekNetworkTest(TestCase):
         core.send_message_to_server(SetWaitPort(1))
 
         sleep(SLSKPROTO_RUN_TIME)
+
+    def test_stream_message_from_file(self):
+
+        # pylint: disable=protected-access
+        network_thread = core._network_thread
+        file_path = os.path.join(DATA_FOLDER_PATH, "publicfilelist.dbn")
+        file_content = os.urandom((network_thread.STREAM_CHUNK_SIZE * 2) + 100)
+
+        with open(file_path, "wb") as file_handle:
+            file_handle.write(file_content)
+
+        conn = PeerConnection()
+        file_stream = network_thread._open_message_file(SharedFileListResponse(file_path=file_path))
+        conn.out_streams.extend((b"header", file_stream, b"next message"))
+
+        sent_data = bytearray()
+
+        while conn.out_streams:
+            network_thread._fill_out_buffer(conn)
+            self.assertLessEqual(len(conn.out_buffer), network_thread.STREAM_CHUNK_SIZE + len(b"header"))
+
+            sent_data += conn.out_buffer
+            conn.out_buffer.clear()
+
+        self.assertEqual(sent_data, b"header" + file_content + b"next message")
+        self.assertTrue(file_stream.file.closed)
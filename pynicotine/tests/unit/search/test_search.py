@@ -18,13 +18,23 @@
 
 import os
 import shutil
+import time
 
 from collections import UserDict
+from itertools import islice
+from threading import Thread
 from unittest import TestCase
+from unittest.mock import Mock
+from unittest.mock import patch
 
 from pynicotine.config import config
 from pynicotine.core import core
+from pynicotine.events import events
+from pynicotine.search import Search
 from pynicotine.shares import PermissionLevel
+from pynicotine.shares import Shares
+from pynicotine.shares import SuffixIndex
+from pynicotine.shares import WordFilter
 from pynicotine.slskmessages import increment_token
 
 DATA_FOLDER_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "temp_data")
@@ -112,8 +122,8 @@ class SearchTest(TestCase):
         self.assertEqual(search.mode, "wishlist")
         self.assertTrue(search.is_ignored)
 
-    def test_create_search_result_list(self):
-        """Test creating search result lists from the word index."""
+    def test_search_results(self):
+        """Test matching search results from the word index."""
 
         max_results = 1500
         word_index = {
@@ -127,25 +137,317 @@ class SearchTest(TestCase):
         excluded_words = {"linux", "game"}
         partial_words = {"stem"}
 
-        results = core.search._create_search_result_list(
-            included_words, excluded_words, partial_words, max_results, word_index)
-        self.assertEqual(results, {37, 38})
+        results = list(islice(core.search._iter_search_results(
+            included_words, excluded_words, partial_words, word_index), max_results))
+        self.assertEqual(results, [37, 38])
 
         included_words = {"lts", "iso"}
         excluded_words = {"linux", "game", "music", "cd"}
         partial_words = set()
 
-        results = core.search._create_search_result_list(
-            included_words, excluded_words, partial_words, max_results, word_index)
-        self.assertIsNone(results)
+        results = list(islice(core.search._iter_search_results(
+            included_words, excluded_words, partial_words, word_index), max_results))
+        self.assertEqual(results, [])
 
         included_words = {"iso"}
         excluded_words = {"system"}
         partial_words = {"ibberish"}
 
-        results = core.search._create_search_result_list(
-            included_words, excluded_words, partial_words, max_results, word_index)
-        self.assertIsNone(results)
+        results = list(islice(core.search._iter_search_results(
+            included_words, excluded_words, partial_words, word_index), max_results))
+        self.assertEqual(results, [])
+
+    def test_search_results_sorted(self):
+        """Test that results are sorted, and limited to the maximum number of
+        results."""
+
+        word_index = {
+            "flac": list(range(0, 1000, 2)),
+            "album": list(range(0, 1000, 3)),
+            "live": [6, 12, 600, 996],
+            "olive": [5, 7, 18, 24, 30],
+            "remix": [12, 18, 30]
+        }
+
+        results = list(islice(core.search._iter_search_results({"flac", "album"}, set(), set(), word_index), 5))
+        self.assertEqual(results, [0, 6, 12, 18, 24])
+
+        results = list(islice(
+            core.search._iter_search_results({"flac", "album"}, {"remix"}, {"live"}, word_index), 100))
+        self.assertEqual(results, [6, 24, 600, 996])
+
+        results = list(islice(core.search._iter_search_results(set(), {"flac"}, {"live"}, word_index), 100))
+        self.assertEqual(results, [5, 7])
+
+    def test_search_results_suffix_index(self):
+        """Test that partial words are matched using the word suffix index."""
+
+        word_index = {
+            "live": [6, 12],
+            "olive": [5, 7],
+            "oliver": [8],
+            "lively": [9]
+        }
+        word_suffixes = SuffixIndex(os.path.join(DATA_FOLDER_PATH, "wordsuffixes.dbn"))
+        word_suffixes.update(word_index)
+        word_suffixes.close()
+
+        word_suffixes = SuffixIndex(os.path.join(DATA_FOLDER_PATH, "wordsuffixes.dbn"), overwrite=False)
+        self.addCleanup(word_suffixes.close)
+
+        self.assertEqual(len(word_suffixes), 4)
+        self.assertEqual(sorted(word_suffixes.iter_words_ending_with("live")), ["live", "olive"])
+
+        results = list(islice(core.search._iter_search_results(set(), set(), {"live"}, word_index, word_suffixes), 100))
+        self.assertEqual(results, [5, 6, 7, 12])
+
+        # Words added after loading the index
+        word_index["alive"] = [10]
+        word_suffixes.add("alive")
+
+        results = list(islice(core.search._iter_search_results(set(), set(), {"live"}, word_index, word_suffixes), 100))
+        self.assertEqual(results, [5, 6, 7, 10, 12])
+
+        results = list(islice(
+            core.search._iter_search_results(set(), set(), {"ively"}, word_index, word_suffixes), 100))
+        self.assertEqual(results, [9])
+
+    def test_search_results_large_partial_word_group(self):
+        """Test that a partial word matching many words is matched quickly
+        when another word has fewer matches."""
+
+        word_index = {f"word{i}xac": list(range(i, 200000, 3000)) for i in range(3000)}
+        word_index["common"] = list(range(0, 200000, 10))
+        word_index["rare"] = [30, 40, 41]
+
+        with patch.object(Search, "_seek_file_index", wraps=Search._seek_file_index) as seek_file_index:
+            results = list(core.search._iter_search_results({"common"}, set(), {"xac"}, word_index))
+
+        self.assertEqual(results, list(range(0, 200000, 10)))
+        self.assertLessEqual(seek_file_index.call_count, len(results))
+
+        results = list(core.search._iter_search_results({"rare", "common"}, {"word41xac"}, {"xac"}, word_index))
+        self.assertEqual(results, [30, 40])
+
+    def test_search_response_cache(self):
+        """Test that responses to search requests are cached until shares are
+        updated."""
+
+        word_index = core.shares.share_dbs["words"] = UserDict({"iso": [0, 1]})
+        public_files = core.shares.share_dbs["public_files"] = UserDict({
+            "real\\isos\\freebsd.iso": ["virtual\\isos\\freebsd.iso", 1000, None, None],
+            "real\\isos\\linux.iso": ["virtual\\isos\\linux.iso", 2000, None, None]
+        })
+        core.shares.share_dbs["buddy_files"] = core.shares.share_dbs["trusted_files"] = UserDict()
+        core.shares.file_path_index = list(public_files)
+
+        for share_db in core.shares.share_dbs.values():
+            share_db.close = lambda: None
+
+        num_results, compressed_lists = core.search._get_search_response(
+            {"iso"}, set(), set(), 100, PermissionLevel.PUBLIC)
+        self.assertEqual(num_results, 2)
+        self.assertEqual(
+            core.search._get_search_response({"iso"}, set(), set(), 100, PermissionLevel.PUBLIC),
+            (num_results, compressed_lists)
+        )
+
+        word_index["iso"] = [1]
+        self.assertEqual(core.search._get_search_response({"iso"}, set(), set(), 100, PermissionLevel.PUBLIC)[0], 2)
+
+        core.search._shares_updated()
+        self.assertEqual(core.search._get_search_response({"iso"}, set(), set(), 100, PermissionLevel.PUBLIC)[0], 1)
+        self.assertEqual(core.search._get_search_response({"bsd"}, set(), set(), 100, PermissionLevel.PUBLIC)[0], 0)
+
+    def test_search_response_max_results(self):
+        """Test that files hidden from a user are skipped when selecting
+        results, without reducing the number of results sent."""
+
+        core.shares.share_dbs["words"] = UserDict({"iso": [0, 1, 2, 3, 4]})
+        core.shares.share_dbs["public_files"] = UserDict({
+            "real\\isos\\freebsd.iso": ["virtual\\isos\\freebsd.iso", 1000, None, None],
+            "real\\isos\\openbsd.iso": ["virtual\\isos\\openbsd.iso", 4000, None, None]
+        })
+        core.shares.share_dbs["buddy_files"] = UserDict({
+            "real\\buddy\\linux.iso": ["virtual\\buddy\\linux.iso", 2000, None, None],
+            "real\\buddy\\netbsd.iso": ["virtual\\buddy\\netbsd.iso", 3000, None, None]
+        })
+        core.shares.share_dbs["trusted_files"] = UserDict({
+            "real\\trusted\\haiku.iso": ["virtual\\trusted\\haiku.iso", 5000, None, None]
+        })
+        core.shares.file_path_index = [
+            "real\\isos\\freebsd.iso", "real\\buddy\\linux.iso", "real\\buddy\\netbsd.iso",
+            "real\\isos\\openbsd.iso", "real\\trusted\\haiku.iso"
+        ]
+
+        for share_db in core.shares.share_dbs.values():
+            share_db.close = lambda: None
+
+        results = core.search._iter_search_results({"iso"}, set(), set(), core.shares.share_dbs["words"])
+        num_results, fileinfos, private_fileinfos = core.search._create_file_info_list(
+            results, max_results=2, permission_level=PermissionLevel.PUBLIC)
+
+        self.assertEqual(num_results, 2)
+        self.assertEqual(fileinfos, [
+            ["virtual\\isos\\freebsd.iso", 1000, None, None],
+            ["virtual\\isos\\openbsd.iso", 4000, None, None]
+        ])
+        self.assertEqual(private_fileinfos, [])
+
+        results = core.search._iter_search_results({"iso"}, set(), set(), core.shares.share_dbs["words"])
+        num_results, fileinfos, private_fileinfos = core.search._create_file_info_list(
+            results, max_results=3, permission_level=PermissionLevel.BUDDY)
+
+        self.assertEqual(num_results, 3)
+        self.assertEqual([fileinfo[0] for fileinfo in fileinfos], [
+            "virtual\\buddy\\linux.iso", "virtual\\buddy\\netbsd.iso", "virtual\\isos\\freebsd.iso"
+        ])
+        self.assertEqual(private_fileinfos, [])
+
+    def test_search_request_rate_limit(self):
+        """Test that search requests are dropped when users exceed the
+        configured rate limits."""
+
+        config.sections["searches"]["max_user_search_requests"] = 2
+        config.sections["searches"]["max_search_requests"] = 3
+        config.sections["searches"]["max_search_response_speed"] = 1
+        core.shares.share_dbs["words"] = UserDict()
+        core.shares.share_dbs["words"].close = lambda: None
+
+        with patch.object(core, "statistics", Mock()) as statistics, \
+                patch.object(core, "users", Mock(login_username="user0")), \
+                patch.object(core, "uploads", Mock(pending_shutdown=False)), \
+                patch.object(Shares, "check_user_permission", return_value=(PermissionLevel.PUBLIC, None)), \
+                patch.object(Search, "_queue_search_request") as queue_search_request:
+            for username in ("user1", "user1", "user1", "user2", "user3"):
+                core.search._process_search_request("iso", username, token=1)
+
+            # Third request of user1 exceeds the per-user limit, request of user3 the total limit
+            self.assertEqual([call.args[0][5] for call in queue_search_request.call_args_list],
+                             ["user1", "user1", "user2"])
+
+            # Statistics of search requests are updated periodically
+            statistics.append_stat_value.assert_not_called()
+            core.search._update_search_request_stats()
+            self.assertEqual(
+                dict(call.args for call in statistics.append_stat_value.call_args_list),
+                {"processed_search_requests": 3, "dropped_search_requests": 2}
+            )
+
+            # Responses exceeding the upload speed limit delay further responses
+            core.search._search_request_bucket.tokens = 3
+
+            with patch.object(type(core), "send_message_to_peer"):
+                core.search._send_search_response(
+                    "user4", 1, 1, (Mock(data=bytearray(4096)),), "iso")
+
+            core.search._process_search_request("iso", "user4", token=1)
+            self.assertEqual(queue_search_request.call_count, 3)
+
+        for option in ("max_user_search_requests", "max_search_requests", "max_search_response_speed"):
+            config.sections["searches"][option] = config.defaults["searches"][option]
+
+    def test_search_request_word_filter(self):
+        """Test that search requests containing words that are definitely
+        not shared are rejected before matching, without counting towards
+        rate limits."""
+
+        word_filter_path = os.path.join(DATA_FOLDER_PATH, "wordfilter.dbn")
+        word_filter = WordFilter(word_filter_path)
+        word_filter.update(("linux", "iso"))
+        word_filter.close()
+
+        core.shares.share_dbs["words"] = UserDict()
+        core.shares.share_dbs["words"].close = lambda: None
+        core.shares.share_dbs["word_filter"] = WordFilter(word_filter_path, overwrite=False)
+        config.sections["searches"]["max_user_search_requests"] = 2
+
+        with patch.object(core, "users", Mock(login_username="user0")), \
+                patch.object(core, "uploads", Mock(pending_shutdown=False)), \
+                patch.object(Shares, "check_user_permission", return_value=(PermissionLevel.PUBLIC, None)), \
+                patch.object(Search, "_queue_search_request") as queue_search_request:
+            core.search._process_search_request("Linux ISO", "user1", token=1)
+            core.search._process_search_request("linux windows", "user1", token=2)
+            core.search._process_search_request("*nux -windows", "user1", token=3)
+
+        self.assertEqual([call.args[0][6] for call in queue_search_request.call_args_list], [1, 3])
+        self.assertEqual(
+            core.search._search_request_stats,
+            {"processed_search_requests": 2, "rejected_search_requests": 1, "dropped_search_requests": 0}
+        )
+
+        option = "max_user_search_requests"
+        config.sections["searches"][option] = config.defaults["searches"][option]
+
+    def test_search_request_normalized_words(self):
+        """Test that words in search requests are normalized like words in
+        the word index."""
+
+        core.shares.share_dbs["words"] = UserDict()
+        core.shares.share_dbs["words"].close = lambda: None
+
+        with patch.object(core, "users", Mock(login_username="user0")), \
+                patch.object(core, "uploads", Mock(pending_shutdown=False)), \
+                patch.object(Shares, "check_user_permission", return_value=(PermissionLevel.PUBLIC, None)), \
+                patch.object(Search, "_queue_search_request") as queue_search_request:
+            core.search._process_search_request("BEYONCÉ Déjà -Vú *ßé", "user1", token=1)
+
+        included_words, excluded_words, partial_words, *_unused = queue_search_request.call_args.args[0]
+
+        self.assertEqual(included_words, {"beyonce", "deja"})
+        self.assertEqual(excluded_words, {"vu"})
+        self.assertEqual(partial_words, {"sse"})
+
+    def test_search_request_queue(self):
+        """Test that search requests are matched in a separate thread, and that
+        the oldest requests are dropped when too many are queued."""
+
+        queue_limit = core.search.SEARCH_REQUEST_QUEUE_LIMIT
+
+        # Queue requests without processing them yet, as if a thread was running
+        core.search._search_request_thread = Mock()
+
+        for token in range(queue_limit + 10):
+            core.search._queue_search_request(
+                ({"iso"}, set(), set(), 100, PermissionLevel.PUBLIC, "user2", token, "iso"))
+
+        self.assertEqual(len(core.search._search_requests), queue_limit)
+        self.assertEqual(core.search._search_requests[0][6], 10)
+
+        with patch.object(Search, "_get_search_response", return_value=(1, ())), \
+                patch.object(Search, "_send_search_response") as send_search_response:
+            core.search._start()
+
+            for _ in range(500):
+                events.process_thread_events()
+
+                if send_search_response.call_count >= queue_limit:
+                    break
+
+                time.sleep(0.01)
+
+        self.assertEqual(send_search_response.call_count, queue_limit)
+        self.assertEqual(
+            [call.args[1] for call in send_search_response.call_args_list], list(range(10, queue_limit + 10)))
+
+    def test_search_response_closed_shares(self):
+        """Test that search requests matched after shares are closed get no
+        results, and that matching waits until shares are swapped."""
+
+        core.shares.share_dbs.pop("words", None)
+        search_request = ({"iso"}, set(), set(), 100, PermissionLevel.PUBLIC)
+
+        self.assertEqual(core.search._get_search_response(*search_request), (0, None))
+
+        with core.shares.share_dbs_lock:
+            search_thread = Thread(target=core.search._get_search_response, args=search_request, daemon=True)
+            search_thread.start()
+            search_thread.join(timeout=0.1)
+
+            self.assertTrue(search_thread.is_alive())
+
+        search_thread.join()
+        self.assertFalse(search_thread.is_alive())
 
     def test_exclude_server_phrases(self):
         """Verify that results containing excluded phrases are not included."""
@@ -176,3 +478,27 @@ class SearchTest(TestCase):
             ["virtual\\isos\\openbsd.iso", 6000, None, None]
         ])
         self.assertEqual(private_fileinfos, [])
+
+    def test_exclude_server_phrases_special_characters(self):
+        """Verify that excluded phrases are matched literally."""
+
+        core.search.excluded_phrases = ["c++ (live)", "", "[bootleg]"]
+        fileinfos = []
+
+        for file_path in (
+            "virtual\\C++ (Live)\\track.mp3",
+            "virtual\\cc (live)\\track.mp3",
+            "virtual\\album [Bootleg]\\track.mp3",
+            "virtual\\album b\\track.mp3"
+        ):
+            core.search._append_file_info(fileinfos, [file_path, 1000, None, None])
+
+        self.assertEqual(fileinfos, [
+            ["virtual\\cc (live)\\track.mp3", 1000, None, None],
+            ["virtual\\album b\\track.mp3", 1000, None, None]
+        ])
+
+        core.search.excluded_phrases = []
+        core.search._append_file_info(fileinfos, ["virtual\\C++ (Live)\\track.mp3", 1000, None, None])
+
+        self.assertEqual(len(fileinfos), 3)
@@ -19,12 +19,32 @@
 import os
 import shutil
 import struct
+import sys
+import time
 import wave
 
 from unittest import TestCase
+from unittest import skipUnless
+from unittest.mock import Mock
+from unittest.mock import patch
 
 from pynicotine.config import config
 from pynicotine.core import core
+from pynicotine.events import events
+from pynicotine.shares import Database
+from pynicotine.shares import DatabaseError
+from pynicotine.shares import FileDatabase
+from pynicotine.shares import FilePathIndex
+from pynicotine.shares import PermissionLevel
+from pynicotine.shares import Scanner
+from pynicotine.shares import ScannerBudget
+from pynicotine.shares import ShareWatcher
+from pynicotine.shares import StringTable
+from pynicotine.shares import WordFilter
+from pynicotine.shares import WordIndexDatabase
+from pynicotine.shares import WordNormalizer
+from pynicotine.slskmessages import FileListMessage
+from pynicotine.slskmessages import SharedFileListResponse
 
 CURRENT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
 DATA_FOLDER_PATH = os.path.join(CURRENT_FOLDER_PATH, "temp_data")
@@ -39,6 +59,16 @@ AUDIO_FILES = (
 )
 
 
+def read_share_dbs():
+    return {
+        destination: (
+            list(share_db) if isinstance(share_db, StringTable) else dict(share_db.items())
+        )
+        for destination, share_db in core.shares.share_dbs.items()
+        if not isinstance(share_db, WordFilter)
+    }
+
+
 class SharesTest(TestCase):
 
     def setUp(self):
@@ -76,12 +106,25 @@ class SharesTest(TestCase):
             self.addCleanup(os.remove, os.path.join(folder_path, basename))
 
         # Rescan shares
-        core.shares.rescan_shares(rebuild=True, use_thread=False)
-        core.shares.load_shares(core.shares.share_dbs, core.shares.share_db_paths)
+        self.rescan_shares(rebuild=True)
 
     def tearDown(self):
         core.quit()
 
+    @staticmethod
+    def rescan_shares(rebuild=False):
+
+        # Previous scan in the same process was not followed by a shares-ready event
+        core.shares.rescanning = False
+
+        core.shares.rescan_shares(rebuild=rebuild, use_thread=False)
+        core.shares.close_shares(core.shares.share_dbs)
+        core.shares.replace_share_dbs()
+        core.shares.remove_old_share_dbs()
+        core.shares.replace_shared_file_lists()
+        core.shares.load_shares(core.shares.share_dbs, core.shares.share_db_paths)
+        core.shares.file_path_index = core.shares.share_dbs["file_paths"]
+
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(DATA_FOLDER_PATH)
@@ -147,6 +190,16 @@ class SharesTest(TestCase):
             "audiofile2", "txt", "folder1", "buddies", "audiofile3", "shares"
         })
 
+        # Verify that words can be found by their suffix
+        word_suffixes = core.shares.share_dbs["word_suffixes"]
+
+        self.assertEqual(sorted(word_suffixes), sorted(word[::-1] for word in word_index))
+        self.assertEqual(set(word_suffixes.iter_words_ending_with("file")), {"file", "somefile", "audiofile"})
+        self.assertEqual(set(word_suffixes.iter_words_ending_with("2")), {
+            "folder2", "nothing2", "test2", "something2", "file2", "audiofile2"
+        })
+        self.assertEqual(list(word_suffixes.iter_words_ending_with("ibberish")), [])
+
         self.assertEqual(len(audiofile_indexes), 1)
         self.assertEqual(len(audiofile2_indexes), 1)
         self.assertEqual(len(audiofile3_indexes), 1)
@@ -169,6 +222,191 @@ class SharesTest(TestCase):
             "Trusted\\audiofile3.wav"
         )
 
+        # Verify that the file path index was saved in the order of file indices
+        self.assertIsInstance(core.shares.file_path_index, FilePathIndex)
+        self.assertEqual(list(core.shares.file_path_index), [
+            *public_files, *buddy_files, *trusted_files
+        ])
+        self.assertEqual(len(core.shares.file_path_index), len(public_files) + len(buddy_files) + len(trusted_files))
+
+    def test_shares_scan_results(self):
+        """Test that progress and compressed lists of shared files are sent
+        from the scanner process."""
+
+        scan_progress = core.shares.scan_progress
+
+        self.assertGreater(scan_progress.num_folders, 0)
+        self.assertEqual(scan_progress.num_files, len(core.shares.file_path_index))
+        self.assertGreater(scan_progress.num_parsed_bytes, 0)
+        self.assertGreater(scan_progress.elapsed_time, 0)
+
+        for permission_level, file_path in core.shares.shared_file_list_paths.items():
+            shared_file_list = core.shares.compressed_shares[permission_level]
+            parsed_shared_file_list = SharedFileListResponse()
+            parsed_shared_file_list.parse_network_message(shared_file_list.make_network_message())
+
+            # Compressed lists are kept on disk instead of in memory
+            self.assertIsNone(shared_file_list.built)
+            self.assertEqual(shared_file_list.file_path, file_path)
+
+            with open(file_path, "rb") as file_handle:
+                self.assertEqual(shared_file_list.make_network_message(), file_handle.read())
+
+            self.assertIn("Shares", [folder_path for folder_path, _files in parsed_shared_file_list.list])
+
+    def test_shares_scan_stats(self):
+        """Test that statistics stored for each share match the compressed
+        lists of shared files."""
+
+        self.assertIn("Shares", dict(core.shares.share_dbs["public_stats"].items()))
+        self.assertIn("Secrets", dict(core.shares.share_dbs["buddy_stats"].items()))
+        self.assertIn("Trusted", dict(core.shares.share_dbs["trusted_stats"].items()))
+
+        for permission_level, shared_file_list in core.shares.compressed_shares.items():
+            parsed_shared_file_list = SharedFileListResponse()
+            parsed_shared_file_list.parse_network_message(shared_file_list.make_network_message())
+            folders = parsed_shared_file_list.list + parsed_shared_file_list.privatelist
+            files = [file_info for _folder_path, folder_files in folders for file_info in folder_files]
+            share_stats = core.shares.get_share_stats(permission_level)
+
+            self.assertEqual(share_stats["dirs"], len(folders))
+            self.assertEqual(share_stats["files"], len(files))
+            self.assertEqual(share_stats["shared_size"], sum(file_info[2] for file_info in files))
+            self.assertEqual(sum(share_stats["file_extensions"].values()), len(files))
+
+        trusted_stats = core.shares.get_share_stats("trusted")
+
+        self.assertEqual(trusted_stats["file_extensions"]["wav"], 3)
+        self.assertGreater(trusted_stats["duration"], 0)
+
+    def test_word_filter(self):
+        """Test that the word filter contains all words in the word index,
+        and rejects most other words."""
+
+        word_filter = core.shares.share_dbs["word_filter"]
+        words = list(core.shares.share_dbs["words"])
+
+        self.assertGreater(len(words), 0)
+
+        for word in words:
+            self.assertIn(word, word_filter)
+
+        num_false_positives = sum(f"missing{i}" in word_filter for i in range(1000))
+        self.assertLess(num_false_positives, 50)
+
+        # New words are only added in memory
+        word_filter.add("missingword")
+        self.assertIn("missingword", word_filter)
+
+        reloaded_word_filter = WordFilter(core.shares.share_db_paths["word_filter"], overwrite=False)
+        self.assertNotIn("missingword", reloaded_word_filter)
+        reloaded_word_filter.close()
+
+    def test_word_normalizer(self):
+        """Test that words are normalized the same way regardless of case,
+        diacritics and compatibility characters, and that word indices of
+        a different normalizer are rejected."""
+
+        word_normalizer = WordNormalizer()
+
+        self.assertEqual(word_normalizer.get_words("Beyoncé - Déjà Vu.FLAC"), ["beyonce", "deja", "vu", "flac"])
+        self.assertEqual(word_normalizer.get_words("Straße Øresund ｆｕｌｌｗｉｄｔｈ"), ["strasse", "oresund", "fullwidth"])
+        self.assertEqual(word_normalizer.get_words("Ёлка 한국어 हिन्दी"), ["елка", "한국어", "हिन्दी"])
+        self.assertEqual(WordNormalizer(transliterations={}).get_words("Straße"), ["straße"])
+
+        db_path = os.path.join(DATA_FOLDER_PATH, "test_words.dbn")
+        word_index = WordIndexDatabase(db_path)
+        word_index["beyonce"] = [1, 2]
+        word_index.close()
+
+        with patch.object(WordIndexDatabase, "word_normalizer", WordNormalizer(version=2)):
+            with self.assertRaises(DatabaseError):
+                WordIndexDatabase(db_path, overwrite=False)
+
+        word_index = WordIndexDatabase(db_path, overwrite=False)
+        self.assertEqual(list(word_index["beyonce"]), [1, 2])
+        word_index.close()
+        os.remove(db_path)
+
+    def test_database_footer(self):
+        """Test that keys are looked up in the hash table stored at the end
+        of a database file, and that patches are only kept in memory."""
+
+        db_path = os.path.join(DATA_FOLDER_PATH, "test_database.dbn")
+        items = {f"folder{i}\\file{i}.mp3": [i, "ä" * (i % 5)] for i in range(500)}
+
+        share_db = Database(db_path)
+        share_db.update(items)
+        share_db.close()
+
+        share_db = Database(db_path, overwrite=False)
+
+        self.assertEqual(len(share_db), len(items))
+        self.assertEqual(list(share_db), list(items))
+        self.assertEqual(share_db["folder42\\file42.mp3"], [42, "ää"])
+        self.assertNotIn("folder42\\file43.mp3", share_db)
+        self.assertIsNone(share_db.get("missing"))
+
+        with self.assertRaises(KeyError):
+            _value = share_db["missing"]
+
+        share_db["folder42\\file42.mp3"] = [0, ""]
+        share_db["new"] = [1, ""]
+        del share_db["folder1\\file1.mp3"]
+
+        self.assertEqual(len(share_db), len(items))
+        self.assertEqual(share_db["folder42\\file42.mp3"], [0, ""])
+        self.assertNotIn("folder1\\file1.mp3", share_db)
+        self.assertEqual(list(share_db)[-1], "new")
+        share_db.close()
+
+        share_db = Database(db_path, overwrite=False)
+        self.assertEqual(share_db["folder42\\file42.mp3"], [42, "ää"])
+        self.assertNotIn("new", share_db)
+        share_db.close()
+
+        # Files without a complete hash table are rejected
+        with open(db_path, "r+b") as file_handle:
+            file_handle.truncate(os.path.getsize(db_path) - 1)
+
+        with self.assertRaises(DatabaseError):
+            Database(db_path, overwrite=False)
+
+        os.remove(db_path)
+
+    def test_file_database_records(self):
+        """Test that file metadata survives being packed into fixed-size
+        records, including missing fields."""
+
+        db_path = os.path.join(DATA_FOLDER_PATH, "test_file_database.dbn")
+        items = {
+            "a": ["Shares\\a.flac", 2 ** 40, (None, 0, 44100, 24), 0],
+            "b": ["Shares\\b.mp3", 12345, (320, 1, 48000, None), 215],
+            "c": ["Shares\\ö.txt", 0, None, None]
+        }
+
+        share_db = FileDatabase(db_path)
+        share_db.update(items)
+        share_db.close()
+
+        share_db = FileDatabase(db_path, overwrite=False)
+        self.assertEqual({key: share_db[key] for key in share_db}, items)
+
+        # Packed file info is stored along with the metadata
+        for key, fileinfo in items.items():
+            self.assertEqual(share_db[key].packed, FileListMessage.pack_file_info(fileinfo))
+
+        # Changing the metadata invalidates the packed file info
+        fileinfo = share_db["b"]
+        fileinfo[0] = "Shares\\renamed.mp3"
+
+        self.assertIsNone(fileinfo.packed)
+        self.assertEqual(
+            FileListMessage.pack_file_info(fileinfo), FileListMessage.pack_file_info(list(fileinfo)))
+        share_db.close()
+
+        os.remove(db_path)
+
     def test_hidden_file_folder_scan(self):
         """Test that hidden files and folders are excluded."""
 
@@ -211,3 +449,488 @@ class SharesTest(TestCase):
         self.assertNotIn(os.path.join(TRUSTED_SHARES_FOLDER_PATH, ".hidden_folder", "nothing"), trusted_files)
         self.assertIn(os.path.join(TRUSTED_SHARES_FOLDER_PATH, "dummy_file3"), trusted_files)
         self.assertEqual(len(trusted_files), 3)
+
+    def test_shares_scan_workers(self):
+        """Test that reading metadata in worker processes results in the same
+        shares as a serial scan."""
+
+        serial_share_dbs = read_share_dbs()
+        serial_file_path_index = list(core.shares.file_path_index)
+
+        config.sections["transfers"]["scanner_workers"] = 2
+        self.rescan_shares(rebuild=True)
+
+        self.assertEqual(read_share_dbs(), serial_share_dbs)
+        self.assertEqual(list(core.shares.file_path_index), serial_file_path_index)
+
+    def test_shares_scan_memory_limit(self):
+        """Test that flushing scanned folders and merging runs of the word
+        index results in the same shares as a scan kept in memory."""
+
+        share_dbs = read_share_dbs()
+        core.shares.close_shares(core.shares.share_dbs)
+
+        scanner = Scanner(
+            Mock(), core.shares.get_shared_folders(), core.shares.share_db_paths, core.shares.shared_file_list_paths,
+            rebuild=True, incremental_rescan=config.sections["transfers"]["incremental_rescan"],
+            file_hash_db_path=core.shares.file_hash_db_path, memory_limit=1
+        )
+        scanner.run()
+        self.addCleanup(os.remove, core.shares.file_hash_db_path)
+
+        core.shares.replace_share_dbs()
+        core.shares.remove_old_share_dbs()
+        core.shares.replace_shared_file_lists()
+        core.shares.load_shares(core.shares.share_dbs, core.shares.share_db_paths)
+        core.shares.file_path_index = core.shares.share_dbs["file_paths"]
+
+        self.assertEqual(read_share_dbs(), share_dbs)
+        self.assertFalse([path for path in os.listdir(DATA_FOLDER_PATH) if ".run" in path or path.endswith(".tmp")])
+
+        # File hashes written to disk while scanning are saved
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        content_hash = Scanner.get_content_hash(file_path, os.path.getsize(file_path))
+        file_hashes = Database(core.shares.file_hash_db_path, overwrite=False)
+        self.addCleanup(file_hashes.close)
+
+        self.assertEqual(file_hashes[content_hash], [(706, 0, 44100, 16), 1])
+
+    def test_shares_rescan_swap(self):
+        """Test that databases in use are kept while rescanning, and replaced
+        by new databases once the scan is complete."""
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        new_file_path = os.path.join(SHARES_FOLDER_PATH, "new_file")
+        public_files = core.shares.share_dbs["public_files"]
+        shared_file_list = core.shares.compressed_shares[PermissionLevel.PUBLIC]
+
+        with open(new_file_path, "wb"):
+            self.addCleanup(os.remove, new_file_path)
+
+        core.shares.rescanning = False
+        core.shares.rescan_shares(use_thread=False)
+
+        # Previous databases are still used while rescanning
+        self.assertTrue(core.shares.rescanning)
+        self.assertTrue(core.shares.is_ready())
+        self.assertIs(core.shares.share_dbs["public_files"], public_files)
+        self.assertIn(file_path, public_files)
+        self.assertNotIn(new_file_path, public_files)
+        self.assertIn(file_path, list(core.shares.file_path_index))
+        self.assertIs(core.shares.compressed_shares[PermissionLevel.PUBLIC], shared_file_list)
+
+        with patch("pynicotine.shares.Shares.send_num_shared_folders_files"):
+            events.emit("shares-ready", True)
+
+        self.assertFalse(core.shares.rescanning)
+        self.assertIsNot(core.shares.compressed_shares[PermissionLevel.PUBLIC], shared_file_list)
+        self.assertIn(new_file_path, core.shares.share_dbs["public_files"])
+        self.assertIn(new_file_path, list(core.shares.file_path_index))
+        self.assertFalse([path for path in os.listdir(DATA_FOLDER_PATH) if path.endswith(".new")])
+
+    def test_shares_rescan_failure(self):
+        """Test that databases in use are kept when a rescan fails, and that
+        shared folders are still watched."""
+
+        public_files = core.shares.share_dbs["public_files"]
+
+        core.shares.rescanning = False
+        core.shares.rescan_shares(use_thread=False)
+
+        with patch("pynicotine.shares.Shares._start_share_watcher") as start_share_watcher:
+            events.emit("shares-ready", False)
+
+        start_share_watcher.assert_called_once_with()
+        self.assertFalse(core.shares.rescanning)
+        self.assertIs(core.shares.share_dbs["public_files"], public_files)
+        self.assertFalse([path for path in os.listdir(DATA_FOLDER_PATH) if path.endswith(".new")])
+
+    def test_shares_rescan_watcher_changes(self):
+        """Test that changes reported by the share watcher while rescanning
+        are applied once new databases replace the ones in use."""
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+
+        core.shares.rescanning = False
+        core.shares.rescan_shares(use_thread=False)
+
+        with patch("pynicotine.shares.Shares.send_num_shared_folders_files"):
+            core.shares.update_shared_folders([(SHARES_FOLDER_PATH, [], {"audiofile.wav"})], [])
+            self.assertIn(file_path, core.shares.share_dbs["public_files"])
+
+            events.emit("shares-ready", True)
+
+        self.assertFalse(core.shares.rescanning)
+        self.assertNotIn(file_path, core.shares.share_dbs["public_files"])
+        self.assertFalse(core.shares._pending_share_changes)  # pylint: disable=protected-access
+
+    def test_shares_rescan_swap_failure(self):
+        """Test that previous databases are restored and loaded again if new
+        databases cannot replace them."""
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        new_file_path = os.path.join(SHARES_FOLDER_PATH, "new_file")
+        replace = os.replace
+
+        with open(new_file_path, "wb"):
+            self.addCleanup(os.remove, new_file_path)
+
+        def replace_except_public_files(src, dst):
+            if src.endswith(b"publicfiles.dbn.new"):
+                raise PermissionError("Access denied")
+
+            replace(src, dst)
+
+        core.shares.rescanning = False
+        core.shares.rescan_shares(use_thread=False)
+
+        with patch("pynicotine.shares.os.replace", side_effect=replace_except_public_files), \
+                patch("pynicotine.shares.Shares.send_num_shared_folders_files") as send_num_shared_folders_files:
+            events.emit("shares-ready", True)
+
+        send_num_shared_folders_files.assert_not_called()
+        self.assertFalse(core.shares.rescanning)
+        self.assertIn(file_path, core.shares.share_dbs["public_files"])
+        self.assertNotIn(new_file_path, core.shares.share_dbs["public_files"])
+        self.assertNotIn(new_file_path, core.shares.share_dbs["buddy_files"])
+        self.assertNotIn(new_file_path, list(core.shares.file_path_index))
+        self.assertFalse(
+            [path for path in os.listdir(DATA_FOLDER_PATH) if path.endswith((".dbn.new", ".dbn.old"))])
+
+    def test_shares_rescan_startup(self):
+        """Test that databases of the previous scan are loaded and used while
+        rescanning on startup."""
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        new_file_path = os.path.join(SHARES_FOLDER_PATH, "new_file")
+
+        with open(new_file_path, "wb"):
+            self.addCleanup(os.remove, new_file_path)
+
+        core.shares.close_shares(core.shares.share_dbs)
+        core.shares.file_path_index = ()
+        core.shares.rescanning = False
+        core.shares.rescan_shares(init=True, rescan=True, use_thread=False)
+
+        self.assertTrue(core.shares.initialized)
+        self.assertTrue(core.shares.rescanning)
+        self.assertTrue(core.shares.is_ready())
+        self.assertIn(file_path, core.shares.share_dbs["public_files"])
+        self.assertNotIn(new_file_path, core.shares.share_dbs["public_files"])
+        self.assertIn("audiofile", core.shares.share_dbs["words"])
+        self.assertIn(file_path, list(core.shares.file_path_index))
+
+        with patch("pynicotine.shares.Shares.send_num_shared_folders_files"):
+            events.emit("shares-ready", True)
+
+        self.assertFalse(core.shares.rescanning)
+        self.assertIn(new_file_path, core.shares.share_dbs["public_files"])
+        self.assertIn(new_file_path, list(core.shares.file_path_index))
+
+    def test_shares_incremental_rescan(self):
+        """Test that unchanged folders are reused, and changed folders are
+        scanned again, when rescanning incrementally."""
+
+        config.sections["transfers"]["incremental_rescan"] = True
+        self.rescan_shares()
+
+        public_folders = core.shares.share_dbs["public_folders"]
+        folder_mtime, virtual_folder_path, subfolder_names, file_names = public_folders[SHARES_FOLDER_PATH]
+
+        self.assertEqual(folder_mtime, os.stat(SHARES_FOLDER_PATH).st_mtime)
+        self.assertEqual(virtual_folder_path, "Shares")
+        self.assertEqual(set(subfolder_names), {"folder1", "folder2", "something"})
+        self.assertEqual(set(file_names), {"audiofile.wav", "dummy_file"})
+
+        streams = {key: core.shares.share_dbs["public_streams"][key] for key in core.shares.share_dbs["public_streams"]}
+
+        # Add a file to a folder, only this folder's stream should change
+        new_file_path = os.path.join(SHARES_FOLDER_PATH, "folder1", "new_file")
+
+        with open(new_file_path, "wb"):
+            self.addCleanup(os.remove, new_file_path)
+
+        self.rescan_shares()
+
+        new_streams = core.shares.share_dbs["public_streams"]
+
+        self.assertIn(new_file_path, core.shares.share_dbs["public_files"])
+        self.assertIn("new_file", core.shares.share_dbs["public_folders"][os.path.dirname(new_file_path)][3])
+        self.assertNotEqual(new_streams["Shares\\folder1"], streams["Shares\\folder1"])
+        self.assertEqual(
+            {key: new_streams[key] for key in new_streams if key != "Shares\\folder1"},
+            {key: value for key, value in streams.items() if key != "Shares\\folder1"}
+        )
+
+    def test_shares_file_hashes(self):
+        """Test that metadata of files is cached by their contents, and reused
+        when rebuilding shares."""
+
+        config.sections["transfers"]["hash_shared_files"] = True
+        self.rescan_shares(rebuild=True)
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        content_hash = Scanner.get_content_hash(file_path, os.path.getsize(file_path))
+        file_hashes = Database(core.shares.file_hash_db_path, overwrite=False)
+        cached_file_hashes = {key: file_hashes[key] for key in file_hashes}
+        file_hashes.close()
+
+        self.assertEqual(cached_file_hashes[content_hash], [(706, 0, 44100, 16), 1])
+
+        # Cached metadata is used instead of reading it from the file again
+        cached_file_hashes[content_hash] = [(320, 1, 48000, None), 2]
+        num_file_hashes = len(cached_file_hashes)
+
+        # Entries of files no longer shared are dropped once there are too many
+        stale_file_hashes = {f"stale{i}": [None, None] for i in range(1000)}
+
+        file_hashes = Database(core.shares.file_hash_db_path)
+        file_hashes.update(cached_file_hashes)
+        file_hashes.update(stale_file_hashes)
+        file_hashes.close()
+
+        config.sections["transfers"]["scanner_workers"] = 2
+        self.rescan_shares(rebuild=True)
+
+        self.assertEqual(
+            ["Shares\\audiofile.wav", 100044, (320, 1, 48000, None), 2],
+            core.shares.share_dbs["public_files"][file_path]
+        )
+
+        file_hashes = Database(core.shares.file_hash_db_path, overwrite=False)
+        cached_file_hashes = {key: file_hashes[key] for key in file_hashes}
+        file_hashes.close()
+
+        self.assertEqual(cached_file_hashes[content_hash], [(320, 1, 48000, None), 2])
+        self.assertLessEqual(len(cached_file_hashes), len(core.shares.share_dbs["file_paths"]) * 2)
+        self.assertGreater(len(cached_file_hashes), num_file_hashes)
+
+        config.sections["transfers"]["scanner_workers"] = 1
+        config.sections["transfers"]["hash_shared_files"] = False
+        os.remove(core.shares.file_hash_db_path)
+
+    @skipUnless(sys.platform != "win32", "niceness is only used on Unix-like systems")
+    def test_shares_lower_process_priority(self):
+        """Test that lowering the priority of a process again, e.g. in a worker
+        started by the scanner, keeps the same niceness."""
+
+        niceness = {"value": 0}
+
+        def setpriority(_which, _who, value):
+            niceness["value"] = value
+
+        # I/O priority of the test process is left unchanged
+        with patch.dict(Scanner.IOPRIO_SET_SYSCALLS, clear=True), \
+                patch("pynicotine.shares.os.getpriority", side_effect=lambda *_args: niceness["value"]), \
+                patch("pynicotine.shares.os.setpriority", side_effect=setpriority):
+            Scanner.lower_process_priority()
+            Scanner.lower_process_priority()
+
+        self.assertEqual(niceness["value"], Scanner.LOW_PRIORITY_NICENESS)
+
+    def test_shares_file_hashes_fill(self):
+        """Test that files shared before file hashes were enabled are hashed
+        without rebuilding shares, and that files without metadata are not
+        hashed."""
+
+        config.sections["transfers"]["hash_shared_files"] = True
+        self.rescan_shares()
+
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        content_hash = Scanner.get_content_hash(file_path, os.path.getsize(file_path))
+        file_hashes = Database(core.shares.file_hash_db_path, overwrite=False)
+        cached_file_hashes = {key: file_hashes[key] for key in file_hashes}
+        file_hashes.close()
+
+        self.assertEqual(cached_file_hashes[content_hash], [(706, 0, 44100, 16), 1])
+        self.assertEqual(len(cached_file_hashes), len(AUDIO_FILES))
+
+        config.sections["transfers"]["hash_shared_files"] = False
+        os.remove(core.shares.file_hash_db_path)
+
+    def test_shares_scan_budget(self):
+        """Test that scans complete at a lower priority with read limits, and
+        that the budget delays reads exceeding it."""
+
+        config.sections["transfers"]["scanner_low_priority"] = True
+        config.sections["transfers"]["scanner_max_read_speed"] = 100000
+        config.sections["transfers"]["scanner_max_files_per_second"] = 10000
+        self.rescan_shares(rebuild=True)
+
+        self.assertIn(os.path.join(SHARES_FOLDER_PATH, "audiofile.wav"), core.shares.share_dbs["public_files"])
+
+        config.sections["transfers"]["scanner_low_priority"] = False
+        config.sections["transfers"]["scanner_max_read_speed"] = 0
+        config.sections["transfers"]["scanner_max_files_per_second"] = 0
+
+        budget = ScannerBudget(max_bytes_per_second=1000, max_files_per_second=10)
+
+        with patch("pynicotine.shares.time.sleep") as sleep:
+            budget.consume(num_bytes=500)
+            self.assertGreater(sleep.call_args.args[0], 0.4)
+
+            budget.consume(num_files=10)
+            self.assertGreater(sleep.call_args.args[0], 0.9)
+
+    def test_shares_update_shared_file_lists(self):
+        """Test that lists of shared files are rebuilt after the share watcher
+        removes a folder, and match the updated statistics."""
+
+        core.shares.rescanning = False
+        folder_path = os.path.join(SHARES_FOLDER_PATH, "folder1")
+        file_names = {
+            os.path.basename(file_path) for file_path, _file_data in core.shares.share_dbs["public_files"].items()
+            if os.path.dirname(file_path) == folder_path
+        }
+        shared_file_list = core.shares.get_shared_file_list(PermissionLevel.PUBLIC)
+
+        with patch.object(core.shares.__class__, "send_num_shared_folders_files"):
+            core.shares.update_shared_folders([], [(folder_path, file_names)])
+
+        self.assertIsNot(core.shares.get_shared_file_list(PermissionLevel.PUBLIC), shared_file_list)
+
+        for permission_level in (PermissionLevel.PUBLIC, PermissionLevel.BUDDY, PermissionLevel.TRUSTED):
+            parsed_shared_file_list = SharedFileListResponse()
+            parsed_shared_file_list.parse_network_message(
+                core.shares.get_shared_file_list(permission_level).make_network_message())
+            folders = parsed_shared_file_list.list + parsed_shared_file_list.privatelist
+            files = [file_info for _folder_path, folder_files in folders for file_info in folder_files]
+            share_stats = core.shares.get_share_stats(permission_level)
+
+            self.assertNotIn("Shares\\folder1", [path for path, _files in folders])
+            self.assertEqual(share_stats["dirs"], len(folders))
+            self.assertEqual(share_stats["files"], len(files))
+            self.assertEqual(share_stats["shared_size"], sum(file_info[2] for file_info in files))
+
+    def test_shares_update_readded_file(self):
+        """Test that a shared file removed and added again without rescanning
+        is only found once in the word index."""
+
+        core.shares.rescanning = False
+        file_path = os.path.join(SHARES_FOLDER_PATH, "audiofile.wav")
+        file_data = core.shares.share_dbs["public_files"][file_path]
+        stored_file_index = list(core.shares.file_path_index).index(file_path)
+        num_file_paths = len(core.shares.file_path_index)
+
+        with patch.object(core.shares.__class__, "send_num_shared_folders_files"):
+            for _ in range(2):
+                core.shares.update_shared_folders([(SHARES_FOLDER_PATH, [], {"audiofile.wav"})], [])
+                core.shares.update_shared_folders(
+                    [(SHARES_FOLDER_PATH, [("audiofile.wav", file_data[:], None)], set())], [])
+
+        file_path_index = core.shares.file_path_index
+        found_file_paths = [
+            file_path_index[file_index]
+            for file_indices in core.shares.share_dbs["words"].get_index_lists("audiofile")
+            for file_index in file_indices
+        ]
+
+        self.assertEqual(len(file_path_index), num_file_paths + 1)
+        self.assertIsNone(file_path_index[stored_file_index])
+        self.assertEqual([path for path in found_file_paths if path is not None], [file_path])
+        self.assertIn(file_path, core.shares.share_dbs["public_files"])
+
+    def test_share_watcher_watch_error(self):
+        """Test that failing to watch shared folders is only reported once."""
+
+        share_watcher = ShareWatcher(core.shares.get_shared_folders(), callback=None)
+        watch_error = OSError(28, "No space left on device")
+
+        with patch.object(ShareWatcher, "_add_watch", side_effect=watch_error), \
+                patch("pynicotine.logfacility.Logger.add") as log_add:
+            for shared_folder_paths in share_watcher.share_groups:
+                for _virtual_name, folder_path, *_unused in shared_folder_paths:
+                    share_watcher._watch_folder_tree(folder_path)  # pylint: disable=protected-access
+
+        log_add.assert_called_once()
+        self.assertIn(SHARES_FOLDER_PATH, log_add.call_args.args[1].values())
+
+    @skipUnless(sys.platform == "linux", "inotify is only available on Linux")
+    def test_share_watcher(self):
+        """Test that added, renamed and removed files are applied to the share
+        databases without rescanning."""
+
+        core.shares.rescanning = False
+        changes = []
+        share_stats = core.shares.get_share_stats("public")
+        share_watcher = ShareWatcher(
+            core.shares.get_shared_folders(), callback=lambda *args: changes.append(args), delay=0.1)
+
+        def wait_for_changes():
+            for _ in range(50):
+                time.sleep(0.1)
+
+                if changes:
+                    break
+
+            core.shares.update_shared_folders(*changes.pop())
+
+        with patch.object(core.shares.__class__, "send_num_shared_folders_files"):
+            share_watcher.start()
+            self.addCleanup(share_watcher.stop)
+            time.sleep(0.2)
+
+            # Add file
+            new_file_path = os.path.join(SHARES_FOLDER_PATH, "folder1", "watched_file")
+
+            with open(new_file_path, "wb") as file_handle:
+                file_handle.write(b"test")
+
+            renamed_file_path = os.path.join(SHARES_FOLDER_PATH, "folder1", "renamed_file")
+
+            def remove_test_files():
+                for file_path in (new_file_path, renamed_file_path):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+
+            self.addCleanup(remove_test_files)
+
+            wait_for_changes()
+            file_index = list(core.shares.file_path_index).index(new_file_path)
+
+            self.assertEqual(
+                core.shares.share_dbs["public_files"][new_file_path], ["Shares\\folder1\\watched_file", 4, None, None]
+            )
+            word_index = core.shares.share_dbs["words"]
+            stored_indices, appended_indices = word_index.get_index_lists("folder1")
+
+            # Stored file indices of existing words are not copied
+            self.assertIsInstance(stored_indices, memoryview)
+            self.assertNotIn(file_index, stored_indices)
+            self.assertEqual(list(appended_indices), [file_index])
+            self.assertIn("watched", word_index)
+            self.assertIn("watched", list(word_index))
+            self.assertEqual([list(indices) for indices in word_index.get_index_lists("watched")], [[file_index]])
+            self.assertIn("watched", core.shares.share_dbs["word_suffixes"].iter_words_ending_with("tched"))
+            self.assertIn(b"watched_file", core.shares.share_dbs["public_streams"]["Shares\\folder1"])
+
+            # Statistics of the share are updated
+            updated_share_stats = core.shares.get_share_stats("public")
+
+            self.assertEqual(updated_share_stats["dirs"], share_stats["dirs"])
+            self.assertEqual(updated_share_stats["files"], share_stats["files"] + 1)
+            self.assertEqual(updated_share_stats["shared_size"], share_stats["shared_size"] + 4)
+            self.assertEqual(
+                updated_share_stats["file_extensions"][""], share_stats["file_extensions"].get("", 0) + 1)
+
+            # Rename file
+            os.rename(new_file_path, renamed_file_path)
+
+            wait_for_changes()
+
+            self.assertNotIn(new_file_path, core.shares.share_dbs["public_files"])
+            self.assertEqual(
+                core.shares.share_dbs["public_files"][renamed_file_path],
+                ["Shares\\folder1\\renamed_file", 4, None, None]
+            )
+            self.assertNotIn(b"watched_file", core.shares.share_dbs["public_streams"]["Shares\\folder1"])
+            self.assertIn(b"renamed_file", core.shares.share_dbs["public_streams"]["Shares\\folder1"])
+            self.assertEqual(core.shares.get_share_stats("public"), updated_share_stats)
+
+            # Remove file
+            os.remove(renamed_file_path)
+
+            wait_for_changes()
+
+            self.assertNotIn(renamed_file_path, core.shares.share_dbs["public_files"])
+            self.assertEqual(core.shares.get_share_stats("public"), share_stats)
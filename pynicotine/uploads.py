@@ -251,7 +251,7 @@ class Uploads(Transfers):
 
     def is_new_upload_accepted(self, enforce_limits=True):
 
-        if core.shares is None or core.shares.rescanning:
+        if core.shares is None or not core.shares.is_ready():
             return False
 
         if not enforce_limits:
@@ -446,7 +446,8 @@ class Uploads(Transfers):
 
             return False, reject_message, size
 
-        if core.shares.rescanning:
+        if not core.shares.is_ready():
+            # Wait until shares are loaded
             self._pending_network_msgs.append(msg)
             return False, None, size
 
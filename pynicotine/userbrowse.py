@@ -123,19 +123,33 @@ class UserBrowse:
             core.setup()
             return
 
-        if username not in self.users or new_request:
+        share_stats = None
+        parse_shares = (username not in self.users or new_request)
+
+        if parse_shares:
             if not permission_level:
                 # Check our own permission level, and show relevant shares for it
                 current_permission_level, _reason = core.shares.check_user_permission(username)
             else:
                 current_permission_level = permission_level
 
-            msg = core.shares.compressed_shares.get(current_permission_level)
+            msg = core.shares.get_shared_file_list(current_permission_level)
+            share_stats = core.shares.get_share_stats(current_permission_level)
             Thread(
                 target=self._parse_local_shares, args=(username, msg), name="LocalShareParser", daemon=True
             ).start()
 
         self._show_user(username, path=path, new_request=new_request, switch_page=switch_page)
+
+        if parse_shares:
+            # Statistics stored while scanning are available before the list of shares is parsed
+            browsed_user = self.users[username]
+            browsed_user.num_folders = browsed_user.num_files = browsed_user.shared_size = None
+
+            if share_stats is not None:
+                browsed_user.num_folders = share_stats["dirs"]
+                browsed_user.num_files = share_stats["files"]
+                browsed_user.shared_size = share_stats["shared_size"]
         core.users.watch_user(username, context="userbrowse")
 
     def request_user_shares(self, username):
@@ -380,15 +394,23 @@ class UserBrowse:
 
         username = msg.username
         browsed_user = self.users.get(username)
-        num_folders = len(msg.list) + len(msg.privatelist)
-        num_files = 0
-        shared_size = 0
+        local_username = core.users.login_username or config.sections["server"]["login"]
 
-        for _folder_path, files in chain(msg.list, msg.privatelist):
-            for file_info in files:
-                shared_size += file_info[2]
+        if browsed_user is not None and username == local_username and browsed_user.num_files is not None:
+            # Our own shares, statistics were stored while scanning
+            num_folders = browsed_user.num_folders
+            num_files = browsed_user.num_files
+            shared_size = browsed_user.shared_size
+        else:
+            num_folders = len(msg.list) + len(msg.privatelist)
+            num_files = 0
+            shared_size = 0
+
+            for _folder_path, files in chain(msg.list, msg.privatelist):
+                for file_info in files:
+                    shared_size += file_info[2]
 
-            num_files += len(files)
+                num_files += len(files)
 
         if browsed_user is not None:
             browsed_user.public_folders = dict(msg.list)